@@ -8,10 +8,30 @@ function initOrdersPage() {
     const form = document.getElementById("orderForm");
     if (!form) return;
 
+    // First load: /me and /orders arrive in one round trip through the gateway's /batch endpoint
+    const initialBatch = fetch("/batch", {
+        method: "POST",
+        credentials: "include",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ requests: [{ id: "me", path: "/me" }, { id: "orders", path: "/orders" }] })
+    }).then(res => res.ok ? res.json() : null).catch(() => null);
+    const usedBatchItems = new Set();
+
+    // Returns a fetch-like response, from the initial batch the first time an item is requested
+    async function getJson(id, path) {
+        if (!usedBatchItems.has(id)) {
+            usedBatchItems.add(id);
+            const batch = await initialBatch;
+            const item = batch && batch.responses.find(r => r.id === id);
+            if (item) return { ok: item.status < 400, json: async () => item.body };
+        }
+        return fetch(path, { credentials: "include" });
+    }
+
     // Check user role & verification
     async function checkRole() {
         try {
-            const res = await fetch("/me", { credentials: "include" });
+            const res = await getJson("me", "/me");
             if (res.ok) {
                 const user = await res.json();
                 const vMsg = document.getElementById("verificationMessage");
@@ -143,7 +163,7 @@ function initOrdersPage() {
 
     // Orders List Logic
     async function loadOrders() {
-        const res = await fetch("/orders", { credentials: "include" });
+        const res = await getJson("orders", "/orders");
         const data = await res.json();
         const orders = data.orders || [];
         const list = document.getElementById("ordersList");
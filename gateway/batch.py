@@ -0,0 +1,126 @@
+import os
+import json
+import asyncio
+import httpx
+from fastapi.middleware.asyncexitstack import AsyncExitStackMiddleware
+from starlette.middleware.exceptions import ExceptionMiddleware
+from .ratelimit import format_duration
+from services.common import deadline
+from services.common.deadline import DEADLINE_HEADER
+
+BATCH_MAX_ITEMS = int(os.getenv("GATEWAY_BATCH_MAX_ITEMS", "10"))
+ALLOWED_METHODS = {"GET", "POST", "DELETE"}
+
+# Outer request headers that must not leak into sub-requests (they describe the batch body)
+_SKIP_HEADERS = {"host", "content-length", "content-type", "transfer-encoding", "accept-encoding", DEADLINE_HEADER.lower()}
+
+
+class BatchError(ValueError):
+    pass
+
+
+def validate_items(payload) -> list:
+    """Normalise {"requests": [{"id", "method", "path", "form"|"json", "depends_on"}]} or raise BatchError."""
+    items = payload.get("requests") if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BatchError("Body must be {\"requests\": [...]}")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise BatchError(f"At most {BATCH_MAX_ITEMS} requests per batch")
+    seen = set()
+    normalised = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise BatchError(f"Request #{index} must be an object")
+        item_id = str(item.get("id", index))
+        method = str(item.get("method", "GET")).upper()
+        path = item.get("path")
+        depends_on = item.get("depends_on") or []
+        if item_id in seen:
+            raise BatchError(f"Duplicate id '{item_id}'")
+        if method not in ALLOWED_METHODS:
+            raise BatchError(f"Method {method} is not allowed in a batch")
+        if not isinstance(path, str) or not path.startswith("/") or path.startswith("//"):
+            raise BatchError(f"Request '{item_id}' needs a path starting with '/'")
+        if path.split("?")[0].rstrip("/") == "/batch":
+            raise BatchError("Batches cannot be nested")
+        if not isinstance(depends_on, list) or any(str(d) not in seen for d in depends_on):
+            # Only earlier items can be referenced, which also rules out cycles
+            raise BatchError(f"Request '{item_id}' depends on an unknown or later request")
+        seen.add(item_id)
+        normalised.append({
+            "id": item_id,
+            "method": method,
+            "path": path,
+            "form": item.get("form"),
+            "json": item.get("json"),
+            "depends_on": [str(d) for d in depends_on],
+        })
+    return normalised
+
+
+class BatchDispatcher:
+    """Runs sub-requests through the gateway's own routes in-process.
+
+    Sub-requests enter below the gateway middleware, so each one is charged to `limiter` here
+    (a batch costs what its requests would cost separately) and runs within what is left of the
+    batch's deadline. Metrics count the batch once; every route keeps its own auth and proxy logic.
+    """
+
+    def __init__(self, app, limiter=None):
+        self.app = app
+        self.limiter = limiter
+        self._asgi = None
+
+    def _dispatch_app(self):
+        if self._asgi is None:
+            handlers = {key: value for key, value in self.app.exception_handlers.items() if key not in (500, Exception)}
+            inner = ExceptionMiddleware(AsyncExitStackMiddleware(self.app.router), handlers=handlers)
+
+            async def asgi(scope, receive, send):
+                scope["app"] = self.app
+                await inner(scope, receive, send)
+
+            self._asgi = asgi
+        return self._asgi
+
+    async def run(self, request, items: list):
+        """Returns (results in request order, Set-Cookie header values to forward)."""
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in _SKIP_HEADERS}
+        client_addr = (request.client.host, request.client.port) if request.client else ("127.0.0.1", 0)
+        limit_key = request.client.host if request.client else "unknown"  # same key as RateLimitMiddleware
+        # A crashing route becomes a 500 item instead of failing the whole batch
+        transport = httpx.ASGITransport(app=self._dispatch_app(), client=client_addr, raise_app_exceptions=False)
+        set_cookies = []
+        tasks = {}
+
+        async with httpx.AsyncClient(transport=transport, base_url=str(request.base_url).rstrip("/")) as client:
+            async def execute(item):
+                for dependency in item["depends_on"]:
+                    if (await tasks[dependency])["status"] >= 400:
+                        return {"id": item["id"], "status": 424, "body": {"detail": f"Dependency '{dependency}' failed"}}
+                if self.limiter is not None and not await self.limiter.check_request_async(limit_key):
+                    detail = f"Too many requests. You are blocked for {format_duration(self.limiter.block_seconds)}."
+                    return {"id": item["id"], "status": 429, "body": {"detail": detail}}
+                # The remaining budget of the batch, taken when the item starts
+                item_headers = {**headers, **deadline.outbound_headers()}
+                resp = await client.request(item["method"], item["path"], headers=item_headers, data=item["form"], json=item["json"])
+                set_cookies.extend(resp.headers.get_list("set-cookie"))
+                result = {"id": item["id"], "status": resp.status_code, "body": _decode_body(resp)}
+                if "location" in resp.headers:
+                    result["location"] = resp.headers["location"]
+                return result
+
+            # Independent items run concurrently; dependants wait on the tasks they name
+            for item in items:
+                tasks[item["id"]] = asyncio.ensure_future(execute(item))
+            results = await asyncio.gather(*tasks.values())
+        return list(results), set_cookies
+
+
+def _decode_body(resp: httpx.Response):
+    if "application/json" in resp.headers.get("content-type", ""):
+        try:
+            return json.loads(resp.content)
+        except ValueError:
+            pass
+    return resp.text
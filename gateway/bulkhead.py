@@ -0,0 +1,91 @@
+import os
+import math
+import asyncio
+import logging
+
+logger = logging.getLogger("Gateway")
+
+BULKHEAD_CONCURRENCY = int(os.getenv("GATEWAY_BULKHEAD_CONCURRENCY", "64"))
+BULKHEAD_QUEUE = int(os.getenv("GATEWAY_BULKHEAD_QUEUE", "128"))
+BULKHEAD_QUEUE_TIMEOUT = float(os.getenv("GATEWAY_BULKHEAD_QUEUE_TIMEOUT", "2"))
+# Per-service concurrency overrides, e.g. "ai=8,orders=100"
+BULKHEAD_LIMITS = os.getenv("GATEWAY_BULKHEAD_LIMITS", "ai=16")
+
+
+def parse_limits(value: str) -> dict:
+    limits = {}
+    for item in value.split(","):
+        name, sep, limit = item.partition("=")
+        if sep and name.strip():
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+class Bulkhead:
+    """At most `max_concurrent` in-flight calls to one service; up to `max_queue` more wait
+    for at most `queue_timeout` seconds, everything beyond that is shed immediately."""
+
+    def __init__(self, name: str, max_concurrent: int = BULKHEAD_CONCURRENCY, max_queue: int = BULKHEAD_QUEUE, queue_timeout: float = BULKHEAD_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.max_concurrent and not self.queued:
+            # Fast path: nobody is waiting, take a slot without yielding
+            await self._semaphore.acquire()
+        elif self.queued >= self.max_queue:
+            self.shed_queue_full += 1
+            logger.warning(f"Bulkhead '{self.name}' queue full ({self.queued}), request shed")
+            return False
+        else:
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed_timeout += 1
+                logger.warning(f"Bulkhead '{self.name}' wait exceeded {self.queue_timeout:g}s, request shed")
+                return False
+            finally:
+                self.queued -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+        }
+
+
+class Bulkheads:
+    def __init__(self, services, limits: dict = None):
+        limits = parse_limits(BULKHEAD_LIMITS) if limits is None else limits
+        self.bulkheads = {name: Bulkhead(name, limits.get(name, BULKHEAD_CONCURRENCY)) for name in services}
+
+    def get(self, name: str) -> Bulkhead:
+        return self.bulkheads[name]
+
+    def stats(self) -> dict:
+        return {name: bulkhead.stats() for name, bulkhead in self.bulkheads.items()}
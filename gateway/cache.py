@@ -0,0 +1,128 @@
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from starlette.responses import Response
+
+PAGE_CACHE_MAX_BYTES = int(os.getenv("GATEWAY_PAGE_CACHE_BYTES", str(8 * 1024 * 1024)))
+PAGE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("GATEWAY_PAGE_CACHE_ENTRY_BYTES", str(512 * 1024)))
+PAGE_CACHE_TTL = float(os.getenv("GATEWAY_PAGE_CACHE_TTL", "300"))
+
+# Rendered templates only differ by these request headers (the frontend sends the same Vary)
+VARY_HEADERS = ("X-SPA", "X-Requested-With")
+
+# Upstream headers that are recomputed or meaningless for a stored copy
+_SKIP_HEADERS = {b"content-length", b"content-encoding", b"transfer-encoding", b"connection", b"keep-alive", b"date", b"server", b"etag"}
+
+
+class CachedPage:
+    __slots__ = ("status_code", "raw_headers", "body", "etag", "expires_at")
+
+    def __init__(self, status_code, raw_headers, body, etag, expires_at):
+        self.status_code = status_code
+        self.raw_headers = raw_headers
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.raw_headers)
+
+
+def make_etag(body: bytes) -> str:
+    # Strong validator: changes whenever a single byte of the page does
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
+
+
+class PageCache:
+    """LRU cache of rendered frontend pages, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = PAGE_CACHE_MAX_BYTES, max_entry_bytes: int = PAGE_CACHE_MAX_ENTRY_BYTES, ttl: float = PAGE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def key(request) -> tuple:
+        return (request.url.path, request.url.query) + tuple(request.headers.get(h, "") for h in VARY_HEADERS)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        if entry is not None:
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, resp):
+        """Store an upstream httpx.Response whose body has been read. Returns the entry, or None if not cacheable."""
+        cache_control = resp.headers.get("cache-control", "").lower()
+        if resp.status_code != 200 or "set-cookie" in resp.headers or "no-store" in cache_control or "private" in cache_control:
+            return None
+        body = resp.content
+        raw_headers = [(k.lower(), v) for k, v in resp.headers.raw if k.lower() not in _SKIP_HEADERS]
+        entry = CachedPage(resp.status_code, raw_headers, body, make_etag(body), time.monotonic() + self.ttl)
+        if entry.size > self.max_entry_bytes:
+            return None
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes and self.entries:
+            self._remove(next(iter(self.entries)))
+        return entry
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+
+    def purge(self, path: str = None) -> int:
+        keys = [k for k in self.entries if path is None or k[0] == path]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def respond(self, entry: CachedPage, request) -> Response:
+        if etag_matches(request.headers.get("if-none-match", ""), entry.etag):
+            self.not_modified += 1
+            response = Response(status_code=304)
+        else:
+            response = Response(content=entry.body, status_code=entry.status_code)
+            response.raw_headers += entry.raw_headers
+        response.headers["ETag"] = entry.etag
+        # Browsers may keep the page but must revalidate, which costs a 304 from the gateway only
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["Vary"] = ", ".join(VARY_HEADERS)
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+page_cache = PageCache()
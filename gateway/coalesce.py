@@ -0,0 +1,52 @@
+import asyncio
+import httpx
+from .cache import VARY_HEADERS
+
+
+def coalesce_key(service: str, path: str, request, params=None, token: str = None) -> tuple:
+    """Requests with equal keys get byte-identical upstream responses.
+
+    The access token is part of the key, so users never receive each other's data.
+    """
+    query = tuple(sorted(httpx.QueryParams(params).multi_items())) if params else ()
+    variant = tuple(request.headers.get(h, "") for h in VARY_HEADERS)
+    return (service, path, query, variant, token or "")
+
+
+class SingleFlight:
+    """Shares one in-flight call between concurrent callers with the same key.
+
+    The call runs in its own task, so a disconnecting caller does not cancel it for the others.
+    Results are only shared while the call is in flight; nothing is cached afterwards.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        task = self.in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(func())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here too, in case every caller went away
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self.in_flight),
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
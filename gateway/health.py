@@ -0,0 +1,141 @@
+import os
+import time
+import asyncio
+import logging
+import httpx
+
+logger = logging.getLogger("Gateway")
+
+HEALTH_INTERVAL = float(os.getenv("GATEWAY_HEALTH_INTERVAL", "5"))
+HEALTH_TIMEOUT = float(os.getenv("GATEWAY_HEALTH_TIMEOUT", "2"))
+BREAKER_FAILURES = int(os.getenv("GATEWAY_BREAKER_FAILURES", "3"))
+BREAKER_RECOVERY = float(os.getenv("GATEWAY_BREAKER_RECOVERY", "10"))
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures; open -> half-open after
+    `recovery_timeout`, where a single probe decides between closed and open again."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, recovery_timeout: float = BREAKER_RECOVERY):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def can_accept(self) -> bool:
+        """Whether a request could be sent now (no side effects)."""
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self._probe_in_flight)
+
+    def allow_request(self) -> bool:
+        if not self.can_accept():
+            return False
+        if self._state == self.HALF_OPEN:
+            self._probe_in_flight = True
+        return True
+
+    def release_probe(self):
+        """The picked request ended without a verdict (never sent, or shed): let another probe go."""
+        self._probe_in_flight = False
+
+    def retry_after(self) -> int:
+        return max(1, int(self.recovery_timeout - (time.monotonic() - self.opened_at)))
+
+    def record_success(self):
+        if self._state != self.CLOSED:
+            logger.info(f"Circuit for '{self.name}' closed")
+        self.failures = 0
+        self._state = self.CLOSED
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                logger.warning(f"Circuit for '{self.name}' opened after {self.failures} failures")
+            self._state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+class HealthChecker:
+    """Polls /health on every upstream instance and feeds the results into its circuit breaker."""
+
+    def __init__(self, pool, interval: float = HEALTH_INTERVAL):
+        self.pool = pool
+        self.interval = interval
+        self.working = False
+        self._task = None
+
+    async def start(self):
+        self.working = True
+        self._task = asyncio.create_task(self._check_loop())
+        logger.info(f"HealthChecker started for {len(self.pool.instances)} services (every {self.interval:g}s)")
+
+    async def stop(self):
+        self.working = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        logger.info("HealthChecker stopped")
+
+    async def _check_loop(self):
+        while self.working:
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error(f"Error in health check loop: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def check_all(self):
+        await asyncio.gather(*(
+            self.check(instance)
+            for instances in self.pool.instances.values()
+            for instance in instances
+        ))
+
+    async def check(self, instance) -> bool:
+        healthy = False
+        try:
+            resp = await self.pool.client(instance.service).get(instance.url + "/health", timeout=HEALTH_TIMEOUT)
+            healthy = resp.status_code == 200
+        except httpx.HTTPError as e:
+            logger.debug(f"Health check for '{instance.service}' at {instance.url} failed: {e}")
+        instance.last_check = time.time()
+        if healthy:
+            instance.breaker.record_success()
+        else:
+            instance.breaker.record_failure()
+        return healthy
+
+    def status(self) -> dict:
+        result = {}
+        for name, instances in self.pool.instances.items():
+            states = [i.breaker.state for i in instances]
+            # A service is as healthy as its best instance
+            state = next((s for s in (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN) if s in states), CircuitBreaker.OPEN)
+            result[name] = {
+                "state": state,
+                "instances": [
+                    {"url": i.url, **i.breaker.snapshot(), "outstanding": i.outstanding, "last_check": i.last_check}
+                    for i in instances
+                ],
+            }
+        return result
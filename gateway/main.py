@@ -1,18 +1,32 @@
-from fastapi import FastAPI, Request, UploadFile, Form, Response
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, Request, UploadFile, Form, Response, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 
 
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import httpx
 import os
-from datetime import datetime
+import time
 import asyncio
 import logging
-
-# --- User configuration ---
-server = '127.0.0.1'
-port = 8010
+import hmac
+from .upstream import UpstreamPool, UPSTREAM_TIMEOUT
+from .health import HealthChecker
+from .bulkhead import Bulkheads
+from .responses import passthrough, FastJSONResponse
+from .batch import BatchDispatcher, BatchError, validate_items
+from .cache import page_cache
+from .coalesce import SingleFlight, coalesce_key
+from .static import PrecompressedStaticFiles, STATIC_MAX_AGE
+from .ratelimit import RateLimiter, RateLimitMiddleware, make_store
+from services.common.metrics import instrument
+from services.common.profiler import install_profiler
+from services.common import deadline
+from services.common.deadline import deadline_dependency
+from services.common.client_ip import client_ip_headers
+from services.common.timing import TimingMiddleware, record, merge_upstream_timing, current_request_id, REQUEST_ID_HEADER
+from .security import get_request_token, decode_access_token, claims_cache, INVALIDATE_HEADER, SECRET_KEY
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
@@ -55,111 +69,47 @@ class RequestCompiler:
 
 compiler = RequestCompiler()
 
-class ConnectionKeeper:
-    def __init__(self):
-        self.working = True
-        
-    async def start(self):
-        self.working = True
-        asyncio.create_task(self._ping_loop())
-        logger.info(f"ConnectionKeeper started for {server}:{port}")
-
-    async def stop(self):
-        self.working = False
-        logger.info("ConnectionKeeper stopped")
-
-    async def _ping_loop(self):
-        logger.info("Starting ping loop")
-        while self.working:
-            try:
-                await self.ping()
-            except Exception as e:
-                logger.error(f"Error in ping loop: {e}")
-            await asyncio.sleep(5)
-
-    async def ping(self):
-        try:
-            # Attempt to connect with a timeout
-            future = asyncio.open_connection(server, port)
-            reader, writer = await asyncio.wait_for(future, timeout=3.0)
-            
-            # Connection successful
-            # logger.info(f"Ping active: Connected to {server}:{port}")
-            
-            writer.close()
-            await writer.wait_closed()
-        except asyncio.TimeoutError:
-            logger.error(f"Ping timeout: Could not connect to {server}:{port} within 3s")
-        except Exception as e:
-            logger.error(f"Ping failed: {e}")
-
-connection_keeper = ConnectionKeeper()
-
-
-# Rate Limiter Logic
-class RateLimiter:
-    def __init__(self):
-        self.ip_stats = {}  # {ip: {'reqs': [timestamps], 'blocked_until': timestamp}}
-
-    def check_request(self, ip: str) -> bool:
-        now = datetime.now().timestamp()
-        
-        if ip not in self.ip_stats:
-            self.ip_stats[ip] = {'reqs': [], 'blocked_until': 0}
-        
-        stats = self.ip_stats[ip]
-        
-        # Check if blocked
-        if stats['blocked_until'] > now:
-            remaining = int(stats['blocked_until'] - now)
-            # logger.warning(f"IP {ip} is blocked for {remaining}s")
-            return False
-
-        # Clean old requests (older than 1s)
-        stats['reqs'] = [t for t in stats['reqs'] if now - t < 1.0]
-        
-        # Add new request
-        stats['reqs'].append(now)
-        
-        # Check rate
-        if len(stats['reqs']) > 20:  # Increased limit to 20 req/s
-            stats['blocked_until'] = now + 3600  # Block for 1 hour
-            logger.warning(f"IP {ip} blocked for 1 hour (Rate limit exceeded: {len(stats['reqs'])} req/s)")
-            return False
-            
-        return True
-
-limiter = RateLimiter()
+# Rate Limiter Logic (token bucket, see ratelimit.py)
+limiter = RateLimiter(store=make_store())
 
-app = FastAPI(title="API Gateway")
+# Total time budget per request; upstreams receive what is left of it in X-Request-Timeout-Ms
+REQUEST_DEADLINE = float(os.getenv("GATEWAY_REQUEST_DEADLINE", "60"))
+UPLOAD_DEADLINE = float(os.getenv("GATEWAY_UPLOAD_DEADLINE", "900"))
 
-@app.middleware("http")
-async def rate_limit_middleware(request: Request, call_next):
-    # Exclude static files from rate limiting
-    if request.url.path.startswith("/static"):
-        return await call_next(request)
+app = FastAPI(title="API Gateway", dependencies=[Depends(deadline_dependency(REQUEST_DEADLINE))])
 
-    client_ip = request.client.host
-    if not limiter.check_request(client_ip):
-        return JSONResponse(
-            status_code=429, 
-            content={"detail": "Too many requests. You are blocked for 1 hour."}
-        )
-    response = await call_next(request)
-    return response
+# Static files are excluded from rate limiting
+app.add_middleware(RateLimitMiddleware, limiter=limiter, exclude_prefixes=("/static",))
+# Middleware added later wraps the earlier ones. Metrics, the profiler (when enabled) and
+# TimingMiddleware (the outermost: its request id and log line cover everything) all sit
+# outside the rate limiter, so they also see the 429s.
+# /metrics lists upstream instances and limiter internals: admins or the METRICS_TOKEN bearer only
+metrics = instrument(app, "gateway", authorize=lambda request: can_scrape_metrics(request))
+install_profiler(app, "gateway")
+app.add_middleware(TimingMiddleware, service="gateway")
 
 
 @app.on_event("startup")
 async def startup_event():
-    await connection_keeper.start()
+    await upstreams.start()
+    await limiter.start()
+    await health_checker.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    await connection_keeper.stop()
+    await health_checker.stop()
+    await limiter.stop()
+    await upstreams.close()
 
 app.mount("/uploaded_files", StaticFiles(directory="uploaded_files"), name="uploaded_files")
 
+# Static assets are served from disk by the gateway itself, never through the frontend service
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(BASE_DIR, "frontend", "static")
+app.mount("/static", PrecompressedStaticFiles(directory=STATIC_DIR), name="static")
+
 # ================= SERVICES =================
+# Each value may list several instances: "http://10.0.0.1:8001,http://10.0.0.2:8001|2" (|N = weight)
 SERVICES = {
     "auth": os.getenv("AUTH_SERVICE_URL", "http://127.0.0.1:8005"),
     "orders": os.getenv("ORDERS_SERVICE_URL", "http://127.0.0.1:8001"),
@@ -169,20 +119,106 @@ SERVICES = {
     "frontend": os.getenv("FRONTEND_SERVICE_URL", "http://127.0.0.1:8008"),
 }
 
+upstreams = UpstreamPool(SERVICES)
+health_checker = HealthChecker(upstreams)
+bulkheads = Bulkheads(SERVICES)
+
+single_flight = SingleFlight()
+
+# ================= METRICS =================
+upstream_latency = metrics.histogram(
+    "gateway_upstream_request_duration_seconds", "Time until upstream response headers arrive", ("service", "instance", "outcome")
+)
+
+def _pool_connections():
+    values = {}
+    for name, entry in upstreams.stats().items():
+        values[(name, "active")] = entry["active"]
+        values[(name, "idle")] = entry["idle"]
+    return values
+
+metrics.callback("gateway_upstream_pool_connections", "Open upstream connections by state", ("service", "state"), _pool_connections)
+metrics.callback(
+    "gateway_upstream_outstanding_requests", "Requests in flight per upstream instance", ("service", "instance"),
+    lambda: {(name, i.url): i.outstanding for name, instances in upstreams.instances.items() for i in instances},
+)
+metrics.callback(
+    "gateway_upstream_circuit_open", "1 while the instance's circuit breaker is not closed", ("service", "instance"),
+    lambda: {(name, i.url): int(i.breaker.state != "closed") for name, instances in upstreams.instances.items() for i in instances},
+)
+metrics.callback(
+    "gateway_bulkhead_in_flight", "Admitted upstream calls per service", ("service",),
+    lambda: {(name,): b.in_flight for name, b in bulkheads.bulkheads.items()},
+)
+metrics.callback(
+    "gateway_bulkhead_queued", "Calls waiting for a bulkhead slot per service", ("service",),
+    lambda: {(name,): b.queued for name, b in bulkheads.bulkheads.items()},
+)
+metrics.callback(
+    "gateway_bulkhead_shed_total", "Calls rejected with 503 by the bulkhead", ("service", "reason"),
+    lambda: {key: value for name, b in bulkheads.bulkheads.items() for key, value in (((name, "queue_full"), b.shed_queue_full), ((name, "timeout"), b.shed_timeout))},
+    kind="counter",
+)
+metrics.callback("gateway_rate_limit_blocks_total", "Clients blocked by the rate limiter", (), lambda: {(): limiter.blocks}, kind="counter")
+metrics.callback("gateway_rate_limited_requests_total", "Requests rejected with 429", (), lambda: {(): limiter.blocked_requests}, kind="counter")
+metrics.callback("gateway_coalesced_requests_total", "GETs served from another request's upstream call", (), lambda: {(): single_flight.coalesced}, kind="counter")
+metrics.callback("gateway_page_cache_hits_total", "Rendered pages served from the page cache", (), lambda: {(): page_cache.hits}, kind="counter")
+
+CACHE_PURGE_TOKEN = os.getenv("GATEWAY_CACHE_PURGE_TOKEN", "")
+STATS_TOKEN = os.getenv("GATEWAY_STATS_TOKEN", "")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 # ================= UPLOADS =================
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(200 * 1024 * 1024)))  # 200 MB
+
+class UploadTooLarge(Exception):
+    pass
+
+async def limited_body(request: Request, limit: int):
+    # Re-yield the incoming body chunk by chunk, aborting once it grows past the limit
+    # (covers chunked uploads that carry no Content-Length)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise UploadTooLarge()
+        yield chunk
 
 # ================= PROXY =================
-async def proxy_request(service: str, path: str, request: Request, method: str = "GET", data=None, files=None, params=None):
-    url = SERVICES[service] + path
-    cookies = {}
-    token = request.cookies.get("access_token")
-    if not token:
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
+async def proxy_request(service: str, path: str, request: Request, method: str = "GET", data=None, files=None, params=None, stream: bool = False, content=None, coalesce: bool = True):
+    # Identical concurrent reads share one upstream call; streamed responses can only be read once
+    if coalesce and method == "GET" and not stream and data is None and files is None and content is None:
+        key = coalesce_key(service, path, request, params, get_request_token(request))
+        return await single_flight.do(key, lambda: _send_upstream(service, path, request, method, params=params))
+    return await _send_upstream(service, path, request, method, data=data, files=files, params=params, stream=stream, content=content)
+
+def is_load_shedding(resp: httpx.Response) -> bool:
+    """A deliberate "not now" from a healthy service: a 503 with Retry-After (admission control)
+    or a 504 for a request whose deadline has run out."""
+    if resp.status_code == 503:
+        return "retry-after" in resp.headers
+    return resp.status_code == 504 and deadline.expired()
+
+class ReleasingStream(httpx.AsyncByteStream):
+    """Upstream body stream that calls `on_close` once, when the response is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._on_close()
 
+async def _send_upstream(service: str, path: str, request: Request, method: str = "GET", data=None, files=None, params=None, stream: bool = False, content=None):
+    cookies = {}
+    token = get_request_token(request)
     if token:
         cookies["access_token"] = token
     
@@ -190,127 +226,314 @@ async def proxy_request(service: str, path: str, request: Request, method: str =
     if refresh_token:
         cookies["refresh_token"] = refresh_token
 
-    timeout = httpx.Timeout(60.0, connect=15.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
+    # Cookies go out as a header: the pooled client is shared between users and must not keep a cookie jar
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in ["host", "content-length", "content-type", "cookie", "x-request-id", "x-request-timeout-ms", "x-client-ip", "x-client-ip-signature"]}
+    if cookies:
+        headers["cookie"] = "; ".join(f"{k}={v}" for k, v in cookies.items())
+    # Same id in every service's log line for this request
+    request_id = current_request_id() or request.headers.get(REQUEST_ID_HEADER)
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+    # Services read the caller's address from the last entry (the ones before it are client-supplied)
+    if request.client:
+        forwarded = headers.get("x-forwarded-for")
+        headers["x-forwarded-for"] = f"{forwarded}, {request.client.host}" if forwarded else request.client.host
+        headers.update(client_ip_headers(request.client.host, SECRET_KEY))
+    if content is not None and "content-type" in request.headers:
+        # Raw body pass-through keeps the client's multipart boundary
+        headers["content-type"] = request.headers["content-type"]
+
+    # Bound in-flight calls per service, so one slow backend cannot hold every coroutine and socket
+    bulkhead = bulkheads.get(service)
+    if not await bulkhead.acquire():
+        return JSONResponse({"detail": f"Service '{service}' is overloaded"}, status_code=503, headers={"Retry-After": str(bulkhead.retry_after)})
+
+    # Fail fast while every instance is known to be down instead of waiting for connect timeouts
+    instance = upstreams.pick(service)
+    if instance is None:
+        bulkhead.release()
+        return JSONResponse({"detail": f"Service '{service}' is unavailable"}, status_code=503, headers={"Retry-After": str(upstreams.retry_after(service))})
+
+    url = instance.url + path
+    breaker = instance.breaker
+    client = upstreams.get(service)
+    instance.outstanding += 1
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            instance.outstanding -= 1
+            bulkhead.release()
+
+    deferred = False
+    try:
+        # Waiting for a bulkhead slot may have used up the budget; the service would refuse it anyway
+        budget = deadline.remaining()
+        if budget is not None and budget <= 0:
+            return JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+        headers.update(deadline.outbound_headers())
+        upstream_timeout = UPSTREAM_TIMEOUT if budget is None else httpx.Timeout(min(60.0, budget), connect=min(15.0, budget))
+
+        # Prepare files if any
+        httpx_files = None
+        if files:
+            httpx_files = {}
+            for key, val in files.items():
+                if isinstance(val, tuple) and len(val) >= 2:
+                    # (filename, fileobj, content_type)
+                    httpx_files[key] = val
+                else:
+                    httpx_files[key] = val
+        
+        # --- Check 1: Validate Request Format (Before Sending) ---
+        # We validate 'data' or 'json' if present
+        if data and not compiler.validate_request_format(data):
+            logger.error(f"Invalid request format: {data}")
+            return JSONResponse({"detail": "Invalid request format"}, status_code=400)
+        
+        upstream_request = client.build_request(
+            method, 
+            url, 
+            data=data, 
+            files=httpx_files, 
+            content=content,
+            params=params,
+            headers=headers,
+            timeout=upstream_timeout,
+        )
+        # With stream=True the body is left unread; the caller must relay it with stream_response()
+        started = time.perf_counter()
         try:
-            # Prepare files if any
-            httpx_files = None
-            if files:
-                httpx_files = {}
-                for key, val in files.items():
-                    if isinstance(val, tuple) and len(val) >= 2:
-                        # (filename, fileobj, content_type)
-                        httpx_files[key] = val
-                    else:
-                        httpx_files[key] = val
-            
-            # --- Check 1: Validate Request Format (Before Sending) ---
-            # We validate 'data' or 'json' if present
-            if data and not compiler.validate_request_format(data):
-                logger.error(f"Invalid request format: {data}")
-                return JSONResponse({"detail": "Invalid request format"}, status_code=400)
-            
-            resp = await client.request(
-                method, 
-                url, 
-                data=data, 
-                files=httpx_files, 
-                cookies=cookies, 
-                params=params,
-                headers={k: v for k, v in request.headers.items() if k.lower() not in ["host", "content-length", "content-type"]}
-            )
-
-            # --- Check 2: Validate Response Format (Before Receiving/Returning) ---
-            # We assume we expect JSON or success status
-            if not compiler.validate_response_format(resp):
-                 logger.error(f"Invalid response format from {url}")
-                 # User asked to return Error or None (represented here as error response)
-                 return JSONResponse({"detail": "Invalid response from upstream service"}, status_code=502)
-
-            return resp
-        except httpx.RequestError as e:
-            return JSONResponse({"detail": f"Request error: {str(e)}"}, status_code=503)
-        finally:
-            # Ensure all file objects are closed
-            if files:
-                for val in files.values():
-                    if isinstance(val, tuple) and len(val) > 1 and hasattr(val[1], 'close'):
-                        val[1].close()
+            resp = await client.send(upstream_request, stream=stream)
+        except httpx.RequestError:
+            upstream_latency.observe((service, instance.url, "error"), time.perf_counter() - started)
+            raise
+        elapsed = time.perf_counter() - started
+        upstream_latency.observe((service, instance.url, f"{resp.status_code // 100}xx"), elapsed)
+        record(f"{service}.upstream", elapsed)
+        if "server-timing" in resp.headers:
+            merge_upstream_timing(service, resp.headers["server-timing"])
+        if is_load_shedding(resp):
+            # The service is up and refusing work on purpose; counting that would cut off its other routes
+            pass
+        elif resp.status_code in (502, 503, 504):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        if INVALIDATE_HEADER in resp.headers:
+            claims_cache.invalidate(resp.headers[INVALIDATE_HEADER])
+
+        # --- Check 2: Validate Response Format (Before Receiving/Returning) ---
+        # We assume we expect JSON or success status
+        if not compiler.validate_response_format(resp):
+             logger.error(f"Invalid response format from {url}")
+             # User asked to return Error or None (represented here as error response)
+             return JSONResponse({"detail": "Invalid response from upstream service"}, status_code=502)
+
+        if stream:
+            # The call keeps its bulkhead slot and counts as outstanding until the body is relayed
+            resp.stream = ReleasingStream(resp.stream, release)
+            deferred = True
+        return resp
+    except httpx.TimeoutException as e:
+        breaker.record_failure()
+        status = 504 if deadline.expired() else 503
+        return JSONResponse({"detail": f"Request error: {str(e) or 'timeout'}"}, status_code=status)
+    except httpx.RequestError as e:
+        breaker.record_failure()
+        return JSONResponse({"detail": f"Request error: {str(e)}"}, status_code=503)
+    finally:
+        # Early returns (deadline, bad format) and load-shedding answers record no verdict
+        breaker.release_probe()
+        if not deferred:
+            release()
+        # Ensure all file objects are closed
+        if files:
+            for val in files.values():
+                if isinstance(val, tuple) and len(val) > 1 and hasattr(val[1], 'close'):
+                    val[1].close()
+
+async def notify(path: str, data, timeout: float):
+    """Fire a request at the notification service; failures are logged, not raised.
+
+    Returns the response, or None when the request could not be sent or got no answer.
+    """
+    if deadline.expired():
+        logger.warning(f"Request deadline exceeded, skipped notification {path}")
+        return None
+    bulkhead = bulkheads.get("notification")
+    if not await bulkhead.acquire():
+        logger.warning(f"Notification service overloaded, skipped {path}")
+        return None
+    instance = upstreams.pick("notification")
+    if instance is None:
+        bulkhead.release()
+        logger.warning(f"Notification service unavailable, skipped {path}")
+        return None
+    instance.outstanding += 1
+    try:
+        headers = {REQUEST_ID_HEADER: current_request_id(), **deadline.outbound_headers()}
+        resp = await upstreams.get("notification").post(instance.url + path, data=data, timeout=deadline.timeout(timeout), headers=headers)
+        if resp.status_code >= 500:
+            if not is_load_shedding(resp):
+                instance.breaker.record_failure()
+            logger.error(f"Notification request {path} failed: HTTP {resp.status_code}")
+        else:
+            instance.breaker.record_success()
+        return resp
+    except httpx.RequestError as e:
+        instance.breaker.record_failure()
+        logger.error(f"Notification request {path} failed: {e}")
+        return None
+    finally:
+        instance.breaker.release_probe()
+        instance.outstanding -= 1
+        bulkhead.release()
+
+# ================= STREAMING =================
+# Headers that describe a single connection and must not be relayed
+# (plus date/server, which uvicorn adds itself)
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding", "upgrade", "date", "server"}
+STREAM_CHUNK_SIZE = 64 * 1024
+
+async def _iter_upstream(resp: httpx.Response):
+    try:
+        async for chunk in resp.aiter_raw(STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await resp.aclose()
+
+def stream_response(resp: httpx.Response) -> Response:
+    # Relay status, headers and body chunks as they arrive; memory per request is bounded by STREAM_CHUNK_SIZE.
+    # Raw (still encoded) bytes are forwarded, so content-encoding and content-length stay valid.
+    raw_headers = [
+        (k.encode("latin-1"), v.encode("latin-1"))
+        for k, v in resp.headers.multi_items()
+        if k.lower() not in HOP_BY_HOP_HEADERS
+    ]
+    if resp.is_stream_consumed:
+        # Body was already buffered (e.g. by a non-streaming proxy call)
+        response = Response(content=resp.content, status_code=resp.status_code)
+        response.raw_headers += [h for h in raw_headers if h[0].lower() not in (b"content-length", b"content-encoding")]
+        return response
+    response = StreamingResponse(_iter_upstream(resp), status_code=resp.status_code, background=BackgroundTask(resp.aclose))
+    response.raw_headers = raw_headers
+    return response
 
 # ================= FRONTEND PROXY =================
-@app.get("/static/{path:path}")
-async def proxy_static(path: str, request: Request):
-    resp = await proxy_request("frontend", f"/static/{path}", request)
+async def proxy_frontend(path: str, request: Request, vary: bool = True, cache: bool = False):
+    if cache:
+        # Rendered pages are small and only vary by the X-SPA headers, so they are kept in page_cache
+        key = page_cache.key(request)
+        entry = page_cache.get(key)
+        if entry is None:
+            resp = await proxy_request("frontend", path, request)
+            if isinstance(resp, JSONResponse): return resp
+            entry = page_cache.put(key, resp)
+            if entry is None:
+                response = stream_response(resp)
+                response.headers["Vary"] = "X-SPA, X-Requested-With"
+                return response
+        return page_cache.respond(entry, request)
+
+    resp = await proxy_request("frontend", path, request, stream=True)
     if isinstance(resp, JSONResponse): return resp
-    response = Response(content=resp.content, status_code=resp.status_code, headers=dict(resp.headers))
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
+    response = stream_response(resp)
+    if vary:
+        response.headers["Vary"] = "X-SPA, X-Requested-With"
     return response
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    resp = await proxy_request("frontend", "/", request)
-    if isinstance(resp, JSONResponse): return resp
-    response = HTMLResponse(content=resp.text, status_code=resp.status_code)
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
-    return response
+    return await proxy_frontend("/", request, cache=True)
 
 @app.get("/{page}_page", response_class=HTMLResponse)
 async def proxy_pages(page: str, request: Request):
-    resp = await proxy_request("frontend", f"/{page}_page", request)
-    if isinstance(resp, JSONResponse): return resp
-    response = HTMLResponse(content=resp.text, status_code=resp.status_code)
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
-    return response
+    return await proxy_frontend(f"/{page}_page", request, cache=True)
 
 @app.get("/info", response_class=HTMLResponse)
 async def info_page(request: Request):
-    resp = await proxy_request("frontend", "/info", request)
-    if isinstance(resp, JSONResponse): return resp
-    response = HTMLResponse(content=resp.text, status_code=resp.status_code)
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
-    return response
+    return await proxy_frontend("/info", request, cache=True)
 
 @app.get("/contacts", response_class=HTMLResponse)
 async def contacts_page(request: Request):
-    resp = await proxy_request("frontend", "/contacts", request)
-    if isinstance(resp, JSONResponse): return resp
-    response = HTMLResponse(content=resp.text, status_code=resp.status_code)
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
-    return response
+    return await proxy_frontend("/contacts", request, cache=True)
 
 @app.get("/registration_success", response_class=HTMLResponse)
 async def registration_success(request: Request):
-    resp = await proxy_request("frontend", "/registration_success", request)
-    if isinstance(resp, JSONResponse): return resp
-    response = HTMLResponse(content=resp.text, status_code=resp.status_code)
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
-    return response
+    return await proxy_frontend("/registration_success", request, cache=True)
 
 @app.get("/register_error", response_class=HTMLResponse)
 async def register_error(request: Request):
-    resp = await proxy_request("frontend", "/register_error", request)
-    if isinstance(resp, JSONResponse): return resp
-    response = HTMLResponse(content=resp.text, status_code=resp.status_code)
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
-    return response
+    return await proxy_frontend("/register_error", request, cache=True)
 
 @app.get("/login_error", response_class=HTMLResponse)
 async def login_error(request: Request):
-    resp = await proxy_request("frontend", "/login_error", request)
-    if isinstance(resp, JSONResponse): return resp
-    response = HTMLResponse(content=resp.text, status_code=resp.status_code)
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
-    return response
+    return await proxy_frontend("/login_error", request, cache=True)
 
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon(request: Request):
-    resp = await proxy_request("frontend", "/static/favicon.ico", request)
-    if isinstance(resp, JSONResponse): return resp
-    return Response(content=resp.content, status_code=resp.status_code, headers=dict(resp.headers))
+    return FileResponse(os.path.join(STATIC_DIR, "favicon.ico"), headers={"Cache-Control": f"public, max-age={STATIC_MAX_AGE}"})
 
 @app.get("/health")
-def health():
-    return {"status": "ok", "service": "gateway"}
+def health(request: Request):
+    upstream_status = health_checker.status()
+    status = "ok" if all(u["state"] == "closed" for u in upstream_status.values()) else "degraded"
+    result = {
+        "status": status,
+        "service": "gateway",
+        "upstreams": {name: "down" if u["state"] == "open" else "up" for name, u in upstream_status.items()},
+    }
+    # Instance URLs, breaker and load details only for operators
+    if is_operator(request, "X-Stats-Token", STATS_TOKEN):
+        result["instances"] = upstream_status
+    return result
+
+def is_operator(request: Request, header: str, secret: str) -> bool:
+    """An admin access token, or the operational `secret` sent in the `header` header."""
+    payload = decode_access_token(get_request_token(request))
+    if payload is not None and payload.get("role") == "admin":
+        return True
+    return bool(secret) and hmac.compare_digest(request.headers.get(header, ""), secret)
+
+def can_scrape_metrics(request: Request) -> bool:
+    """Prometheus sends METRICS_TOKEN as a bearer token; admins may look too."""
+    token = get_request_token(request) or ""
+    if METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN):
+        return True
+    return is_operator(request, "X-Metrics-Token", METRICS_TOKEN)
+
+@app.post("/cache/purge")
+async def purge_cache(request: Request, path: str = None):
+    # For deploys: allowed with an admin access token or the GATEWAY_CACHE_PURGE_TOKEN secret
+    if not is_operator(request, "X-Purge-Token", CACHE_PURGE_TOKEN):
+        return JSONResponse({"detail": "Forbidden"}, status_code=403)
+    return {"purged": page_cache.purge(path)}
+
+@app.get("/stats")
+def stats(request: Request):
+    # Pool, cache, limiter and bulkhead internals: admin access token or the GATEWAY_STATS_TOKEN secret
+    if not is_operator(request, "X-Stats-Token", STATS_TOKEN):
+        return JSONResponse({"detail": "Forbidden"}, status_code=403)
+    return {"upstream_pools": upstreams.stats(), "claims_cache": claims_cache.stats(), "rate_limiter": limiter.stats(), "page_cache": page_cache.stats(), "coalescing": single_flight.stats(), "bulkheads": bulkheads.stats()}
+
+batch_dispatcher = BatchDispatcher(app, limiter=limiter)
+
+@app.post("/batch")
+async def batch(request: Request):
+    # Several gateway calls in one round trip: {"requests": [{"id": "me", "path": "/me"}, ...]}
+    try:
+        items = validate_items(await request.json())
+    except (BatchError, ValueError) as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+    results, set_cookies = await batch_dispatcher.run(request, items)
+    response = FastJSONResponse({"responses": results})
+    for cookie in set_cookies:
+        response.raw_headers.append((b"set-cookie", cookie.encode("latin-1")))
+    return response
 
 # ================= AUTH =================
 @app.post("/register")
@@ -343,10 +566,7 @@ async def register(request: Request, email: str = Form(...), password: str = For
     email = auth_data["user"]["email"]
 
     if v_token:
-        async with httpx.AsyncClient() as client:
-            await client.post(SERVICES["notification"] + "/send-verification", 
-                             data={"email": email, "token": v_token, "base_url": base_url}, 
-                             timeout=10.0)
+        await notify("/send-verification", {"email": email, "token": v_token, "base_url": base_url}, timeout=10.0)
 
     response_json = {
         "message": "Registration successful. Please verify your email.",
@@ -374,23 +594,33 @@ async def register(request: Request, email: str = Form(...), password: str = For
 @app.post("/contacts")
 async def handle_contacts(request: Request):
     form = await request.form()
-    # Forward to notification service
-    async with httpx.AsyncClient() as client:
-        await client.post(SERVICES["notification"] + "/send-contact-email", data=form, timeout=20.0)
+    # Forward to notification service; the message only exists in that request, so say when it was lost
+    resp = await notify("/send-contact-email", form, timeout=20.0)
+    if resp is None or resp.status_code >= 500:
+        return JSONResponse(
+            {"detail": "Message could not be delivered, please try again later"},
+            status_code=503,
+            headers={"Retry-After": str(upstreams.retry_after("notification"))},
+        )
     return JSONResponse({"status": "sent"})
 
 @app.get("/verify/{token}")
 async def verify_email(token: str, request: Request):
-    resp = await proxy_request("auth", f"/verify/{token}", request)
+    # Verification consumes the token, so each request must reach the auth service
+    resp = await proxy_request("auth", f"/verify/{token}", request, coalesce=False)
     if not isinstance(resp, JSONResponse) and resp.status_code == 200:
+        # Verification outdates the caller's access token (its is_verified claim), so swap it for a fresh one
+        tokens = await renew_tokens(request)
+
         # If it's an API call (not expecting HTML), return JSON
         accept_header = request.headers.get("accept", "")
         if "text/html" not in accept_header:
-            return JSONResponse(resp.json())
-
-        resp_f = await proxy_request("frontend", f"/verify/{token}", request)
-        if isinstance(resp_f, JSONResponse): return resp_f
-        return HTMLResponse(content=resp_f.text, status_code=resp_f.status_code)
+            response = passthrough(resp)
+        else:
+            response = await proxy_frontend(f"/verify/{token}", request, vary=False)
+        if tokens:
+            set_token_cookies(response, *tokens)
+        return response
     
     detail = "Verification failed"
     if not isinstance(resp, JSONResponse):
@@ -411,14 +641,13 @@ async def login(request: Request, password: str = Form(...), email: str = Form(N
         # If client explicitly asks for JSON, or doesn't explicitly ask for HTML
         accept_header = request.headers.get("accept", "").lower()
         if "application/json" in accept_header or "text/html" not in accept_header:
-            try:
-                return JSONResponse(resp.json(), status_code=resp.status_code)
-            except:
-                return JSONResponse({"detail": resp.text}, status_code=resp.status_code)
+            if "application/json" in resp.headers.get("content-type", ""):
+                return passthrough(resp)
+            return JSONResponse({"detail": resp.text}, status_code=resp.status_code)
 
         if resp.status_code == 401:
             return RedirectResponse("/login_error", status_code=303)
-        return JSONResponse(resp.json(), resp.status_code)
+        return passthrough(resp)
     
     auth_data = resp.json()
     token = auth_data["access_token"]
@@ -429,7 +658,7 @@ async def login(request: Request, password: str = Form(...), email: str = Form(N
     if "application/json" in accept_header or "text/html" not in accept_header:
         # We don't set cookies here as it's an API call, 
         # but for SPA we might need them if the client doesn't handle tokens manually
-        return JSONResponse(auth_data)
+        return passthrough(resp)
 
     response = RedirectResponse("/orders_page", status_code=303)
     response.set_cookie("access_token", token, httponly=True, samesite="lax")
@@ -446,16 +675,13 @@ async def resend_verification(request: Request):
     resp = await proxy_request("auth", "/resend-verification", request, method="POST", data=form)
     if isinstance(resp, JSONResponse): return resp
     if resp.status_code != 200:
-        return JSONResponse(resp.json(), resp.status_code)
+        return passthrough(resp)
     
     data = resp.json()
     email = data["email"]
     v_token = data["verification_token"]
 
-    async with httpx.AsyncClient() as client:
-        await client.post(SERVICES["notification"] + "/send-verification", 
-                         data={"email": email, "token": v_token, "base_url": base_url}, 
-                         timeout=10.0)
+    await notify("/send-verification", {"email": email, "token": v_token, "base_url": base_url}, timeout=10.0)
 
     return JSONResponse({"message": "Link resent successfully"})
 
@@ -464,29 +690,58 @@ async def ai_chat(request: Request, message: str = Form(...)):
     data = {"message": message}
     resp = await proxy_request("ai", "/chat", request, method="POST", data=data)
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
+
+async def get_user_claims(request: Request, reject_invalid: bool = False):
+    """Return the caller's /me claims, verifying the JWT locally and asking auth only on a cache miss."""
+    payload = decode_access_token(get_request_token(request))
+    if payload is None and reject_invalid and SECRET_KEY:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    if payload is not None:
+        claims = claims_cache.get(payload["sub"], payload.get("ver"))
+        if claims is not None:
+            return claims
 
-@app.get("/me")
-async def me(request: Request):
     resp = await proxy_request("auth", "/me", request)
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    if resp.status_code != 200:
+        return passthrough(resp)
+    claims = resp.json()
+    if payload is not None:
+        claims_cache.set(payload["sub"], claims, payload.get("ver"))
+    return claims
+
+@app.get("/me")
+async def me(request: Request):
+    claims = await get_user_claims(request)
+    if isinstance(claims, Response): return claims
+    return FastJSONResponse(claims)
+
+def set_token_cookies(response: Response, access_token: str, refresh_token: str):
+    response.set_cookie("access_token", access_token, httponly=True, samesite="lax")
+    response.set_cookie("logged_in", "true", httponly=False, samesite="lax")
+    response.set_cookie("refresh_token", refresh_token, httponly=True, samesite="lax", max_age=7*24*3600)
+
+async def renew_tokens(request: Request):
+    """(access_token, refresh_token) for the caller's refresh cookie, or None without a valid one."""
+    if not request.cookies.get("refresh_token"):
+        return None
+    resp = await proxy_request("auth", "/refresh", request, method="POST")
+    if isinstance(resp, JSONResponse) or resp.status_code != 200:
+        return None
+    data = resp.json()
+    return data["access_token"], data["refresh_token"]
 
 @app.post("/refresh")
 async def refresh(request: Request):
     resp = await proxy_request("auth", "/refresh", request, method="POST")
     if isinstance(resp, JSONResponse): return resp
     if resp.status_code != 200:
-        return JSONResponse(resp.json(), resp.status_code)
+        return passthrough(resp)
     
     data = resp.json()
-    access_token = data["access_token"]
-    refresh_token = data["refresh_token"]
-    
     response = JSONResponse({"status": "refreshed"})
-    response.set_cookie("access_token", access_token, httponly=True, samesite="lax")
-    response.set_cookie("logged_in", "true", httponly=False, samesite="lax")
-    response.set_cookie("refresh_token", refresh_token, httponly=True, samesite="lax", max_age=7*24*3600)
+    set_token_cookies(response, data["access_token"], data["refresh_token"])
     return response
 
 @app.post("/logout")
@@ -502,48 +757,37 @@ async def logout():
 async def orders(request: Request):
     resp = await proxy_request("orders", "/orders", request)
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
 
 @app.delete("/orders/{order_id}")
 async def delete_order(order_id: int, request: Request):
     resp = await proxy_request("orders", f"/orders/{order_id}", request, method="DELETE")
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
 
-@app.post("/create_order")
+@app.post("/create_order", dependencies=[Depends(deadline_dependency(UPLOAD_DEADLINE))])
 async def create_order(request: Request):
-    # Check if user is verified
-    resp_me = await proxy_request("auth", "/me", request)
-    if isinstance(resp_me, JSONResponse): return resp_me
-    if resp_me.status_code != 200:
-        return JSONResponse(resp_me.json(), resp_me.status_code)
-    
-    user_data = resp_me.json()
-    if not user_data.get("is_verified"):
-        return JSONResponse({"detail": "Please verify your email to create orders."}, status_code=403)
-
-    form = await request.form()
-    data = {}
-    files = {}
-
-    for key, value in form.items():
-        if hasattr(value, "filename"):
-            if value.filename:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"{timestamp}_{value.filename}"
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                with open(filepath, "wb") as f:
-                    f.write(await value.read())
-                files["file"] = (filename, open(filepath, "rb"), value.content_type)
-        else:
-            data[key] = value
-
-    if not files:
-        files["_force_multipart"] = (None, b"")
-
-    resp = await proxy_request("orders", "/create_order", request, method="POST", data=data, files=files)
+    # Refuse oversized uploads before reading any of the body
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE:
+        return JSONResponse({"detail": "Файл завеликий"}, status_code=413)
+
+    # Check if user is verified. Verification is never revoked, so a signed is_verified claim is
+    # enough; tokens without it (or issued before verifying) are checked with the auth service.
+    payload = decode_access_token(get_request_token(request))
+    if not (payload and payload.get("is_verified")):
+        user_data = await get_user_claims(request, reject_invalid=True)
+        if isinstance(user_data, Response): return user_data
+        if not user_data.get("is_verified"):
+            return JSONResponse({"detail": "Please verify your email to create orders."}, status_code=403)
+
+    # The multipart body is piped to the orders service as it arrives; only orders writes the file
+    try:
+        resp = await proxy_request("orders", "/create_order", request, method="POST", content=limited_body(request, MAX_UPLOAD_SIZE))
+    except UploadTooLarge:
+        return JSONResponse({"detail": "Файл завеликий"}, status_code=413)
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
 
 
 # ================= NOTIFICATION =================
@@ -552,13 +796,13 @@ async def calculate_price(request: Request):
     params = request.query_params
     resp = await proxy_request("orders", "/calculate_price", request, params=params)
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
 
 @app.get("/notifications")
 async def notifications(request: Request):
     resp = await proxy_request("notification", "/notifications", request)
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
 
 # ================= ADMIN =================
 @app.get("/admin")
@@ -567,7 +811,7 @@ async def admin_dashboard(request: Request):
     path = f"/admin?email={email}" if email else "/"
     resp = await proxy_request("admin", path, request)
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
 
 @app.post("/admin/update_status/{order_id}")
 async def update_status(order_id: int, request: Request):
@@ -576,21 +820,17 @@ async def update_status(order_id: int, request: Request):
     resp = await proxy_request("admin", f"/update_status/{order_id}", request, method="POST", data=form)
     print(f"[Gateway] Admin response for {order_id}: {resp.status_code}")
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
 
 @app.delete("/admin/delete_order/{order_id}")
 async def admin_delete_order(order_id: int, request: Request):
     resp = await proxy_request("admin", f"/delete_order/{order_id}", request, method="DELETE")
     if isinstance(resp, JSONResponse): return resp
-    return JSONResponse(resp.json(), status_code=resp.status_code)
+    return passthrough(resp)
 
 # ================= CATCH-ALL FOR SPA =================
 # Moved to end to avoid shadowing API routes like /me, /orders, /calculate_price
 @app.get("/{path:path}", response_class=HTMLResponse)
 async def catch_all(path: str, request: Request):
     # Proxy everything else to frontend (e.g. /intro, /about)
-    resp = await proxy_request("frontend", f"/{path}", request)
-    if isinstance(resp, JSONResponse): return resp
-    response = HTMLResponse(content=resp.text, status_code=resp.status_code)
-    response.headers["Vary"] = "X-SPA, X-Requested-With"
-    return response
+    return await proxy_frontend(f"/{path}", request, cache=True)
@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger("Gateway")
+
+RATE_LIMIT_BACKEND = os.getenv("GATEWAY_RATE_LIMIT_BACKEND", "memory")  # memory | sqlite
+RATE_LIMIT_DB = os.getenv("GATEWAY_RATE_LIMIT_DB", os.path.join("data", "gateway_ratelimit.db"))
+RATE_LIMIT_RPS = float(os.getenv("GATEWAY_RATE_LIMIT_RPS", "20"))
+RATE_LIMIT_BLOCK_SECONDS = int(os.getenv("GATEWAY_RATE_LIMIT_BLOCK_SECONDS", "3600"))
+RATE_LIMIT_IDLE_SECONDS = int(os.getenv("GATEWAY_RATE_LIMIT_IDLE_SECONDS", "600"))
+
+
+# Per-key state is a fixed-size tuple: (tokens, updated_at, blocked_until)
+class MemoryStore:
+    """Process-local store; each uvicorn worker keeps its own counters."""
+    name = "memory"
+    executor = None  # updates are in-memory and run inline on the event loop
+
+    def __init__(self):
+        self.buckets = {}
+
+    def update(self, key, func):
+        new_state, result = func(self.buckets.get(key))
+        self.buckets[key] = new_state
+        return result
+
+    def evict_idle(self, idle_before: float, now: float) -> int:
+        stale = [k for k, (_, updated, blocked_until) in self.buckets.items() if updated < idle_before and blocked_until <= now]
+        for key in stale:
+            del self.buckets[key]
+        return len(stale)
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class SQLiteStore:
+    """Store shared through a local SQLite file so several workers enforce one limit."""
+    name = "sqlite"
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, blocked_until REAL NOT NULL)"
+        )
+        self.lock = threading.Lock()
+        # BEGIN IMMEDIATE may wait up to the busy timeout for another worker's write lock,
+        # so updates run on this thread instead of the event loop (one connection, used serially)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit")
+
+    def update(self, key, func):
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT tokens, updated_at, blocked_until FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                new_state, result = func(row)
+                self.conn.execute("INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)", (key, *new_state))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def evict_idle(self, idle_before: float, now: float) -> int:
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM rate_limits WHERE updated_at < ? AND blocked_until <= ?", (idle_before, now))
+            return cursor.rowcount
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+
+def make_store(backend: str = RATE_LIMIT_BACKEND):
+    if backend == "sqlite":
+        return SQLiteStore()
+    return MemoryStore()
+
+
+class RateLimiter:
+    """Token bucket per client IP: `rate` requests/s with bursts up to `rate`; exceeding it blocks the IP."""
+
+    def __init__(self, store=None, rate: float = RATE_LIMIT_RPS, block_seconds: int = RATE_LIMIT_BLOCK_SECONDS, idle_seconds: int = RATE_LIMIT_IDLE_SECONDS):
+        self.store = store if store is not None else MemoryStore()
+        self.rate = rate
+        self.burst = rate
+        self.block_seconds = block_seconds
+        self.idle_seconds = idle_seconds
+        self.blocked_requests = 0
+        self.blocks = 0
+        self._evict_task = None
+
+    def _take(self, state, now):
+        tokens, updated, blocked_until = state if state else (self.burst, now, 0.0)
+        if blocked_until > now:
+            return (tokens, now, blocked_until), False
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            return (0.0, now, now + self.block_seconds), None
+        return (tokens - 1, now, 0.0), True
+
+    def check_request(self, ip: str) -> bool:
+        now = time.time()
+        try:
+            allowed = self.store.update(ip, lambda state: self._take(state, now))
+        except sqlite3.Error as e:
+            # Fail open: a busy shared store must not take the whole gateway down
+            logger.error(f"Rate limiter store error: {e}")
+            return True
+        if allowed is None:
+            self.blocks += 1
+            logger.warning(f"IP {ip} blocked for {self.block_seconds}s (Rate limit exceeded: {self.rate:g} req/s)")
+        if not allowed:
+            self.blocked_requests += 1
+            return False
+        return True
+
+    async def check_request_async(self, ip: str) -> bool:
+        """check_request() off the event loop when the store can block (SQLite)."""
+        if self.store.executor is None:
+            return self.check_request(ip)
+        return await asyncio.get_running_loop().run_in_executor(self.store.executor, self.check_request, ip)
+
+    def evict_idle(self) -> int:
+        now = time.time()
+        return self.store.evict_idle(now - self.idle_seconds, now)
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            try:
+                if self.store.executor is None:
+                    evicted = self.evict_idle()
+                else:
+                    evicted = await asyncio.get_running_loop().run_in_executor(self.store.executor, self.evict_idle)
+                if evicted:
+                    logger.info(f"Rate limiter evicted {evicted} idle clients")
+            except Exception as e:
+                logger.error(f"Rate limiter eviction failed: {e}")
+
+    async def start(self):
+        if self._evict_task is None:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def stop(self):
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            self._evict_task = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.store.name,
+            "tracked_clients": len(self.store),
+            "blocks": self.blocks,
+            "blocked_requests": self.blocked_requests,
+        }
+
+
+def format_duration(seconds: int) -> str:
+    """3600 -> '1 hour', 120 -> '2 minutes', 90 -> '90 seconds'"""
+    for unit, size in (("hour", 3600), ("minute", 60)):
+        if seconds >= size and seconds % size == 0:
+            count = seconds // size
+            return f"{count} {unit}" + ("s" if count != 1 else "")
+    return f"{seconds} second" + ("s" if seconds != 1 else "")
+
+
+class RateLimitMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware request/response wrapping)."""
+
+    def __init__(self, app, limiter: RateLimiter, exclude_prefixes=("/static",)):
+        self.app = app
+        self.limiter = limiter
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        if not await self.limiter.check_request_async(client_ip):
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": f"Too many requests. You are blocked for {format_duration(self.limiter.block_seconds)}."}
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,31 @@
+import importlib.util
+import httpx
+from starlette.responses import JSONResponse, Response
+
+orjson = None
+if importlib.util.find_spec("orjson") is not None:
+    import orjson
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serialised with orjson when it is installed (same output as Starlette's compact JSON)."""
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return super().render(content)
+
+
+def passthrough(resp: httpx.Response) -> Response:
+    """Relay an upstream body byte-for-byte instead of decoding and re-encoding it.
+
+    Only the status, Content-Type and Retry-After (on 429/503) are kept: upstream cookies and
+    hop-by-hop headers stay behind, as they did with JSONResponse(resp.json()).
+    """
+    headers = {"Retry-After": resp.headers["retry-after"]} if "retry-after" in resp.headers else None
+    return Response(
+        content=resp.content,
+        status_code=resp.status_code,
+        headers=headers,
+        media_type=resp.headers.get("content-type", "application/json"),
+    )
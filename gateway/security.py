@@ -0,0 +1,78 @@
+import os
+import time
+from typing import Optional
+from jose import jwt, JWTError
+
+# Same key and scheme as services/auth/security.py. Without a key the gateway
+# falls back to asking the auth service (/me) for every check.
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = "HS256"
+
+CLAIMS_CACHE_TTL = float(os.getenv("GATEWAY_CLAIMS_TTL", "60"))
+CLAIMS_CACHE_SIZE = int(os.getenv("GATEWAY_CLAIMS_CACHE_SIZE", "10000"))
+
+# Set by the auth service on responses that change a user's claims (value: email, or "*" for everyone)
+INVALIDATE_HEADER = "X-Auth-Invalidate"
+
+
+def get_request_token(request) -> Optional[str]:
+    token = request.cookies.get("access_token")
+    if not token:
+        auth_header = request.headers.get("Authorization")
+        if auth_header and auth_header.startswith("Bearer "):
+            token = auth_header.split(" ")[1]
+    return token
+
+
+def decode_access_token(token: str) -> Optional[dict]:
+    if not SECRET_KEY or not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload if payload.get("sub") else None
+
+
+class ClaimsCache:
+    """Short-lived per-user copy of the auth service's /me answer (email, role, is_verified).
+
+    Each entry remembers the token_version ("ver" claim) of the token it was fetched for; a token
+    carrying another version misses and is checked by auth, which rejects outdated ones.
+    """
+
+    def __init__(self, ttl: float = CLAIMS_CACHE_TTL, max_size: int = CLAIMS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = {}  # {sub: (expires_at, ver, claims)}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sub: str, ver: Optional[int] = None) -> Optional[dict]:
+        entry = self.entries.get(sub)
+        if entry and entry[0] > time.monotonic():
+            if entry[1] == ver:
+                self.hits += 1
+                return entry[2]
+        elif entry:
+            del self.entries[sub]
+        self.misses += 1
+        return None
+
+    def set(self, sub: str, claims: dict, ver: Optional[int] = None):
+        if len(self.entries) >= self.max_size and sub not in self.entries:
+            # Dicts keep insertion order, so the first key is the oldest entry
+            del self.entries[next(iter(self.entries))]
+        self.entries[sub] = (time.monotonic() + self.ttl, ver, claims)
+
+    def invalidate(self, sub: str):
+        if sub == "*":
+            self.entries.clear()
+        else:
+            self.entries.pop(sub, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+claims_cache = ClaimsCache()
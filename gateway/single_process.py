@@ -0,0 +1,48 @@
+"""Single-process deployment: the gateway plus every service app in one interpreter.
+
+    uvicorn gateway.single_process:app --port 8010
+
+Each service keeps its own FastAPI app, middleware and database; only the hop between them changes.
+Gateway calls and admin -> notification calls go through httpx.ASGITransport, so there is no
+loopback TCP connection. The regular multi-process topology (gateway.main:app plus one uvicorn
+per service) is unaffected.
+"""
+from contextlib import AsyncExitStack
+import httpx
+from services.common.transport import register_transport
+from services.auth.main import app as auth_app
+from services.orders.main import app as orders_app
+from services.notification.main import app as notification_app
+from services.admin.main import app as admin_app
+from services.ai.main import app as ai_app
+from services.frontend.main import app as frontend_app
+
+SERVICE_APPS = {
+    "auth": auth_app,
+    "orders": orders_app,
+    "notification": notification_app,
+    "admin": admin_app,
+    "ai": ai_app,
+    "frontend": frontend_app,
+}
+
+# Registered before the gateway builds its upstream clients (at startup, or lazily on first use)
+for _name, _service_app in SERVICE_APPS.items():
+    register_transport(_name, httpx.ASGITransport(app=_service_app))
+
+from .main import app, logger  # noqa: E402
+
+_lifespans = AsyncExitStack()
+
+
+@app.on_event("startup")
+async def start_services():
+    # ASGITransport does not send lifespan events, so run each service's startup/shutdown here
+    for service_app in SERVICE_APPS.values():
+        await _lifespans.enter_async_context(service_app.router.lifespan_context(service_app))
+    logger.info(f"Single-process mode: {', '.join(SERVICE_APPS)} served in-process")
+
+
+@app.on_event("shutdown")
+async def stop_services():
+    await _lifespans.aclose()
@@ -0,0 +1,56 @@
+import os
+import stat
+from mimetypes import guess_type
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+STATIC_MAX_AGE = int(os.getenv("GATEWAY_STATIC_MAX_AGE", "86400"))
+
+# Preferred first; siblings are produced by scripts/precompress_static.py
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves `name.br` / `name.gz` siblings to clients that accept them.
+
+    Responses are FileResponse objects: byte ranges and ETag/Last-Modified revalidation come from
+    Starlette, and the file is sent with zero-copy `http.response.pathsend` when the server supports it.
+    """
+
+    def __init__(self, *args, max_age: int = STATIC_MAX_AGE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = f"public, max-age={max_age}"
+
+    async def get_response(self, path: str, scope):
+        request_headers = Headers(scope=scope)
+        response = None
+        # Byte ranges refer to the identity file, so ranged requests skip the compressed variants
+        if "range" not in request_headers:
+            response = await self._precompressed_response(path, scope, request_headers)
+        if response is None:
+            response = await super().get_response(path, scope)
+            if response.status_code in (200, 206, 304):
+                response.headers["Vary"] = "Accept-Encoding"
+        if response.status_code in (200, 206, 304):
+            response.headers["Cache-Control"] = self.cache_control
+        return response
+
+    async def _precompressed_response(self, path: str, scope, request_headers: Headers):
+        accept_encoding = request_headers.get("accept-encoding", "")
+        accepted = {part.split(";")[0].strip() for part in accept_encoding.split(",")}
+        for encoding, suffix in PRECOMPRESSED:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                continue
+            media_type = guess_type(path)[0] or "text/plain"
+            response = FileResponse(full_path, stat_result=stat_result, media_type=media_type)
+            response.headers["Content-Encoding"] = encoding
+            response.headers["Vary"] = "Accept-Encoding"
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+        return None
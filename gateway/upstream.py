@@ -0,0 +1,135 @@
+import os
+import logging
+import importlib.util
+import httpx
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from .health import CircuitBreaker
+from services.common.transport import get_transport, parse_instances
+
+logger = logging.getLogger("Gateway")
+
+# --- Pool configuration ---
+POOL_MAX_CONNECTIONS = int(os.getenv("GATEWAY_POOL_MAX_CONNECTIONS", "100"))
+POOL_MAX_KEEPALIVE = int(os.getenv("GATEWAY_POOL_MAX_KEEPALIVE", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("GATEWAY_POOL_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("GATEWAY_HTTP2", "0").lower() in ("1", "true", "yes")
+
+UPSTREAM_TIMEOUT = httpx.Timeout(60.0, connect=15.0)
+
+
+class Instance:
+    """One running copy of a service, with its own circuit breaker and in-flight counter."""
+
+    def __init__(self, service: str, url: str, weight: int = 1):
+        self.service = service
+        self.url = url
+        self.weight = weight
+        self.breaker = CircuitBreaker(f"{service} ({url})")
+        self.outstanding = 0
+        self.requests = 0
+        self.last_check = None
+
+    def load(self) -> float:
+        return self.outstanding / self.weight
+
+
+class UpstreamPool:
+    """Keeps one long-lived httpx.AsyncClient per service so every route reuses warm connections,
+    and picks which instance of the service gets each request."""
+
+    def __init__(self, services: dict):
+        # services: name -> comma-separated instance list (see parse_instances) or a list of URLs
+        self.instances = {}
+        for name, value in services.items():
+            entries = parse_instances(value) if isinstance(value, str) else [(url, 1) for url in value]
+            self.instances[name] = [Instance(name, url, weight) for url, weight in entries]
+        self.services = {name: [i.url for i in instances] for name, instances in self.instances.items()}
+        self.clients = {}
+        self.requests_sent = {name: 0 for name in services}
+        self._next = {name: 0 for name in services}
+        self.http2 = HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+        if HTTP2_ENABLED and not self.http2:
+            logger.warning("GATEWAY_HTTP2 is set but the 'h2' package is not installed, using HTTP/1.1")
+
+    def _build_client(self, name: str) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        )
+        # Shared between users, so never store Set-Cookie from upstream responses
+        no_cookies = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+        # In single-process mode the service is called in-process through its registered ASGI transport
+        transport = get_transport(name)
+        return httpx.AsyncClient(timeout=UPSTREAM_TIMEOUT, limits=limits, http2=self.http2, cookies=no_cookies, transport=transport)
+
+    async def start(self):
+        for name in self.services:
+            if name not in self.clients or self.clients[name].is_closed:
+                self.clients[name] = self._build_client(name)
+        logger.info(f"Upstream pools ready for: {', '.join(self.clients)} (http2={self.http2})")
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+        logger.info("Upstream pools closed")
+
+    def client(self, name: str) -> httpx.AsyncClient:
+        client = self.clients.get(name)
+        if client is None or client.is_closed:
+            # Created lazily when used outside of the app lifespan (scripts, tests)
+            client = self._build_client(name)
+            self.clients[name] = client
+        return client
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        self.requests_sent[name] = self.requests_sent.get(name, 0) + 1
+        return self.client(name)
+
+    def pick(self, name: str):
+        """Least-outstanding (weighted) instance whose breaker lets a request through, or None.
+
+        Scanning starts one position further on every call, so ties are spread round-robin.
+        """
+        instances = self.instances[name]
+        start = self._next[name]
+        self._next[name] = (start + 1) % len(instances)
+        best = None
+        for offset in range(len(instances)):
+            instance = instances[(start + offset) % len(instances)]
+            if not instance.breaker.can_accept():
+                continue
+            if best is None or instance.load() < best.load():
+                best = instance
+        if best is not None:
+            best.breaker.allow_request()
+            best.requests += 1
+        return best
+
+    def retry_after(self, name: str) -> int:
+        return min(i.breaker.retry_after() for i in self.instances[name])
+
+    def stats(self) -> dict:
+        result = {}
+        for name in self.services:
+            entry = {
+                "requests": self.requests_sent.get(name, 0),
+                "instances": [{"url": i.url, "weight": i.weight, "outstanding": i.outstanding, "requests": i.requests} for i in self.instances[name]],
+                "connections": 0,
+                "idle": 0,
+                "active": 0,
+                "max_connections": POOL_MAX_CONNECTIONS,
+                "max_keepalive": POOL_MAX_KEEPALIVE,
+            }
+            client = self.clients.get(name)
+            # httpcore does not expose counters directly, so inspect the pool's connection list
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            for conn in getattr(pool, "connections", []):
+                entry["connections"] += 1
+                if conn.is_idle():
+                    entry["idle"] += 1
+                else:
+                    entry["active"] += 1
+            result[name] = entry
+        return result
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+import httpx
+
+# Logins/sec of the auth service against the size of its password-hashing process pool
+# (AUTH_HASH_WORKERS). Each run starts a fresh auth service with a throwaway database.
+#
+#   python scripts/bench_login.py --workers 1 2 4 --duration 10
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run_all import start_process
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+PORT = 18005
+URL = f"http://127.0.0.1:{PORT}"
+EMAIL = "bench@example.com"
+PASSWORD = "bench-password"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.3)
+    raise RuntimeError("auth service did not become ready")
+
+
+async def measure(workers: int, concurrency: int, duration: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency + 2)
+    async with httpx.AsyncClient(base_url=URL, timeout=60.0, limits=limits) as client:
+        await wait_until_ready(client)
+        await client.post("/register", data={"email": EMAIL, "password": PASSWORD})
+        latencies, statuses = [], {}
+        health_latencies = []
+
+        async def login_worker(stop_at):
+            while time.monotonic() < stop_at:
+                start = time.perf_counter()
+                resp = await client.post("/login", data={"email": EMAIL, "password": PASSWORD})
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+                if resp.status_code == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+        async def health_probe(stop_at):
+            # Non-hashing endpoints should stay fast while logins saturate the pool
+            while time.monotonic() < stop_at:
+                start = time.perf_counter()
+                await client.get("/health")
+                health_latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.05)
+
+        started = time.monotonic()
+        stop_at = started + duration
+        await asyncio.gather(health_probe(stop_at), *(login_worker(stop_at) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return {
+        "workers": workers,
+        "logins_per_s": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p95": percentile(latencies, 95) if latencies else 0.0,
+        "rejected": statuses.get(503, 0),
+        "health_p95": percentile(health_latencies, 95) if health_latencies else 0.0,
+    }
+
+
+def run(workers: int, concurrency: int, duration: float) -> dict:
+    data_dir = tempfile.mkdtemp(prefix="bench_login_")
+    env = os.environ.copy()
+    env["AUTH_DATABASE_URL"] = f"sqlite:///{os.path.join(data_dir, 'auth.db')}"
+    env["AUTH_HASH_WORKERS"] = str(workers)
+    env.setdefault("SECRET_KEY", "bench-secret")
+    env.setdefault("REFRESH_SECRET_KEY", "bench-refresh-secret")
+    proc = start_process("services.auth.main:app", PORT, env, quiet=True)
+    try:
+        return asyncio.run(measure(workers, concurrency or workers * 2, duration))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Auth logins/sec against the number of hashing processes")
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, max(1, cores // 2), cores}))
+    parser.add_argument("--concurrency", type=int, default=0, help="concurrent logins (0 = 2 per worker)")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(f"CPU cores: {cores}")
+    print(f"{'workers':>8} {'logins/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'503s':>6} {'/health p95':>12}")
+    for workers in args.workers:
+        r = run(workers, args.concurrency, args.duration)
+        print(f"{r['workers']:>8} {r['logins_per_s']:>10.1f} {r['p50']:>9.1f} {r['p95']:>9.1f} {r['rejected']:>6} {r['health_p95']:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import statistics
+import httpx
+
+# End-to-end latency through the gateway: one uvicorn per service vs. gateway.single_process.
+# Both topologies run on ports shifted by PORT_OFFSET, with throwaway databases.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run_all import plan_processes, start_process
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+PORT_OFFSET = 10000
+GATEWAY_URL = f"http://127.0.0.1:{8010 + PORT_OFFSET}"
+
+SCENARIOS = [
+    ("GET /calculate_price", "GET", "/calculate_price?width=20&length=30&height=40&material=PLA&infill=20", None),
+    ("GET /notifications", "GET", "/notifications", None),
+    ("POST /batch (2 items)", "POST", "/batch", {"requests": [
+        {"id": "price", "path": "/calculate_price?width=20&length=30&height=40&material=PLA"},
+        {"id": "notes", "path": "/notifications"},
+    ]}),
+]
+
+
+def prepare_env(data_dir: str):
+    os.environ["AUTH_DATABASE_URL"] = f"sqlite:///{os.path.join(data_dir, 'auth.db')}"
+    os.environ["ORDERS_DATABASE_URL"] = f"sqlite:///{os.path.join(data_dir, 'orders.db')}"
+    os.environ["NOTIFICATION_DATABASE_URL"] = f"sqlite:///{os.path.join(data_dir, 'notifications.db')}"
+    os.environ["NOTIFICATION_SERVICE_URL"] = f"http://127.0.0.1:{8004 + PORT_OFFSET}"
+    # The benchmark is a single client firing as fast as it can
+    os.environ["GATEWAY_RATE_LIMIT_RPS"] = "1000000"
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+
+
+def wait_until_ready(client: httpx.Client, timeout: float = 60.0):
+    # The gateway answers before the services do, so wait until every scenario goes through
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if all(client.request(method, path, json=body).status_code == 200 for _, method, path, body in SCENARIOS):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("services did not become ready")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_mode(mode: str, requests: int, warmup: int) -> dict:
+    data_dir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    prepare_env(data_dir)
+    processes = [start_process(module, port, env, quiet=True) for _, module, port, env in plan_processes(single=(mode == "single"), port_offset=PORT_OFFSET)]
+    results = {}
+    try:
+        with httpx.Client(base_url=GATEWAY_URL, timeout=30.0) as client:
+            wait_until_ready(client)
+            for name, method, path, body in SCENARIOS:
+                for _ in range(warmup):
+                    client.request(method, path, json=body)
+                latencies = []
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    resp = client.request(method, path, json=body)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    resp.raise_for_status()
+                results[name] = {
+                    "mean": statistics.mean(latencies),
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                }
+    finally:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare gateway latency in multi-process and single-process mode")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--modes", nargs="+", choices=("multi", "single"), default=["multi", "single"])
+    args = parser.parse_args()
+
+    all_results = {mode: run_mode(mode, args.requests, args.warmup) for mode in args.modes}
+    print(f"\n{'scenario':<24} {'mode':<7} {'mean ms':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, *_ in SCENARIOS:
+        for mode in args.modes:
+            r = all_results[mode][name]
+            print(f"{name:<24} {mode:<7} {r['mean']:>8.2f} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['p99']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import time
+import argparse
+import httpx
+from starlette.responses import JSONResponse
+
+# Compares the gateway's old decode/re-encode relay with the raw-bytes pass-through
+# on an /admin-style payload (every order in the system).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gateway.responses import passthrough, FastJSONResponse, orjson
+
+
+def admin_payload(count: int) -> bytes:
+    orders = [
+        {
+            "id": i,
+            "user_email": f"user{i % 500}@example.com",
+            "description": f"Order #{i}: bracket for a 3D printer, PETG, 20% infill",
+            "status": ("new", "pending", "in progress", "done")[i % 4],
+            "file_path": f"uploaded_files/20250101_{i}_model.stl",
+            "color": "black",
+            "size": "120x80x40",
+            "created_at": "2025-01-01T12:00:00",
+        }
+        for i in range(count)
+    ]
+    return json.dumps({"orders": orders}).encode()
+
+
+def cpu_per_call(func, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU cost of relaying upstream JSON through the gateway")
+    parser.add_argument("--orders", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--iterations", type=int, default=0, help="0 = scale with payload size")
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if orjson is not None else 'no (stdlib json fallback)'}")
+    print(f"{'orders':>8} {'body KB':>9} {'decode+encode':>14} {'fast encode':>12} {'passthrough':>12} {'saved':>8}")
+    for count in args.orders:
+        body = admin_payload(count)
+        resp = httpx.Response(200, content=body, headers={"content-type": "application/json"})
+        iterations = args.iterations or max(20, 200000 // max(count, 1))
+
+        old = cpu_per_call(lambda: JSONResponse(resp.json(), status_code=resp.status_code), iterations)
+        fast = cpu_per_call(lambda: FastJSONResponse(resp.json(), status_code=resp.status_code), iterations)
+        raw = cpu_per_call(lambda: passthrough(resp), iterations)
+        print(
+            f"{count:>8} {len(body) / 1024:>9.1f} {old * 1e6:>12.1f}us {fast * 1e6:>10.1f}us "
+            f"{raw * 1e6:>10.1f}us {(old - raw) / old * 100 if old else 0:>7.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import uuid
+import random
+import sqlite3
+import argparse
+import threading
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+# Verification-token lookup on a large users table: the old unindexed users.verification_token
+# scan against the hashed, indexed verification_tokens table, plus the migration between them
+# and the expiry sweeper. Runs on a throwaway SQLite database.
+#
+#   python scripts/bench_verification_tokens.py --users 1000000
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+DB_FILE = os.path.join(tempfile.mkdtemp(prefix="bench_tokens_"), "auth.db")
+os.environ["AUTH_DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+
+from services.auth.database import Base, engine, SessionLocal  # noqa: E402
+from services.auth.models import User, VerificationToken  # noqa: E402
+from services.auth.crud import find_verification_token, migrate_plaintext_verification_tokens, sweep_expired_verification_tokens  # noqa: E402
+
+
+def populate(count: int, chunk: int = 50000) -> list:
+    """`count` users in the old layout (plaintext token on the user row); returns every token."""
+    Base.metadata.create_all(bind=engine)
+    tokens = []
+    expires = (datetime.utcnow() + timedelta(minutes=3)).isoformat(sep=" ")
+    conn = sqlite3.connect(DB_FILE)
+    for start in range(0, count, chunk):
+        rows = []
+        for i in range(start, min(count, start + chunk)):
+            token = str(uuid.uuid4())
+            tokens.append(token)
+            rows.append((f"user{i}@example.com", "x", "user", 0, token, expires, 0, 0))
+        conn.executemany(
+            "INSERT INTO users (email, hashed_password, role, is_verified, verification_token, "
+            "verification_token_expires_at, verification_request_count, is_blocked) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+    conn.close()
+    return tokens
+
+
+def time_lookups(func, tokens) -> dict:
+    latencies = []
+    for token in tokens:
+        start = time.perf_counter()
+        assert func(token) is not None
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {"mean": statistics.mean(latencies), "p50": statistics.median(latencies), "max": max(latencies)}
+
+
+class WriterProbe(threading.Thread):
+    """Small committed writes from another connection, as a second auth worker would make."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stop = threading.Event()
+        self.latencies = []
+        self.failures = 0
+
+    def run(self):
+        conn = sqlite3.connect(DB_FILE, timeout=5.0, isolation_level=None)
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            try:
+                conn.execute("UPDATE users SET verification_request_count = verification_request_count + 1 WHERE id = 1")
+                self.latencies.append((time.perf_counter() - start) * 1000)
+            except sqlite3.OperationalError:
+                self.failures += 1
+            time.sleep(0.005)
+        conn.close()
+
+
+def query_plan(sql: str) -> str:
+    with sqlite3.connect(DB_FILE) as conn:
+        return "; ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", ("x",)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verification-token lookup: unindexed plaintext scan vs. hashed index")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=20, help="lookups per layout (the old scan is slow)")
+    parser.add_argument("--sweep-batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tokens = populate(args.users)
+    print(f"Populated {args.users:,} users in {time.perf_counter() - start:.1f}s ({DB_FILE})")
+    sample = random.sample(tokens, min(args.lookups, len(tokens)))
+
+    db = SessionLocal()
+    old = time_lookups(lambda t: db.query(User).filter(User.verification_token == t).first(), sample)
+    print(f"\nold  users.verification_token = ?   {query_plan('SELECT id FROM users WHERE verification_token = ?')}")
+    print(f"     mean {old['mean']:.3f} ms   p50 {old['p50']:.3f} ms   max {old['max']:.3f} ms")
+
+    start = time.perf_counter()
+    migrated = migrate_plaintext_verification_tokens(db)
+    print(f"\nMigrated {migrated:,} tokens to verification_tokens in {time.perf_counter() - start:.1f}s")
+
+    new = time_lookups(lambda t: find_verification_token(db, t), sample)
+    print(f"\nnew  verification_tokens.token_hash = ?   {query_plan('SELECT id FROM verification_tokens WHERE token_hash = ?')}")
+    print(f"     mean {new['mean']:.3f} ms   p50 {new['p50']:.3f} ms   max {new['max']:.3f} ms")
+    print(f"     speed-up (mean): {old['mean'] / new['mean']:.0f}x")
+
+    # Expire half of the tokens, then sweep them in batches
+    db.query(VerificationToken).filter(VerificationToken.id % 2 == 0).update(
+        {VerificationToken.expires_at: datetime.utcnow() - timedelta(minutes=1)}, synchronize_session=False
+    )
+    db.commit()
+    probe = WriterProbe()
+    probe.start()
+    start = time.perf_counter()
+    deleted = sweep_expired_verification_tokens(db, batch_size=args.sweep_batch)
+    elapsed = time.perf_counter() - start
+    probe.stop.set()
+    probe.join()
+    print(f"\nSwept {deleted:,} expired tokens in {elapsed:.1f}s (batches of {args.sweep_batch}, {elapsed / max(1, deleted / args.sweep_batch) * 1000:.1f} ms per batch)")
+    if probe.latencies:
+        waits = sorted(probe.latencies)
+        print(f"     concurrent writer: {len(waits)} writes, p50 {waits[len(waits) // 2]:.1f} ms, "
+              f"p99 {waits[int(len(waits) * 0.99)]:.1f} ms, max {waits[-1]:.1f} ms, {probe.failures} 'database is locked'")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
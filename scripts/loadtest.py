@@ -0,0 +1,433 @@
+"""Asyncio load generator for the gateway.
+
+    # Gateway + stub services with 20 ms +- 5 ms latency and 1% errors, 50 concurrent users for 30 s
+    python scripts/loadtest.py run --stubs --stub-latency-ms 20 --stub-jitter-ms 5 --stub-error-rate 0.01 \\
+        --concurrency 50 --duration 30 --output loadtest.json
+
+    # Against an already running gateway, open-loop at 100 scenarios/s
+    python scripts/loadtest.py run --target http://127.0.0.1:8010 --rate 100 --duration 60
+
+The JSON report (p50/p95/p99 latency, throughput, error rate; overall and per step) is printed and
+optionally written to --output, so runs before and after a change can be diffed.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+import subprocess
+from collections import defaultdict
+import httpx
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run_all import start_process
+
+# Stub ports are port_base + the usual last digits of each service (see run_all.py)
+STUB_PORTS = {"orders": 1, "notification": 4, "auth": 5, "admin": 6, "ai": 7, "frontend": 8}
+GATEWAY_PORT_OFFSET = 10
+
+SCENARIO_WEIGHTS = "register=1,login=2,preview=4,create_order=1,list_orders=4,admin_update=1"
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+# ================= STUB SERVICES =================
+def make_stub_app(service: str, latency_ms: float, jitter_ms: float, error_rate: float, secret_key: str, orders_count: int = 20):
+    """FastAPI app answering the routes the gateway calls on `service`, after a simulated delay."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, HTMLResponse
+    from jose import jwt
+
+    app = FastAPI(title=f"Stub {service}")
+    orders = [
+        {"id": i, "user_email": "user@example.com", "description": f"Stub order {i}", "status": "new",
+         "file_path": None, "color": "black", "size": "10x10x10", "price": 120.0, "created_at": "2025-01-01T00:00:00"}
+        for i in range(orders_count)
+    ]
+
+    def token(email: str, minutes: int = 120) -> str:
+        return jwt.encode({"sub": email, "exp": int(time.time()) + minutes * 60}, secret_key, algorithm="HS256")
+
+    @app.middleware("http")
+    async def simulate(request: Request, call_next):
+        if request.url.path == "/health":
+            return await call_next(request)
+        delay = max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000 if jitter_ms else latency_ms / 1000
+        await asyncio.sleep(delay)
+        if error_rate and random.random() < error_rate:
+            return JSONResponse({"detail": "Injected stub error"}, status_code=503)
+        return await call_next(request)
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok", "service": service}
+
+    if service == "auth":
+        @app.post("/register")
+        async def register(request: Request):
+            email = (await request.form()).get("email", "user@example.com")
+            return {"access_token": token(email), "refresh_token": token(email, 7 * 24 * 60), "verification_token": uuid.uuid4().hex, "user": {"email": email}}
+
+        @app.post("/login")
+        async def login(request: Request):
+            email = (await request.form()).get("email", "user@example.com")
+            return {"access_token": token(email), "refresh_token": token(email, 7 * 24 * 60), "token_type": "bearer"}
+
+        @app.get("/me")
+        def me():
+            return {"email": "user@example.com", "role": "admin", "is_verified": True}
+
+    elif service == "orders":
+        @app.get("/orders")
+        def list_orders():
+            return {"orders": orders}
+
+        @app.post("/create_order")
+        async def create_order(request: Request):
+            size = 0
+            async for chunk in request.stream():
+                size += len(chunk)
+            return {"message": "Order created", "order_id": random.randint(1, 10**6), "received_bytes": size, "price": 120.0, "currency": "UAH"}
+
+        @app.get("/calculate_price")
+        def calculate_price():
+            return {"price": 120.0, "currency": "UAH"}
+
+    elif service == "admin":
+        @app.get("/")
+        def admin_panel():
+            return {"orders": orders}
+
+        @app.post("/update_status/{order_id}")
+        def update_status(order_id: int):
+            return {"message": "Status updated"}
+
+    elif service == "notification":
+        @app.post("/{action}")
+        def send(action: str):
+            return {"status": "queued"}
+
+        @app.get("/notifications")
+        def notifications():
+            return []
+
+    elif service == "ai":
+        @app.post("/chat")
+        def chat():
+            return {"response": "Stub answer"}
+
+    elif service == "frontend":
+        @app.get("/{path:path}", response_class=HTMLResponse)
+        def page(path: str):
+            return f"<html><body>stub page /{path}</body></html>"
+
+    return app
+
+
+async def serve_stubs(args):
+    import uvicorn
+    servers = []
+    for service, offset in STUB_PORTS.items():
+        app = make_stub_app(service, args.stub_latency_ms, args.stub_jitter_ms, args.stub_error_rate, args.secret_key)
+        config = uvicorn.Config(app, host="127.0.0.1", port=args.port_base + offset, log_level="warning", access_log=False)
+        servers.append(uvicorn.Server(config))
+    print(f"Stub services on ports {args.port_base}+{sorted(STUB_PORTS.values())}", flush=True)
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def start_stub_stack(args):
+    """Stub services and a real gateway (gateway.main:app) pointed at them, as subprocesses."""
+    env = os.environ.copy()
+    env["SECRET_KEY"] = args.secret_key
+    env["GATEWAY_RATE_LIMIT_RPS"] = "1000000"  # every virtual user shares one IP
+    for service, offset in STUB_PORTS.items():
+        env[f"{service.upper()}_SERVICE_URL"] = f"http://127.0.0.1:{args.port_base + offset}"
+    stubs = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "stubs", "--port-base", str(args.port_base),
+         "--stub-latency-ms", str(args.stub_latency_ms), "--stub-jitter-ms", str(args.stub_jitter_ms),
+         "--stub-error-rate", str(args.stub_error_rate), "--secret-key", args.secret_key],
+        cwd=BASE_DIR, env=env,
+    )
+    # The gateway logs every request; on a busy run that costs more than the stubs' latency
+    gateway = start_process("gateway.main:app", args.port_base + GATEWAY_PORT_OFFSET, env, quiet=not args.verbose)
+    return [stubs, gateway], f"http://127.0.0.1:{args.port_base + GATEWAY_PORT_OFFSET}"
+
+
+# ================= MEASUREMENT =================
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    total = len(values)
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(values) / total, 2) if total else None,
+            "p50": round(percentile(values, 50), 2) if total else None,
+            "p95": round(percentile(values, 95), 2) if total else None,
+            "p99": round(percentile(values, 99), 2) if total else None,
+            "max": round(values[-1], 2) if total else None,
+        },
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(int)
+        self.scenarios = defaultdict(int)
+        self.delayed_arrivals = 0
+
+    async def request(self, client: httpx.AsyncClient, step: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+            status = resp.status_code
+        except httpx.HTTPError as e:
+            resp, status = None, type(e).__name__
+        self.latencies[step].append((time.perf_counter() - start) * 1000)
+        self.statuses[str(status)] += 1
+        if resp is None or resp.status_code >= 400:
+            self.errors[step] += 1
+            return None
+        return resp
+
+    def report(self, elapsed: float, config: dict) -> dict:
+        all_latencies = [v for values in self.latencies.values() for v in values]
+        result = {"config": config, "elapsed_s": round(elapsed, 2), **summarize(all_latencies, sum(self.errors.values()), elapsed)}
+        result["scenarios"] = dict(self.scenarios)
+        result["status_codes"] = dict(sorted(self.statuses.items()))
+        result["delayed_arrivals"] = self.delayed_arrivals
+        result["steps"] = {step: summarize(values, self.errors[step], elapsed) for step, values in sorted(self.latencies.items())}
+        return result
+
+
+# ================= SCENARIOS =================
+class VirtualUser:
+    def __init__(self, email: str, password: str):
+        self.email = email
+        self.password = password
+        self.token = None
+
+    def headers(self) -> dict:
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Cookie"] = f"access_token={self.token}"
+        return headers
+
+
+async def step_login(client, rec, user):
+    resp = await rec.request(client, "login", "POST", "/login", data={"email": user.email, "password": user.password}, headers={"Accept": "application/json"})
+    if resp is not None:
+        user.token = resp.json().get("access_token")
+    return user.token is not None
+
+
+async def scenario_register(client, rec, user, args):
+    email = f"load_{uuid.uuid4().hex[:12]}@example.com"
+    await rec.request(client, "register", "POST", "/register", data={"email": email, "password": "loadtest-password"}, headers={"Accept": "application/json"})
+
+
+async def scenario_login(client, rec, user, args):
+    await step_login(client, rec, user)
+
+
+async def scenario_preview(client, rec, user, args):
+    params = {"width": random.randint(10, 200), "length": random.randint(10, 200), "height": random.randint(10, 200), "material": random.choice(["PLA", "PETG", "ABS"]), "infill": 20}
+    await rec.request(client, "preview", "GET", "/calculate_price", params=params, headers=user.headers())
+
+
+async def scenario_create_order(client, rec, user, args):
+    if not user.token and not await step_login(client, rec, user):
+        return
+    files = {"file": ("model.stl", os.urandom(args.file_kb * 1024), "application/octet-stream")}
+    data = {"description": "Load test order", "width": "50", "length": "50", "height": "50", "material": "PLA", "infill": "20"}
+    await rec.request(client, "create_order", "POST", "/create_order", data=data, files=files, headers=user.headers())
+
+
+async def scenario_list_orders(client, rec, user, args):
+    if not user.token and not await step_login(client, rec, user):
+        return
+    await rec.request(client, "list_orders", "GET", "/orders", headers=user.headers())
+
+
+async def scenario_admin_update(client, rec, user, args):
+    if not user.token and not await step_login(client, rec, user):
+        return
+    resp = await rec.request(client, "admin_list", "GET", "/admin", headers=user.headers())
+    orders = resp.json().get("orders", []) if resp is not None else []
+    if orders:
+        order_id = random.choice(orders)["id"]
+        await rec.request(client, "admin_update", "POST", f"/admin/update_status/{order_id}", data={"status": "in progress"}, headers=user.headers())
+
+
+SCENARIOS = {
+    "register": scenario_register,
+    "login": scenario_login,
+    "preview": scenario_preview,
+    "create_order": scenario_create_order,
+    "list_orders": scenario_list_orders,
+    "admin_update": scenario_admin_update,
+}
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}', choose from: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def create_users(client, args) -> list:
+    """Accounts shared by the virtual users; registered up front so setup is not measured."""
+    users = []
+    for _ in range(args.users):
+        user = VirtualUser(f"load_{uuid.uuid4().hex[:12]}@example.com", "loadtest-password")
+        resp = await client.post("/register", data={"email": user.email, "password": user.password}, headers={"Accept": "application/json"})
+        if resp.status_code == 200:
+            user.token = resp.json().get("access_token")
+        users.append(user)
+    return users
+
+
+async def wait_ready(client, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/calculate_price", params={"width": 10, "length": 10, "height": 10})).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.3)
+    raise SystemExit("Gateway did not become ready")
+
+
+async def run_load(target: str, args) -> dict:
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    rec = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=target, timeout=args.timeout, limits=limits) as client:
+        await wait_ready(client)
+        users = await create_users(client, args)
+
+        async def run_one():
+            name = random.choices(names, weights)[0]
+            rec.scenarios[name] += 1
+            await SCENARIOS[name](client, rec, random.choice(users), args)
+
+        started = time.perf_counter()
+        stop_at = started + args.duration
+        if args.rate:
+            # Open loop: arrivals follow the clock whether or not earlier scenarios finished
+            slots = asyncio.Semaphore(args.concurrency)
+            tasks = set()
+
+            async def arrival():
+                if slots.locked():
+                    rec.delayed_arrivals += 1
+                async with slots:
+                    await run_one()
+
+            next_at = started
+            while next_at < stop_at:
+                task = asyncio.create_task(arrival())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                next_at += random.expovariate(args.rate) if args.poisson else 1 / args.rate
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            if tasks:
+                await asyncio.gather(*tasks)
+        else:
+            # Closed loop: `concurrency` users, each starting a new scenario when the last one ends
+            async def worker():
+                while time.perf_counter() < stop_at:
+                    await run_one()
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    config = {
+        "target": target, "stubs": args.stubs, "concurrency": args.concurrency, "rate": args.rate,
+        "duration_s": args.duration, "mix": mix, "file_kb": args.file_kb,
+    }
+    if args.stubs:
+        config.update({"stub_latency_ms": args.stub_latency_ms, "stub_jitter_ms": args.stub_jitter_ms, "stub_error_rate": args.stub_error_rate})
+    return rec.report(elapsed, config)
+
+
+def add_stub_options(parser):
+    parser.add_argument("--port-base", type=int, default=19000, help="stubs use port_base+1..8, the gateway port_base+10")
+    parser.add_argument("--stub-latency-ms", type=float, default=10.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--secret-key", default="loadtest-secret", help="shared by the stub auth service and the gateway")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway load generator")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="generate load and print a JSON report")
+    target = run.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target", help="base URL of a running gateway")
+    target.add_argument("--stubs", action="store_true", help="start the gateway against stub services")
+    run.add_argument("--concurrency", type=int, default=20, help="closed loop: virtual users; open loop: max scenarios in flight")
+    run.add_argument("--rate", type=float, default=0.0, help="open loop: scenarios started per second (0 = closed loop)")
+    run.add_argument("--poisson", action="store_true", help="exponential inter-arrival times instead of a fixed interval")
+    run.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    run.add_argument("--mix", default=SCENARIO_WEIGHTS, help=f"scenario weights (default {SCENARIO_WEIGHTS})")
+    run.add_argument("--users", type=int, default=10, help="accounts registered before the run")
+    run.add_argument("--file-kb", type=int, default=256, help="size of the file uploaded by create_order")
+    run.add_argument("--timeout", type=float, default=30.0)
+    run.add_argument("--output", help="also write the JSON report to this file")
+    run.add_argument("--verbose", action="store_true", help="show the gateway's logs (--stubs)")
+    add_stub_options(run)
+
+    stubs = sub.add_parser("stubs", help="only serve the stub services (used by 'run --stubs')")
+    add_stub_options(stubs)
+
+    args = parser.parse_args()
+    if args.command == "stubs":
+        asyncio.run(serve_stubs(args))
+        return
+
+    processes = []
+    target_url = args.target
+    if args.stubs:
+        processes, target_url = start_stub_stack(args)
+    try:
+        report = asyncio.run(run_load(target_url, args))
+    finally:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            proc.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+# Micro-benchmarks for the per-request hot paths, each timed in isolation (warmup + repeated rounds).
+#
+#   python scripts/microbench.py --save                 # record a baseline
+#   python scripts/microbench.py --compare              # fail (exit 1) on regressions beyond --threshold
+#   python scripts/microbench.py --filter orders        # only benchmarks whose name contains "orders"
+#
+# Baselines are machine-specific: record one before a change and compare after it on the same host.
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+DEFAULT_BASELINE = os.path.join(BASE_DIR, "data", "microbench_baseline.json")
+
+# Throwaway databases, so importing the services never touches data/*.db
+_data_dir = tempfile.mkdtemp(prefix="microbench_")
+for _name in ("AUTH", "ORDERS", "NOTIFICATION"):
+    os.environ[f"{_name}_DATABASE_URL"] = f"sqlite:///{os.path.join(_data_dir, _name.lower() + '.db')}"
+os.environ.setdefault("SECRET_KEY", "microbench-secret")
+os.environ.setdefault("REFRESH_SECRET_KEY", "microbench-refresh-secret")
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, number: int):
+    """Register `setup() -> callable`; the callable is timed `number` times per round."""
+    def register(setup):
+        BENCHMARKS[name] = (setup, number)
+        return setup
+    return register
+
+
+# ================= BENCHMARKS =================
+MATERIALS = ["PLA", "ABS", "PETG", "TPU", "Nylon", "SLA", "PETG CF 10", "Unknown"]
+
+
+@benchmark("orders.calculate_order_price", number=20000)
+def bench_price():
+    from services.orders.pricing import calculate_order_price
+    return lambda: calculate_order_price(width=120, length=80, height=40, material="PETG", infill=20)
+
+
+@benchmark("gateway.RateLimiter.check_request[memory, 1k IPs]", number=20000)
+def bench_rate_limit():
+    from gateway.ratelimit import RateLimiter, MemoryStore
+    limiter = RateLimiter(MemoryStore(), rate=1e9)
+    ips = [f"10.0.{i // 256}.{i % 256}" for i in range(1000)]
+    state = {"i": 0}
+
+    def run():
+        state["i"] = (state["i"] + 1) % len(ips)
+        limiter.check_request(ips[state["i"]])
+    return run
+
+
+@benchmark("gateway.RateLimiter.check_request[sqlite, 1k IPs]", number=2000)
+def bench_rate_limit_sqlite():
+    from gateway.ratelimit import RateLimiter, SQLiteStore
+    limiter = RateLimiter(SQLiteStore(os.path.join(_data_dir, "ratelimit.db")), rate=1e9)
+    ips = [f"10.0.{i // 256}.{i % 256}" for i in range(1000)]
+    state = {"i": 0}
+
+    def run():
+        state["i"] = (state["i"] + 1) % len(ips)
+        limiter.check_request(ips[state["i"]])
+    return run
+
+
+@benchmark("auth.hash_password", number=1)
+def bench_hash():
+    from services.auth.security import hash_password
+    return lambda: hash_password("correct horse battery staple")
+
+
+@benchmark("auth.verify_password", number=1)
+def bench_verify():
+    from services.auth.security import hash_password, verify_password
+    hashed = hash_password("correct horse battery staple")
+    return lambda: verify_password("correct horse battery staple", hashed)
+
+
+@benchmark("auth.LoginThrottle.retry_after[throttled account]", number=20000)
+def bench_login_throttle():
+    from services.auth.throttle import LoginThrottle
+    throttle = LoginThrottle(max_per_account=5, max_per_ip=10**9)
+    for _ in range(5):
+        throttle.failure("victim@example.com", "198.51.100.7")
+    return lambda: throttle.retry_after("victim@example.com", "198.51.100.7")
+
+
+def _auth_user():
+    from services.auth.database import SessionLocal, Base, engine
+    from services.auth.crud import get_user_by_email, create_user
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    if get_user_by_email(db, "user@example.com") is None:
+        create_user(db, "user@example.com", "not-a-real-hash")
+    return db
+
+
+@benchmark("auth.get_user_by_email[ORM query]", number=2000)
+def bench_user_query():
+    from services.auth.crud import get_user_by_email
+    db = _auth_user()
+    return lambda: (get_user_by_email(db, "user@example.com"), db.expunge_all())
+
+
+@benchmark("auth.get_user_record[cached]", number=20000)
+def bench_user_cache():
+    from services.auth.crud import get_user_record
+    db = _auth_user()
+    return lambda: get_user_record(db, "user@example.com")
+
+
+@benchmark("auth.create_access_token", number=5000)
+def bench_create_token():
+    from services.auth.security import create_access_token
+    return lambda: create_access_token({"sub": "user@example.com"})
+
+
+@benchmark("auth.decode_access_token", number=5000)
+def bench_decode_token():
+    from services.auth.security import create_access_token, decode_access_token
+    token = create_access_token({"sub": "user@example.com"})
+    return lambda: decode_access_token(token)
+
+
+@benchmark("gateway.decode_access_token", number=5000)
+def bench_gateway_decode_token():
+    from services.auth.security import create_access_token
+    from gateway.security import decode_access_token
+    token = create_access_token({"sub": "user@example.com"})
+    return lambda: decode_access_token(token)
+
+
+@benchmark("notification.build_themed_email", number=20000)
+def bench_email():
+    from services.notification.main import build_themed_email
+    return lambda: build_themed_email(
+        "Оновлення статусу замовлення #42", "Вітаємо",
+        "Статус вашого замовлення #42 було змінено на: <strong>done</strong>.",
+        "http://127.0.0.1:8000/orders_page", "Переглянути замовлення",
+    )
+
+
+def load_orders(count: int):
+    """`count` orders inserted into the throwaway orders DB and loaded back as ORM objects."""
+    from services.orders.database import SessionLocal, Base, engine
+    from services.orders.models import Order
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    created = datetime(2025, 1, 1)
+    with SessionLocal() as db:
+        if db.query(Order).count() < count:
+            db.bulk_save_objects([
+                Order(
+                    user_email=f"user{i % 500}@example.com",
+                    description=f"Order #{i}: bracket for a 3D printer",
+                    file_path=f"uploaded_files/20250101_{i}_model.stl",
+                    color="black", size="120x80x40", status=rng.choice(["new", "pending", "in progress", "done"]),
+                    price=rng.uniform(50, 5000), width=120.0, length=80.0, height=40.0,
+                    material=rng.choice(MATERIALS), infill=20.0, real_weight=None,
+                    created_at=created + timedelta(minutes=i),
+                )
+                for i in range(count)
+            ])
+            db.commit()
+    db = SessionLocal()
+    return db.query(Order).limit(count).all()
+
+
+@benchmark("orders.get_orders serialisation[10k orders]", number=5)
+def bench_orders_to_dict():
+    from services.orders.main import order_to_dict
+    orders = load_orders(10000)
+    return lambda: [order_to_dict(o) for o in orders]
+
+
+@benchmark("admin.admin_panel serialisation[10k orders]", number=5)
+def bench_admin_to_dict():
+    from services.admin.main import order_summary
+    orders = load_orders(10000)
+    return lambda: [order_summary(o) for o in orders]
+
+
+# ================= RUNNER =================
+def time_benchmark(setup, number: int, repeat: int, warmup: int) -> dict:
+    func = setup()
+    for _ in range(warmup * number):
+        func()
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "median_us": statistics.median(rounds),
+        "min_us": min(rounds),
+        "mean_us": statistics.mean(rounds),
+        "stdev_us": statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Names of benchmarks whose median got slower than the baseline by more than `threshold`."""
+    regressions = []
+    print(f"\n{'benchmark':<52} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, result in results.items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            print(f"{name:<52} {'-':>12} {format_us(result['median_us']):>12} {'new':>8}")
+            continue
+        change = result["median_us"] / old["median_us"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<52} {format_us(old['median_us']):>12} {format_us(result['median_us']):>12} {change * 100:>+7.1f}%{flag}")
+    return regressions
+
+
+def format_us(value: float) -> str:
+    if value >= 1000:
+        return f"{value / 1000:.2f}ms"
+    return f"{value:.2f}us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the per-request hot paths")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7, help="timed rounds per benchmark")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed rounds per benchmark")
+    parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE, help=f"write results as the baseline (default {DEFAULT_BASELINE})")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="compare with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown of the median before flagging (0.15 = 15%%)")
+    parser.add_argument("--list", action="store_true", help="list benchmark names and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return
+
+    results = {}
+    print(f"{'benchmark':<52} {'median':>12} {'min':>12} {'stdev':>10}")
+    for name, (setup, number) in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        result = time_benchmark(setup, number, args.repeat, args.warmup)
+        results[name] = result
+        print(f"{name:<52} {format_us(result['median_us']):>12} {format_us(result['min_us']):>12} {format_us(result['stdev_us']):>10}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import os
+import gzip
+import importlib.util
+
+# Creates .gz (and .br when the 'brotli' package is installed) next to text assets in frontend/static,
+# so the gateway can serve them without compressing on every request.
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(BASE_DIR, "frontend", "static")
+EXTENSIONS = (".css", ".js", ".svg", ".html", ".json", ".txt", ".ico")
+MIN_SIZE = 512  # smaller files are not worth an extra round of negotiation
+
+brotli = None
+if importlib.util.find_spec("brotli") is not None:
+    import brotli
+
+
+def is_fresh(source: str, target: str) -> bool:
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def write_variant(source: str, data: bytes, suffix: str, compress) -> bool:
+    target = source + suffix
+    if is_fresh(source, target):
+        return False
+    compressed = compress(data)
+    if len(compressed) >= len(data):
+        # Not smaller, the gateway will serve the original
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+    with open(target, "wb") as f:
+        f.write(compressed)
+    return True
+
+
+def precompress(static_dir: str = STATIC_DIR):
+    created = 0
+    for root, dirs, files in os.walk(static_dir):
+        for name in files:
+            if not name.endswith(EXTENSIONS):
+                continue
+            source = os.path.join(root, name)
+            if os.path.getsize(source) < MIN_SIZE:
+                continue
+            with open(source, "rb") as f:
+                data = f.read()
+            if write_variant(source, data, ".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0)):
+                created += 1
+            if brotli is not None and write_variant(source, data, ".br", lambda d: brotli.compress(d, quality=11)):
+                created += 1
+    return created
+
+
+if __name__ == "__main__":
+    if brotli is None:
+        print("Note: 'brotli' is not installed, only .gz variants will be created.")
+    print(f"Created {precompress()} precompressed files in {STATIC_DIR}")
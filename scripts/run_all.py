@@ -1,4 +1,5 @@
 import os
+import argparse
 import subprocess
 import sys
 import time
@@ -59,22 +60,73 @@ SERVICES = [
     ("Gateway", "gateway.main:app", 8010),
 ]
 
-def run_services():
+# Extra instances of a service listen on port + i * INSTANCE_PORT_STEP
+# (the base ports are adjacent, so port + 1 would collide with the next service)
+INSTANCE_PORT_STEP = 100
+
+
+def instance_ports(port, count):
+    return [port + i * INSTANCE_PORT_STEP for i in range(count)]
+
+
+def parse_instances(values):
+    """['3'] -> every service x3; ['orders=3', 'auth=2'] -> per service. The gateway always runs once."""
+    counts = {name.lower(): 1 for name, _, _ in SERVICES}
+    for value in values or []:
+        if "=" in value:
+            name, count = value.split("=", 1)
+            counts[name.strip().lower()] = int(count)
+        else:
+            counts = {name: int(value) for name in counts}
+    counts["gateway"] = 1
+    return counts
+
+
+def gateway_env(counts, port_offset=0):
+    # Tell the gateway about every instance, e.g. ORDERS_SERVICE_URL=http://127.0.0.1:8001,http://127.0.0.1:8101
+    env = os.environ.copy()
+    for name, _, port in SERVICES:
+        if name == "Gateway":
+            continue
+        urls = [f"http://127.0.0.1:{p}" for p in instance_ports(port + port_offset, counts[name.lower()])]
+        env[f"{name.upper()}_SERVICE_URL"] = ",".join(urls)
+    return env
+
+
+def plan_processes(instances=None, single=False, port_offset=0):
+    """[(label, app module, port, env)] for the chosen topology; env None = inherit."""
+    if single:
+        # Gateway and every service in one interpreter, connected through in-process ASGI transports
+        return [("All-in-one", "gateway.single_process:app", 8010 + port_offset, None)]
+    counts = parse_instances(instances)
+    plan = []
+    for name, module, port in SERVICES:
+        env = gateway_env(counts, port_offset) if name == "Gateway" else None
+        for i, instance_port in enumerate(instance_ports(port + port_offset, counts[name.lower()])):
+            plan.append((name if i == 0 else f"{name}#{i + 1}", module, instance_port, env))
+    return plan
+
+
+def start_process(module, port, env=None, quiet=False):
+    # We use sys.executable to ensure we use the same Python interpreter
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--host", "0.0.0.0", "--port", str(port)],
+        stdout=subprocess.DEVNULL if quiet else None, # Inherit stdout for colors and ease of debugging
+        stderr=subprocess.DEVNULL if quiet else None,
+        env=env,
+    )
+
+
+def run_services(instances=None, single=False):
     processes = []
     print("=" * 50)
-    print("🚀 Starting all microservices...")
+    print("🚀 Starting all microservices..." + (" (single process)" if single else ""))
     print("=" * 50)
 
     try:
-        for name, module, port in SERVICES:
-            print(f"📦 Starting {name:12} on port {port}...")
-            # We use sys.executable to ensure we use the same Python interpreter
-            proc = subprocess.Popen(
-                [sys.executable, "-m", "uvicorn", module, "--host", "0.0.0.0", "--port", str(port)],
-                stdout=None, # Inherit stdout for colors and ease of debugging
-                stderr=None,
-            )
-            processes.append((name, proc))
+        for label, module, port, env in plan_processes(instances, single):
+            print(f"📦 Starting {label:12} on port {port}...")
+            processes.append((label, start_process(module, port, env)))
             time.sleep(0.5) # Slight delay to avoid console output mess
 
         print("\n" + "=" * 50)
@@ -101,4 +153,13 @@ def run_services():
         print("✅ All services stopped.")
 
 if __name__ == "__main__":
-    run_services()
+    parser = argparse.ArgumentParser(description="Run all microservices locally")
+    parser.add_argument(
+        "--instances", action="append", metavar="N | SERVICE=N",
+        help="instances per service, e.g. --instances 2 or --instances orders=3 (repeatable)",
+    )
+    parser.add_argument("--single", action="store_true", help="run the gateway and all services in one process")
+    args = parser.parse_args()
+    if args.single and args.instances:
+        parser.error("--single and --instances cannot be combined")
+    run_services(args.instances, args.single)
@@ -1,34 +1,46 @@
 from fastapi import FastAPI, Form, Depends, HTTPException, BackgroundTasks
 from sqlalchemy.orm import Session
-import httpx
 import os
+import logging
+from itertools import cycle
 from services.orders.database import get_db
 from . import crud
+from services.common.metrics import instrument
+from services.common.profiler import install_profiler
+from services.common.deadline import deadline_dependency
+from services.common.transport import client_for, parse_instances
+from services.common.timing import TimingMiddleware, current_request_id, REQUEST_ID_HEADER
 
-app = FastAPI(title="Admin Service")
+logger = logging.getLogger("AdminService")
+
+app = FastAPI(title="Admin Service", dependencies=[Depends(deadline_dependency())])
+metrics = instrument(app, "admin")
+install_profiler(app, "admin")
+app.add_middleware(TimingMiddleware, service="admin")
+
+# May list several instances, like the gateway's *_SERVICE_URL settings; calls rotate over them
+NOTIFICATION_URLS = cycle([url for url, _ in parse_instances(os.getenv("NOTIFICATION_SERVICE_URL", "http://127.0.0.1:8004"))])
 
 @app.get("/health")
 def health():
     return {"status": "ok", "service": "admin"}
 
+def order_summary(o) -> dict:
+    return {
+        "id": o.id,
+        "user_email": o.user_email,
+        "description": o.description,
+        "status": o.status,
+        "file_path": o.file_path,
+        "color": o.color,
+        "size": o.size,
+        "created_at": o.created_at.isoformat() if o.created_at else None
+    }
+
 @app.get("/")
 def admin_panel(email: str = "", db: Session = Depends(get_db)):
     orders = crud.get_all_orders(db, email)
-    return {
-        "orders": [
-            {
-                "id": o.id,
-                "user_email": o.user_email,
-                "description": o.description,
-                "status": o.status,
-                "file_path": o.file_path,
-                "color": o.color,
-                "size": o.size,
-                "created_at": o.created_at.isoformat() if o.created_at else None
-            }
-            for o in orders
-        ]
-    }
+    return {"orders": [order_summary(o) for o in orders]}
 
 @app.post("/update_status/{order_id}")
 async def update_status(background_tasks: BackgroundTasks, order_id: int, status: str = Form(...), db: Session = Depends(get_db)):
@@ -40,20 +52,21 @@ async def update_status(background_tasks: BackgroundTasks, order_id: int, status
         print(f"DEBUG: Order {order_id} NOT FOUND")
     if order and order.user_email:
         # Trigger notification via Notification Service
-        NOTIFICATION_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://127.0.0.1:8004") + "/send-status-update"
+        NOTIFICATION_URL = next(NOTIFICATION_URLS) + "/send-status-update"
         
+        # Runs after the response is sent, so it gets its own timeout rather than the caller's deadline
         async def notify():
             try:
                 base_url = "http://127.0.0.1:8000" 
-                async with httpx.AsyncClient() as client:
+                async with client_for("notification") as client:
                     await client.post(NOTIFICATION_URL, data={
                         "email": order.user_email,
                         "order_id": order_id,
                         "new_status": status,
                         "base_url": base_url
-                    })
+                    }, headers={REQUEST_ID_HEADER: current_request_id()}, timeout=10.0)
             except Exception as e:
-                print(f"Error triggering status notification: {e}")
+                logger.error(f"Error triggering status notification for order {order_id}: {e}")
         
         background_tasks.add_task(notify)
         
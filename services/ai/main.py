@@ -1,10 +1,18 @@
-from fastapi import FastAPI, Form, HTTPException
+from fastapi import FastAPI, Form, HTTPException, Depends
 from fastapi.responses import JSONResponse
 import os
 import httpx
 import json
+from services.common.metrics import instrument
+from services.common.profiler import install_profiler
+from services.common import deadline
+from services.common.deadline import deadline_dependency
+from services.common.timing import TimingMiddleware
 
-app = FastAPI(title="Smart 3D AI Assistant")
+app = FastAPI(title="Smart 3D AI Assistant", dependencies=[Depends(deadline_dependency())])
+metrics = instrument(app, "ai")
+install_profiler(app, "ai")
+app.add_middleware(TimingMiddleware, service="ai")
 
 @app.get("/health")
 def health():
@@ -57,7 +65,8 @@ async def chat(message: str = Form(...)):
     try:
         async with httpx.AsyncClient() as client:
             # Use Standard API for a complete response
-            resp = await client.post(url, headers=headers, json=payload, timeout=45.0)
+            # Never wait longer than the gateway is willing to wait for us
+            resp = await client.post(url, headers=headers, json=payload, timeout=deadline.timeout(45.0))
             
             if resp.status_code != 200:
                 error_detail = resp.text
@@ -69,6 +78,11 @@ async def chat(message: str = Form(...)):
             reply = data.get("content", "Вибачте, я не зміг сформувати відповідь.")
             return {"response": reply}
             
+    except httpx.TimeoutException:
+        if deadline.expired():
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+        print("Amarsia Timeout")
+        return {"response": "Amarsia AI не відповів вчасно. Спробуйте ще раз."}
     except httpx.ConnectError:
         print("Amarsia Connection Error")
         return {"response": "Не вдалося з'єднатися з Amarsia AI. Перевірте підключення до мережі."}
@@ -1,9 +1,192 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import NamedTuple, Optional, Union
+from sqlalchemy import event
 from sqlalchemy.orm import Session
-from .models import User
+from .database import engine
+from .models import User, VerificationToken
 from .security import hash_password
 
+USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+VERIFICATION_TOKEN_TTL = timedelta(minutes=3)
+
+
+class UserRecord(NamedTuple):
+    """Read-only copy of the columns the hot paths need; safe to share between requests and threads."""
+    id: int
+    email: str
+    hashed_password: str
+    role: str
+    is_verified: int
+    token_version: int
+    is_blocked: int
+    blocked_until: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserRecord":
+        return cls(user.id, user.email, user.hashed_password, user.role, user.is_verified,
+                   user.token_version or 0, user.is_blocked or 0, user.blocked_until)
+
+
+class UserCache:
+    """LRU/TTL cache of UserRecords by email.
+
+    Writes in this module invalidate their user. Writes by other processes (another auth worker,
+    promote_admin.py) are noticed through SQLite's PRAGMA data_version, which changes whenever
+    another connection commits to the database file; the whole cache is dropped then. Commits by
+    this process's own sessions change it too, so those move the baseline instead (see below).
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_SIZE, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.db_path = db_path
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # {email: (expires_at, record)}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._conn_lock = threading.Lock()  # the side connection is shared between threads
+        self._conn = None
+        self._data_version = None
+
+    def _read_data_version(self) -> Optional[int]:
+        """PRAGMA data_version, or None when it cannot be read right now.
+
+        The side connection never waits for a lock (timeout=0): while a writer holds the file
+        exclusively the version is simply unknown and the cache is left as it is.
+        """
+        with self._conn_lock:
+            try:
+                if self._conn is None:
+                    self._conn = sqlite3.connect(self.db_path, timeout=0, check_same_thread=False)
+                return self._conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.OperationalError as e:
+                if e.sqlite_errorcode not in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+                    self._conn = None
+                return None
+            except sqlite3.Error:
+                self._conn = None
+                return None
+
+    def _check_data_version(self):
+        if self.db_path is None:
+            return
+        version = self._read_data_version()
+        if version is None:
+            return
+        with self._lock:
+            if version != self._data_version:
+                if self._data_version is not None:
+                    self.invalidations += 1
+                self.entries.clear()
+                self._data_version = version
+
+    def get(self, email: str) -> Optional[UserRecord]:
+        self._check_data_version()
+        with self._lock:
+            entry = self.entries.get(email)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(email)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, record: UserRecord):
+        with self._lock:
+            self.entries[record.email] = (time.monotonic() + self.ttl, record)
+            self.entries.move_to_end(record.email)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def sync(self):
+        """Apply writes from other processes committed so far (called before a local write)."""
+        self._check_data_version()
+
+    def local_commit(self):
+        """A session of this process committed: its writes already invalidated their own entries."""
+        if self.db_path is None:
+            return
+        version = self._read_data_version()
+        if version is not None:
+            with self._lock:
+                self._data_version = version
+
+    def invalidate(self, email: str):
+        with self._lock:
+            self.entries.pop(email, None)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "external_invalidations": self.invalidations,
+            "ttl": self.ttl,
+        }
+
+
+user_cache = UserCache(db_path=engine.url.database if engine.url.get_backend_name() == "sqlite" else None)
+
+
+# Local writes. External changes are applied just before a session's first write, while it does not
+# hold SQLite's write lock yet; the version change caused by its own commit is then taken as the new
+# baseline. A commit by another process in the gap between the two is only picked up by the TTL.
+def _user_cache_write(session):
+    if session.bind is engine and not session.info.get("user_cache_write"):
+        user_cache.sync()
+        session.info["user_cache_write"] = True
+
+
+@event.listens_for(Session, "before_flush")
+def _user_cache_flush(session, flush_context, instances):
+    _user_cache_write(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _user_cache_bulk_write(orm_execute_state):
+    # query().update()/delete() and bulk inserts bypass the flush
+    if not orm_execute_state.is_select:
+        _user_cache_write(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_commit")
+def _user_cache_local_commit(session):
+    if session.info.pop("user_cache_write", False):
+        user_cache.local_commit()
+
+
+@event.listens_for(Session, "after_rollback")
+def _user_cache_rollback(session):
+    session.info.pop("user_cache_write", None)
+
+
+def get_user_record(db: Session, identifier: Union[str, int]) -> Optional[UserRecord]:
+    """Cached, read-only lookup by email (ids are not cached); use get_user_by_email to modify a user."""
+    if isinstance(identifier, str) and not identifier.isdigit():
+        record = user_cache.get(identifier)
+        if record is not None:
+            return record
+    user = get_user_by_email(db, identifier)
+    if user is None:
+        return None
+    record = UserRecord.from_user(user)
+    user_cache.put(record)
+    return record
+
 
 def get_user_by_email(db: Session, identifier: Union[str, int]) -> Optional[User]:
     """Return a user by email (str) or ID (int/str digits)."""
@@ -18,38 +201,122 @@ def get_user_by_email(db: Session, identifier: Union[str, int]) -> Optional[User
 
 def create_user(db: Session, email: str, hashed_password: str, verification_token: str = None) -> User:
     """Create a new user with a hashed password and return the instance."""
-    expires_at = datetime.utcnow() + timedelta(minutes=3) if verification_token else None
+    now = datetime.utcnow()
     user = User(
         email=email, 
         hashed_password=hashed_password, 
-        verification_token=verification_token,
-        verification_token_expires_at=expires_at,
-        last_verification_request_at=datetime.utcnow() if verification_token else None,
+        last_verification_request_at=now if verification_token else None,
         verification_request_count=1 if verification_token else 0
     )
     db.add(user)
+    if verification_token:
+        db.flush()  # assigns user.id
+        issue_verification_token(db, user, verification_token, now + VERIFICATION_TOKEN_TTL)
     db.commit()
     db.refresh(user)
+    user_cache.invalidate(email)
     return user
 
-def verify_user(db: Session, token: str) -> bool:
-    user = db.query(User).filter(User.verification_token == token).first()
-    if user:
-        if user.verification_token_expires_at and user.verification_token_expires_at < datetime.utcnow():
-            return False
-            
-        user.is_verified = 1
-        user.verification_token = None
-        user.verification_token_expires_at = None
+def get_token_version(db: Session, email: str) -> Optional[int]:
+    """Current token_version of a user (None if the user does not exist)."""
+    record = get_user_record(db, email)
+    return None if record is None else record.token_version
+
+def bump_token_version(user: User) -> None:
+    """Outdate every access token issued so far (their role/is_verified claims changed); caller commits."""
+    user.token_version = (user.token_version or 0) + 1
+
+def hash_verification_token(token: str) -> str:
+    # Tokens are random UUIDs, so a plain (unsalted) sha256 is enough to make a DB leak useless
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_verification_token(db: Session, user: User, token: str, expires_at: datetime) -> None:
+    """Store `token` (hashed) as the user's only verification token; caller commits."""
+    db.query(VerificationToken).filter(VerificationToken.user_id == user.id).delete(synchronize_session=False)
+    db.add(VerificationToken(token_hash=hash_verification_token(token), user_id=user.id, expires_at=expires_at))
+
+def find_verification_token(db: Session, token: str) -> Optional[VerificationToken]:
+    # Unique index on token_hash: one B-tree probe however many users there are
+    return db.query(VerificationToken).filter(VerificationToken.token_hash == hash_verification_token(token)).first()
+
+def verify_user(db: Session, token: str) -> Optional[User]:
+    """Mark the owner of a valid verification token as verified and return them (None if invalid/expired)."""
+    row = find_verification_token(db, token)
+    if row is None or row.expires_at < datetime.utcnow():
+        return None
+    user = db.query(User).filter(User.id == row.user_id).first()
+    if user is None:
+        return None
+
+    user.is_verified = 1
+    db.query(VerificationToken).filter(VerificationToken.user_id == user.id).delete(synchronize_session=False)
+    bump_token_version(user)
+    db.commit()
+    user_cache.invalidate(user.email)
+    return user
+
+def sweep_expired_verification_tokens(db: Session, batch_size: int = 1000, now: Optional[datetime] = None, pause: float = 0.05) -> int:
+    """Delete expired tokens in batches of `batch_size` (one short transaction each); returns the count.
+
+    Sleeps `pause` seconds between batches: SQLite's busy handler polls with growing sleeps, so
+    without a gap another connection waiting for the write lock keeps losing it to the next batch.
+    """
+    now = now or datetime.utcnow()
+    deleted = 0
+    while True:
+        if deleted:
+            time.sleep(pause)
+        ids = [row[0] for row in db.query(VerificationToken.id).filter(VerificationToken.expires_at < now).limit(batch_size)]
+        if not ids:
+            return deleted
+        db.query(VerificationToken).filter(VerificationToken.id.in_(ids)).delete(synchronize_session=False)
         db.commit()
-        return True
-    return False
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
+
+def migrate_plaintext_verification_tokens(db: Session, batch_size: int = 10000) -> int:
+    """Move tokens from the old users.verification_token column into verification_tokens (hashed)."""
+    now = datetime.utcnow()
+    migrated = 0
+    last_id = 0
+    while True:
+        # Walk the primary key, so each batch starts where the previous one stopped
+        rows = (
+            db.query(User.id, User.verification_token, User.verification_token_expires_at)
+            .filter(User.id > last_id, User.verification_token.isnot(None))
+            .order_by(User.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return migrated
+        ids = [user_id for user_id, _, _ in rows]
+        last_id = ids[-1]
+        db.query(VerificationToken).filter(VerificationToken.user_id.in_(ids)).delete(synchronize_session=False)
+        db.bulk_insert_mappings(VerificationToken, [
+            {"token_hash": hash_verification_token(token), "user_id": user_id, "expires_at": expires_at or now + VERIFICATION_TOKEN_TTL}
+            for user_id, token, expires_at in rows
+        ])
+        db.query(User).filter(User.id.in_(ids)).update(
+            {User.verification_token: None, User.verification_token_expires_at: None}, synchronize_session=False
+        )
+        db.commit()
+        migrated += len(rows)
+
+def lock_user(db: Session, email: str, until: datetime) -> None:
+    """Persist a login lockout in the is_blocked/blocked_until columns."""
+    db.query(User).filter(User.email == email).update({User.is_blocked: 1, User.blocked_until: until})
+    db.commit()
+    user_cache.invalidate(email)
 
 def make_user_admin(db: Session, email: str) -> bool:
     user = get_user_by_email(db, email)
     if user:
         user.role = "admin"
+        bump_token_version(user)
         db.commit()
         db.refresh(user)
+        user_cache.invalidate(user.email)
         return True
     return False
@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from services.common.deadline import check_deadline
+from services.common.timing import span
+
+# bcrypt runs in its own processes: it does not hold the GIL or Starlette's shared threadpool,
+# so /me and /refresh keep their capacity during a burst of logins, and throughput scales with cores.
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Calls allowed to wait for a worker; beyond that /login and /register answer 503 immediately
+HASH_QUEUE = int(os.getenv("AUTH_HASH_QUEUE", str(HASH_WORKERS * 4)))
+
+logger = logging.getLogger("AuthHashing")
+
+
+def _hash(password: str) -> str:
+    from .security import pwd_context
+    return pwd_context.hash(password)
+
+
+def _verify(plain: str, hashed: str) -> bool:
+    from .security import pwd_context
+    return pwd_context.verify(plain, hashed)
+
+
+def _warm_up() -> None:
+    from . import security  # noqa: F401  (imports passlib/bcrypt in the worker)
+
+
+class HashPool:
+    """Process pool for password hashing with admission control.
+
+    At most `workers` hashes run at once and `queue` more may wait; any call past that is
+    refused with 503 + Retry-After instead of piling up behind bcrypt.
+    """
+
+    def __init__(self, workers: int = HASH_WORKERS, queue: int = HASH_QUEUE):
+        self.workers = max(1, workers)
+        self.queue = max(0, queue)
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        self.restarts = 0
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            # spawn: the same on every platform, and safe to start from a process that already has threads
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            for _ in range(self.workers):
+                self._executor.submit(_warm_up)
+            logger.info(f"Password hashing pool: {self.workers} processes, queue {self.queue}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def restart(self, broken):
+        """Replace `broken` with a fresh pool, once however many calls saw it fail."""
+        if self._executor is broken:
+            logger.error("Password hashing pool broke (a worker died), starting a new one")
+            self._executor = None
+            self.restarts += 1
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.start()
+
+    def retry_after(self) -> int:
+        # Time to drain the queue at the average hash duration, at least one second
+        average = self.busy_seconds / self.completed if self.completed else 0.3
+        return max(1, round(average * (self.in_flight / self.workers)))
+
+    async def run(self, func, *args):
+        check_deadline()
+        if self.in_flight >= self.workers + self.queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication is busy, please retry",
+                headers={"Retry-After": str(self.retry_after())},
+            )
+        self.start()
+        executor = self._executor
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            with span("hash"):
+                return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); the pool refuses all work from now on, so replace it
+            self.restart(executor)
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication is busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - start
+
+    async def hash(self, password: str) -> str:
+        return await self.run(_hash, password)
+
+    async def verify(self, plain: str, hashed: str) -> bool:
+        return await self.run(_verify, plain, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue": self.queue,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+        }
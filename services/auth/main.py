@@ -1,41 +1,118 @@
 from datetime import datetime, timedelta
+from typing import Union
+import os
+import math
+import asyncio
+import logging
 import re
 import uuid
-from fastapi import FastAPI, Form, Depends, HTTPException, Cookie
+from fastapi import FastAPI, Form, Depends, HTTPException, Cookie, Request, Response
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from .database import engine, SessionLocal
 from .models import Base, User
-from .crud import get_user_by_email, create_user
-from .security import verify_password, hash_password, create_access_token, decode_access_token, create_refresh_token, decode_refresh_token
+from .crud import get_user_by_email, get_user_record, create_user, lock_user, get_token_version, user_cache, UserRecord
+from .crud import VERIFICATION_TOKEN_TTL, issue_verification_token, migrate_plaintext_verification_tokens, sweep_expired_verification_tokens
+from .security import create_access_token, decode_access_token, create_refresh_token, decode_refresh_token
+from .hashing import HashPool
+from .throttle import LoginThrottle, THROTTLE_PERSIST, client_ip
+from .token_versions import TokenVersionCache
+from services.common.metrics import instrument
+from services.common.profiler import install_profiler
+from services.common.deadline import deadline_dependency
+from services.common.timing import TimingMiddleware
 
 # ... Инициализация ---
 def run_migrations():
-    import sqlite3
-    from .database import DB_PATH
+    # Columns added after the first release; runs against AUTH_DATABASE_URL, like the rest of the service
+    from sqlalchemy import inspect, text
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        if not inspect(engine).has_table("users"):
+            return
+        existing = {column["name"] for column in inspect(engine).get_columns("users")}
         columns = [
             ("verification_token_expires_at", "DATETIME"),
             ("last_verification_request_at", "DATETIME"),
             ("verification_request_count", "INTEGER DEFAULT 0"),
             ("is_blocked", "INTEGER DEFAULT 0"),
-            ("blocked_until", "DATETIME")
+            ("blocked_until", "DATETIME"),
+            ("token_version", "INTEGER DEFAULT 0")
         ]
-        for col_name, col_type in columns:
-            try:
-                cursor.execute(f"ALTER TABLE users ADD COLUMN {col_name} {col_type}")
-            except sqlite3.OperationalError:
-                pass
-        conn.commit()
-        conn.close()
+        with engine.begin() as conn:
+            for col_name, col_type in columns:
+                if col_name not in existing:
+                    conn.execute(text(f"ALTER TABLE users ADD COLUMN {col_name} {col_type}"))
     except Exception as e:
         print(f"Migration error: {e}")
 
+logger = logging.getLogger("AuthService")
+
+# Expired verification tokens are deleted in batches every AUTH_TOKEN_SWEEP_INTERVAL seconds
+TOKEN_SWEEP_INTERVAL = float(os.getenv("AUTH_TOKEN_SWEEP_INTERVAL", "300"))
+TOKEN_SWEEP_BATCH = int(os.getenv("AUTH_TOKEN_SWEEP_BATCH", "1000"))
+
 run_migrations()
 Base.metadata.create_all(bind=engine)
-app = FastAPI(title="Auth Service")
+with SessionLocal() as _db:
+    _migrated = migrate_plaintext_verification_tokens(_db)
+    if _migrated:
+        logger.info(f"Moved {_migrated} plaintext verification tokens to verification_tokens")
+app = FastAPI(title="Auth Service", dependencies=[Depends(deadline_dependency())])
+metrics = instrument(app, "auth")
+install_profiler(app, "auth")
+app.add_middleware(TimingMiddleware, service="auth")
+
+hash_pool = HashPool()
+metrics.callback("auth_hash_in_flight", "Password hashes running or queued", (), lambda: {(): hash_pool.in_flight})
+metrics.callback("auth_hash_rejected_total", "Logins/registrations refused with 503 by the hashing pool", (), lambda: {(): hash_pool.rejected}, kind="counter")
+
+login_throttle = LoginThrottle()
+metrics.callback("auth_login_throttled_total", "Logins refused with 429 before verifying the password", (), lambda: {(): login_throttle.rejected}, kind="counter")
+metrics.callback("auth_user_cache_lookups_total", "User lookups by cache result", ("result",), lambda: {("hit",): user_cache.hits, ("miss",): user_cache.misses}, kind="counter")
+metrics.callback("auth_user_cache_hit_ratio", "Share of user lookups served from the cache", (), lambda: {(): user_cache.stats()["hit_ratio"]})
+
+@app.on_event("startup")
+def start_hash_pool():
+    hash_pool.start()
+
+@app.on_event("shutdown")
+def stop_hash_pool():
+    hash_pool.shutdown()
+
+async def sweep_verification_tokens():
+    while True:
+        await asyncio.sleep(TOKEN_SWEEP_INTERVAL)
+        try:
+            with SessionLocal() as db:
+                deleted = await run_in_threadpool(sweep_expired_verification_tokens, db, TOKEN_SWEEP_BATCH)
+            if deleted:
+                logger.info(f"Deleted {deleted} expired verification tokens")
+        except Exception as e:
+            logger.error(f"Verification token sweep failed: {e}")
+
+_sweeper_task = None
+
+@app.on_event("startup")
+async def start_token_sweeper():
+    global _sweeper_task
+    _sweeper_task = asyncio.create_task(sweep_verification_tokens())
+
+@app.on_event("shutdown")
+async def stop_token_sweeper():
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+
+token_versions = TokenVersionCache()
+
+def access_token_for(user: Union[User, UserRecord]) -> str:
+    # Everything /me answers, so it needs no DB read; `ver` lets later changes outdate the token
+    return create_access_token({
+        "sub": user.email,
+        "role": user.role,
+        "is_verified": user.is_verified,
+        "ver": user.token_version or 0,
+    })
 
 @app.get("/health")
 def health():
@@ -51,9 +128,10 @@ def get_db():
 
 
 # --- Регистрация ---
+# register/login are async: bcrypt runs in hash_pool and the short DB calls in the threadpool
 @app.post("/register")
-def register(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    if get_user_by_email(db, email):
+async def register(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+    if await run_in_threadpool(get_user_record, db, email):
         raise HTTPException(status_code=400, detail="Цей Email вже зареєстрований")
 
     # Minimum length validation
@@ -64,12 +142,12 @@ def register(email: str = Form(...), password: str = Form(...), db: Session = De
     if not re.match(r"^[a-zA-Z0-9!@#$%^&*()_+\-=\[\]{};':\"\\|,.<>\/?]+$", password):
         raise HTTPException(status_code=400, detail="Пароль має містити лише англійські літери та символи")
 
-    hashed = hash_password(password)
+    hashed = await hash_pool.hash(password)
     verification_token = str(uuid.uuid4())
-    user = create_user(db, email, hashed, verification_token=verification_token)
+    user = await run_in_threadpool(create_user, db, email, hashed, verification_token=verification_token)
 
     # создаём токены сразу после регистрации
-    access_token = create_access_token({"sub": user.email, "role": user.role})
+    access_token = access_token_for(user)
     refresh_token = create_refresh_token({"sub": user.email})
 
     return JSONResponse(
@@ -123,15 +201,16 @@ def resend_verification(email: str = Form(...), db: Session = Depends(get_db)):
         user.is_blocked = 1
         user.blocked_until = now + timedelta(minutes=10)
         db.commit()
+        user_cache.invalidate(user.email)
         raise HTTPException(status_code=429, detail="Maximum attempts reached. Blocked for 10 minutes.")
 
     # Generate new token
     new_token = str(uuid.uuid4())
-    user.verification_token = new_token
-    user.verification_token_expires_at = now + timedelta(minutes=3)
+    issue_verification_token(db, user, new_token, now + VERIFICATION_TOKEN_TTL)
     user.last_verification_request_at = now
     
     db.commit()
+    user_cache.invalidate(user.email)
     
     return {
         "message": "New verification link sent.",
@@ -139,26 +218,52 @@ def resend_verification(email: str = Form(...), db: Session = Depends(get_db)):
         "email": user.email
     }
 
+# Tells the gateway to drop its cached claims for a user whose role/verification changed
+CLAIMS_CHANGED_HEADER = "X-Auth-Invalidate"
+
 @app.get("/verify/{token}")
-def verify(token: str, db: Session = Depends(get_db)):
+def verify(token: str, response: Response, db: Session = Depends(get_db)):
     from .crud import verify_user
-    if verify_user(db, token):
+    user = verify_user(db, token)
+    if user:
+        token_versions.set(user.email, user.token_version)
+        response.headers[CLAIMS_CHANGED_HEADER] = user.email
         return {"message": "Email verified successfully"}
     raise HTTPException(status_code=400, detail="Invalid or expired token")
 
 
 # --- Логин ---
+def _too_many_attempts(retry_after: float):
+    return HTTPException(
+        status_code=429,
+        detail="Too many failed login attempts. Please try again later.",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
 @app.post("/login")
-def login(email: str = Form(None), username: str = Form(None), password: str = Form(...), db: Session = Depends(get_db)):
+async def login(request: Request, email: str = Form(None), username: str = Form(None), password: str = Form(...), db: Session = Depends(get_db)):
     login_id = email or username
     if not login_id:
         raise HTTPException(status_code=422, detail="Email or username is required")
-    
-    user = get_user_by_email(db, login_id)
-    if not user or not verify_password(password, user.hashed_password):
+
+    # Throttled attempts are refused before the user lookup and bcrypt
+    ip = client_ip(request)
+    retry_after = login_throttle.retry_after(login_id, ip)
+    if retry_after:
+        raise _too_many_attempts(retry_after)
+
+    user = await run_in_threadpool(get_user_record, db, login_id)
+    now = datetime.utcnow()
+    if THROTTLE_PERSIST and user and user.is_blocked and user.blocked_until and user.blocked_until > now:
+        login_throttle.rejected += 1
+        raise _too_many_attempts((user.blocked_until - now).total_seconds())
+    if not user or not await hash_pool.verify(password, user.hashed_password):
+        if login_throttle.failure(login_id, ip) and THROTTLE_PERSIST and user:
+            await run_in_threadpool(lock_user, db, user.email, now + timedelta(seconds=login_throttle.window))
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    login_throttle.success(login_id)
 
-    access_token = create_access_token({"sub": user.email, "role": user.role})
+    access_token = access_token_for(user)
     refresh_token = create_refresh_token({"sub": user.email})
 
     return JSONResponse(
@@ -182,11 +287,20 @@ def me(access_token: str = Cookie(None), db: Session = Depends(get_db)):
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = get_user_by_email(db, payload.get("sub"))
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    email = payload.get("sub")
+    if "ver" not in payload:
+        # Issued before tokens carried their claims
+        user = get_user_record(db, email)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        return {"email": user.email, "role": user.role, "is_verified": user.is_verified}
 
-    return {"email": user.email, "role": user.role, "is_verified": user.is_verified}
+    current = token_versions.get(email, lambda e: get_token_version(db, e))
+    if current is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if payload["ver"] != current:
+        raise HTTPException(status_code=401, detail="Token outdated, please log in again")
+    return {"email": email, "role": payload.get("role"), "is_verified": payload.get("is_verified")}
 
 
 @app.post("/refresh")
@@ -198,11 +312,11 @@ def refresh(refresh_token: str = Cookie(None), db: Session = Depends(get_db)):
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
-    user = get_user_by_email(db, payload.get("sub"))
+    user = get_user_record(db, payload.get("sub"))
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
-    new_access_token = create_access_token({"sub": user.email, "role": user.role})
+    new_access_token = access_token_for(user)
     new_refresh_token = create_refresh_token({"sub": user.email})
 
     return JSONResponse(
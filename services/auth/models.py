@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
 from sqlalchemy.orm import declarative_base, relationship
 from .database import Base
 
@@ -12,9 +12,20 @@ class User(Base):
     hashed_password = Column(String(255), nullable=False)
     role = Column(String(50), default="user")  # user | admin
     is_verified = Column(Integer, default=0)    # 0 for False, 1 for True (SQLite compatible)
+    # Legacy plaintext token columns: moved into verification_tokens at startup, no longer written
     verification_token = Column(String(255), nullable=True)
     verification_token_expires_at = Column(DateTime, nullable=True)
     last_verification_request_at = Column(DateTime, nullable=True)
     verification_request_count = Column(Integer, default=0)
     is_blocked = Column(Integer, default=0)
     blocked_until = Column(DateTime, nullable=True)
+    token_version = Column(Integer, default=0)   # bumped when claims in issued tokens go stale
+
+
+class VerificationToken(Base):
+    """Email verification tokens, stored as sha256 hex digests (the plain token only goes out by email)."""
+    __tablename__ = "verification_tokens"
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    expires_at = Column(DateTime, index=True, nullable=False)
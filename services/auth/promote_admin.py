@@ -18,6 +18,7 @@ class User(Base):
     role = Column(String(50), default="user")
     is_verified = Column(Integer, default=0)
     verification_token = Column(String(255), nullable=True)
+    token_version = Column(Integer, default=0)
 
 def promote():
     db = SessionLocal()
@@ -25,6 +26,8 @@ def promote():
     user = db.query(User).filter(User.email == email).first()
     if user:
         user.role = "admin"
+        # Outdates tokens carrying the old role (the auth service notices within AUTH_TOKEN_VERSION_TTL)
+        user.token_version = (user.token_version or 0) + 1
         db.commit()
         print(f"Successfully promoted {email} to admin.")
     else:
@@ -2,15 +2,22 @@ import os
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
+from services.common.timing import span
+from services.common.deadline import check_deadline
 
 # хэширование пароля
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is the most expensive step of a request, so it is skipped once the caller has given up
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    check_deadline()
+    with span("hash"):
+        return pwd_context.hash(password)
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+    check_deadline()
+    with span("hash"):
+        return pwd_context.verify(plain, hashed)
 
 # JWT
 SECRET_KEY = os.getenv("SECRET_KEY")
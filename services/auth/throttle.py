@@ -0,0 +1,115 @@
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+from services.common.client_ip import signed_client_ip
+
+# Failed logins allowed per window before further attempts are refused without running bcrypt
+THROTTLE_WINDOW = float(os.getenv("AUTH_THROTTLE_WINDOW", "300"))
+THROTTLE_MAX_PER_ACCOUNT = int(os.getenv("AUTH_THROTTLE_MAX_PER_ACCOUNT", "5"))
+THROTTLE_MAX_PER_IP = int(os.getenv("AUTH_THROTTLE_MAX_PER_IP", "30"))
+# Memory budget: keys tracked per table; the least recently used key is dropped first
+THROTTLE_MAX_KEYS = int(os.getenv("AUTH_THROTTLE_MAX_KEYS", "100000"))
+# Also lock the account in users.is_blocked/blocked_until, so the lock survives restarts
+# and is shared between auth instances
+THROTTLE_PERSIST = os.getenv("AUTH_THROTTLE_PERSIST", "").lower() in ("1", "true", "yes")
+# Peers whose X-Forwarded-For is trusted (the gateway appends the address it saw as the last entry)
+TRUSTED_PROXIES = {p.strip() for p in os.getenv("AUTH_TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if p.strip()}
+
+
+def client_ip(request) -> str:
+    # The gateway's signed X-Client-IP works across hosts; X-Forwarded-For only from TRUSTED_PROXIES
+    from .security import SECRET_KEY
+    signed = signed_client_ip(request.headers, SECRET_KEY)
+    if signed:
+        return signed
+    peer = request.client.host if request.client else "unknown"
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and peer in TRUSTED_PROXIES:
+        # Earlier entries are whatever the client sent; only the proxy's own entry can be trusted
+        return forwarded.split(",")[-1].strip() or peer
+    return peer
+
+
+class FailureWindow:
+    """Sliding-window failure timestamps per key, bounded to `max_keys` keys (LRU)."""
+
+    def __init__(self, limit: int, window: float = THROTTLE_WINDOW, max_keys: int = THROTTLE_MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._failures: "OrderedDict[str, deque]" = OrderedDict()
+        self.evictions = 0
+
+    def retry_after(self, key: str, now: float) -> float:
+        """Seconds until `key` may try again; 0 while it is under the limit."""
+        failures = self._failures.get(key)
+        if failures is None:
+            return 0.0
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return 0.0
+        if len(failures) < self.limit:
+            return 0.0
+        return failures[0] + self.window - now
+
+    def record(self, key: str, now: float) -> bool:
+        """Count a failure; True when it brings `key` to the limit."""
+        failures = self._failures.get(key)
+        if failures is None:
+            # Only the newest `limit` timestamps matter for the window
+            failures = self._failures[key] = deque(maxlen=self.limit)
+            if len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._failures.move_to_end(key)
+        failures.append(now)
+        return len(failures) >= self.limit and failures[0] > now - self.window
+
+    def reset(self, key: str):
+        self._failures.pop(key, None)
+
+    def __len__(self):
+        return len(self._failures)
+
+
+class LoginThrottle:
+    """Refuses logins for an account or IP with too many recent failures, before bcrypt runs."""
+
+    def __init__(self, max_per_account: int = THROTTLE_MAX_PER_ACCOUNT, max_per_ip: int = THROTTLE_MAX_PER_IP,
+                 window: float = THROTTLE_WINDOW, max_keys: int = THROTTLE_MAX_KEYS):
+        self.window = window
+        self.accounts = FailureWindow(max_per_account, window, max_keys)
+        self.ips = FailureWindow(max_per_ip, window, max_keys)
+        self.rejected = 0
+
+    @staticmethod
+    def _account(login_id: str) -> str:
+        return login_id.strip().lower()
+
+    def retry_after(self, login_id: str, ip: str, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        wait = max(self.accounts.retry_after(self._account(login_id), now), self.ips.retry_after(ip, now))
+        if wait > 0:
+            self.rejected += 1
+        return wait
+
+    def failure(self, login_id: str, ip: str, now: Optional[float] = None) -> bool:
+        """Record a failed attempt; True when the account has just reached its limit."""
+        now = time.monotonic() if now is None else now
+        self.ips.record(ip, now)
+        return self.accounts.record(self._account(login_id), now)
+
+    def success(self, login_id: str):
+        self.accounts.reset(self._account(login_id))
+
+    def stats(self) -> dict:
+        return {
+            "accounts_tracked": len(self.accounts),
+            "ips_tracked": len(self.ips),
+            "rejected": self.rejected,
+            "evictions": self.accounts.evictions + self.ips.evictions,
+        }
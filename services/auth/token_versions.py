@@ -0,0 +1,45 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# How long a user's token_version is trusted before re-reading it. Changes made by this process
+# are applied immediately; the TTL bounds staleness for changes made by another auth instance
+# or by scripts such as promote_admin.py.
+TOKEN_VERSION_TTL = float(os.getenv("AUTH_TOKEN_VERSION_TTL", "30"))
+TOKEN_VERSION_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_VERSION_CACHE_SIZE", "100000"))
+
+
+class TokenVersionCache:
+    """email -> current users.token_version, so /me can reject outdated tokens without a DB read."""
+
+    def __init__(self, ttl: float = TOKEN_VERSION_TTL, max_size: int = TOKEN_VERSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # {email: (expires_at, version)}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email: str, load: Callable[[str], Optional[int]]) -> Optional[int]:
+        """Cached version for `email`, calling load(email) on a miss; None for unknown users."""
+        entry = self.entries.get(email)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self.entries.move_to_end(email)
+            return entry[1]
+        self.misses += 1
+        version = load(email)
+        if version is None:
+            self.entries.pop(email, None)
+        else:
+            self.set(email, version)
+        return version
+
+    def set(self, email: str, version: int):
+        self.entries[email] = (time.monotonic() + self.ttl, version)
+        self.entries.move_to_end(email)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
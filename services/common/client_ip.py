@@ -0,0 +1,29 @@
+import hmac
+import hashlib
+from typing import Optional
+
+# The gateway forwards the caller's address here, signed with the shared SECRET_KEY, so services
+# can trust it whichever host or load balancer the call came through
+CLIENT_IP_HEADER = "X-Client-IP"
+CLIENT_IP_SIGNATURE_HEADER = "X-Client-IP-Signature"
+
+
+def sign_client_ip(ip: str, key: str) -> str:
+    return hmac.new(key.encode(), ip.encode(), hashlib.sha256).hexdigest()
+
+
+def client_ip_headers(ip: str, key: Optional[str]) -> dict:
+    if not key:
+        return {}
+    return {CLIENT_IP_HEADER: ip, CLIENT_IP_SIGNATURE_HEADER: sign_client_ip(ip, key)}
+
+
+def signed_client_ip(headers, key: Optional[str]) -> Optional[str]:
+    """The forwarded client IP when its signature checks out, else None."""
+    ip = headers.get(CLIENT_IP_HEADER)
+    signature = headers.get(CLIENT_IP_SIGNATURE_HEADER)
+    if not key or not ip or not signature:
+        return None
+    if not hmac.compare_digest(signature, sign_client_ip(ip, key)):
+        return None
+    return ip
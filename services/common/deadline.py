@@ -0,0 +1,73 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import HTTPException, Request
+
+# Remaining budget in milliseconds, set by the gateway on every upstream call
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+# Absolute deadline on the time.monotonic() clock; None when the caller set no budget
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None without a deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check_deadline():
+    """Refuse to start (more) work for a request the caller has already given up on."""
+    if expired():
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
+
+def timeout(default: float) -> float:
+    """Outbound timeout capped to the remaining budget."""
+    left = remaining()
+    if left is None:
+        return default
+    return max(0.001, min(default, left))
+
+
+def outbound_headers() -> dict:
+    left = remaining()
+    if left is None:
+        return {}
+    return {DEADLINE_HEADER: str(max(0, int(left * 1000)))}
+
+
+def set_deadline(budget: float):
+    _deadline.set(time.monotonic() + budget)
+
+
+def deadline_dependency(default_budget: float = None):
+    """FastAPI dependency reading the budget header; requests that arrive already expired get a 504.
+
+    `default_budget` (seconds) applies when the header is missing; a header can only shorten it.
+    """
+
+    async def enforce_deadline(request: Request):
+        budget = default_budget
+        header = request.headers.get(DEADLINE_HEADER)
+        if header is not None:
+            try:
+                requested = int(header) / 1000
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid {DEADLINE_HEADER} header")
+            budget = requested if budget is None else min(budget, requested)
+        if budget is None:
+            _deadline.set(None)
+            return
+        if budget <= 0:
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+        set_deadline(budget)
+
+    return enforce_deadline
@@ -0,0 +1,180 @@
+import time
+from bisect import bisect_left
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+# Fixed latency buckets in seconds, shared by every service so dashboards can aggregate them
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metrics are only updated from the event loop thread (ASGI middleware, async proxy code),
+# so plain dict/list updates are safe and recording needs no locks.
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.series = {}
+
+    def observe(self, labels, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total!r}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Callback:
+    """Value read at scrape time from `func() -> {label values tuple: number}` (pool sizes, existing stats)."""
+
+    def __init__(self, name: str, help: str, labelnames, func, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self.kind = kind
+
+    def samples(self):
+        for labels, value in self.func().items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self, service: str):
+        self.service = service
+        self.metrics = []
+        self.requests = self.counter("http_requests_total", "HTTP requests by route and status code", ("service", "route", "method", "status"))
+        self.latency = self.histogram("http_request_duration_seconds", "HTTP request latency by route", ("service", "route", "method"))
+        self.in_progress = 0
+        self.callback("http_requests_in_progress", "HTTP requests currently being served", ("service",), lambda: {(self.service,): self.in_progress})
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, labelnames, func, kind: str = "gauge") -> Callback:
+        return self._add(Callback(name, help, labelnames, func, kind))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+def route_template(scope) -> str:
+    # Label by the route pattern ("/orders/{order_id}"), never the raw path, to keep cardinality bounded
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    root_path = scope.get("root_path", "")
+    if root_path:
+        return root_path + "/*"  # mounted app, e.g. /static
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware recording the request counter and latency histogram."""
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        registry = self.registry
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        registry.in_progress += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            registry.in_progress -= 1
+            route = route_template(scope)
+            method = scope["method"]
+            registry.requests.inc((registry.service, route, method, str(status)))
+            registry.latency.observe((registry.service, route, method), time.perf_counter() - start)
+
+
+def instrument(app, service: str, authorize=None) -> MetricsRegistry:
+    """Add the metrics middleware and a GET /metrics route to a FastAPI app.
+
+    `authorize(request) -> bool`, when given, guards the route (403 otherwise).
+    """
+    registry = MetricsRegistry(service)
+    app.add_middleware(MetricsMiddleware, registry=registry)
+
+    async def metrics(request: Request):
+        if authorize is not None and not authorize(request):
+            return PlainTextResponse("Forbidden", status_code=403)
+        return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+    return registry
@@ -0,0 +1,215 @@
+import os
+import sys
+import hmac
+import time
+import marshal
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import Optional
+from jose import jwt, JWTError
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import compile_path
+
+# Off unless PROFILER_ENABLED is set: then install_profiler() adds neither a middleware nor a route.
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "").lower() in ("1", "true", "yes")
+# Alternative to an admin access token, for calling a service port directly
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+
+TOKEN_HEADER = "X-Profile-Token"
+
+logger = logging.getLogger("Profiler")
+
+# Stacks whose innermost frame is in one of these modules are threads waiting for work
+# (the event loop in select(), idle threadpool workers) and are counted, not recorded.
+_IDLE_FILES = tuple(os.sep + name for name in ("selectors.py", "threading.py", "queue.py"))
+
+
+class Capture:
+    """Samples the stacks of every thread (sys._current_frames) from a background thread.
+
+    With `route` set, samples are only taken while a matching request is in flight, and the
+    capture completes after `requests` of them; otherwise it runs until stop().
+    """
+
+    def __init__(self, interval: float, route: Optional[str] = None, requests: int = 1):
+        self.interval = interval
+        self.route = route
+        self._route_regex = compile_path(route)[0] if route else None
+        self.requests = requests
+        self.started = 0
+        self.finished = 0
+        self.active = 0
+        self.samples = Counter()
+        self.idle_samples = 0
+        self.done = asyncio.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.monotonic() - self.started_at
+
+    def wants(self, path: str) -> bool:
+        if self.route is None or self.started >= self.requests:
+            return False
+        return path == self.route or self._route_regex.match(path) is not None
+
+    def request_started(self):
+        self.started += 1
+        self.active += 1
+
+    def request_finished(self):
+        self.active -= 1
+        self.finished += 1
+        if self.finished >= self.requests:
+            self.done.set()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if self.route is not None and self.active == 0:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if stack[0][0].endswith(_IDLE_FILES):
+                    self.idle_samples += 1
+                    continue
+                self.samples[tuple(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's folded format ('outer;inner;leaf count'), for flamegraph.pl or speedscope."""
+        lines = []
+        for stack, count in self.samples.most_common():
+            frames = ";".join(f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in stack)
+            lines.append(f"{frames} {count}")
+        return "\n".join(lines) + "\n"
+
+    def pstats(self) -> bytes:
+        """The samples as a marshalled pstats table (pstats.Stats(path)); times are samples * interval."""
+        stats = {}
+        for stack, count in self.samples.items():
+            seconds = count * self.interval
+            for func in set(stack):
+                cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+                stats[func] = (cc + count, nc + count, tt, ct + seconds, callers)
+            leaf = stack[-1]
+            cc, nc, tt, ct, callers = stats[leaf]
+            stats[leaf] = (cc, nc, tt + seconds, ct, callers)
+            for caller, callee in set(zip(stack, stack[1:])):
+                callers = stats[callee][4]
+                c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                c_tt += seconds if callee == leaf else 0.0
+                callers[caller] = (c_cc + count, c_nc + count, c_tt, c_ct + seconds)
+        return marshal.dumps(stats)
+
+
+class Profiler:
+    def __init__(self, service: str):
+        self.service = service
+        self.capture: Optional[Capture] = None
+
+
+class ProfilerMiddleware:
+    """Pure ASGI middleware; outside a route capture it is a single attribute check."""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        capture = self.profiler.capture
+        if capture is None or scope["type"] != "http" or not capture.wants(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        capture.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            capture.request_finished()
+
+
+def is_admin(request: Request) -> bool:
+    """An admin access token (cookie or Bearer), or the PROFILER_TOKEN secret."""
+    header_token = request.headers.get(TOKEN_HEADER, "")
+    if PROFILER_TOKEN and hmac.compare_digest(header_token, PROFILER_TOKEN):
+        return True
+    token = request.cookies.get("access_token")
+    auth_header = request.headers.get("Authorization", "")
+    if not token and auth_header.startswith("Bearer "):
+        token = auth_header.split(" ", 1)[1]
+    secret = os.getenv("SECRET_KEY")
+    if not token or not secret:
+        return False
+    try:
+        payload = jwt.decode(token, secret, algorithms=["HS256"])
+    except JWTError:
+        return False
+    return payload.get("role") == "admin"
+
+
+def install_profiler(app, service: str, enabled: bool = PROFILER_ENABLED) -> Optional[Profiler]:
+    """Add GET /debug/profile to a FastAPI app when profiling is enabled.
+
+    /debug/profile?seconds=10                     every thread for a 10 s window
+    /debug/profile?route=/create_order&requests=5 only while the next 5 matching requests run
+    &format=collapsed (default) or pstats, &interval_ms=5 sampling period
+    """
+    if not enabled:
+        return None
+    profiler = Profiler(service)
+    app.add_middleware(ProfilerMiddleware, profiler=profiler)
+
+    async def profile(request: Request, seconds: float = 0, route: str = "", requests: int = 1,
+                      timeout: float = 60, format: str = "collapsed", interval_ms: float = 5):
+        if not is_admin(request):
+            return JSONResponse({"detail": "Forbidden"}, status_code=403)
+        if format not in ("collapsed", "pstats"):
+            return JSONResponse({"detail": "format must be 'collapsed' or 'pstats'"}, status_code=400)
+        if not route and seconds <= 0:
+            return JSONResponse({"detail": "Pass seconds=<window> or route=<path>"}, status_code=400)
+        if profiler.capture is not None:
+            return JSONResponse({"detail": "A profile is already being captured"}, status_code=409)
+
+        capture = Capture(max(interval_ms, 1) / 1000, route=route or None, requests=max(requests, 1))
+        profiler.capture = capture
+        capture.start()
+        logger.info(f"Profiling {service}: " + (f"next {capture.requests} request(s) to {route}" if route else f"{seconds:g}s window"))
+        try:
+            if route:
+                try:
+                    await asyncio.wait_for(capture.done.wait(), min(timeout, PROFILER_MAX_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(seconds, PROFILER_MAX_SECONDS))
+        finally:
+            profiler.capture = None
+            capture.stop()
+
+        headers = {
+            "X-Profile-Samples": str(sum(capture.samples.values())),
+            "X-Profile-Idle-Samples": str(capture.idle_samples),
+            "X-Profile-Requests": str(capture.finished),
+            "Content-Disposition": f'attachment; filename="{service}-{int(time.time())}.{"prof" if format == "pstats" else "folded"}"',
+        }
+        if format == "pstats":
+            return Response(capture.pstats(), media_type="application/octet-stream", headers=headers)
+        return Response(capture.collapsed(), media_type="text/plain", headers=headers)
+
+    app.add_api_route("/debug/profile", profile, methods=["GET"], include_in_schema=False)
+    return profiler
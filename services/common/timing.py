@@ -0,0 +1,134 @@
+import re
+import json
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+logger = logging.getLogger("RequestLog")
+
+# Per-request state; sync endpoints run in a threadpool with a copy of the context,
+# which still points at the same dicts, so spans recorded there are not lost.
+_request_id: ContextVar[str] = ContextVar("request_id", default="")
+_spans: ContextVar[dict] = ContextVar("timing_spans", default=None)
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+def record(name: str, seconds: float):
+    """Add `seconds` to the span `name` of the current request (no-op outside a request)."""
+    spans = _spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def instrument_engine(engine):
+    """Count time spent in SQL statements as the `db` span."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("timing_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        record("db", time.perf_counter() - conn.info["timing_start"].pop())
+
+
+def format_server_timing(spans: dict) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans.items())
+
+
+def parse_server_timing(value: str) -> dict:
+    """'db;dur=1.5, hash;dur=240' -> {'db': 0.0015, 'hash': 0.24}; entries without dur are skipped."""
+    spans = {}
+    for entry in value.split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        for param in params:
+            key, _, number = param.partition("=")
+            if name and key == "dur":
+                try:
+                    spans[name] = spans.get(name, 0.0) + float(number) / 1000
+                except ValueError:
+                    pass
+    return spans
+
+
+def merge_upstream_timing(prefix: str, value: str):
+    """Record an upstream's Server-Timing spans as `prefix.name` on the current request."""
+    for name, seconds in parse_server_timing(value).items():
+        record(f"{prefix}.{name}", seconds)
+
+
+class TimingMiddleware:
+    """Plain ASGI middleware: assigns/propagates X-Request-ID, emits Server-Timing and one JSON log line per request.
+
+    Server-Timing is written with the response headers, so it covers the work done before the
+    first byte; the log line is written at the very end and also includes background tasks.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = ""
+        for key, value in scope["headers"]:
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if not _REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        spans = {}
+        id_token = _request_id.set(request_id)
+        spans_token = _spans.set(spans)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # Upstream Server-Timing headers were already merged into `spans` by the proxy code
+                headers = [(k, v) for k, v in message.get("headers", []) if k.lower() not in (b"server-timing", b"x-request-id")]
+                timing = dict(spans)
+                timing[self.service] = time.perf_counter() - start
+                headers.append((b"server-timing", format_server_timing(timing).encode("latin-1")))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            logger.info(json.dumps({
+                "request_id": request_id,
+                "service": self.service,
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round(duration * 1000, 1),
+                "spans_ms": {name: round(seconds * 1000, 1) for name, seconds in spans.items()},
+            }))
+            _spans.reset(spans_token)
+            _request_id.reset(id_token)
@@ -0,0 +1,33 @@
+import httpx
+
+# Service name -> httpx transport used instead of TCP. Empty in the normal multi-process
+# deployment; gateway/single_process.py registers in-process ASGI transports here.
+_transports = {}
+
+
+def register_transport(service: str, transport: httpx.AsyncBaseTransport):
+    _transports[service] = transport
+
+
+def get_transport(service: str):
+    return _transports.get(service)
+
+
+def client_for(service: str, **kwargs) -> httpx.AsyncClient:
+    """AsyncClient for calling another service; goes in-process when that service is mounted locally."""
+    transport = _transports.get(service)
+    if transport is not None:
+        kwargs["transport"] = transport
+    return httpx.AsyncClient(**kwargs)
+
+
+def parse_instances(value: str) -> list:
+    """'http://a:8001, http://b:8001|3' -> [('http://a:8001', 1), ('http://b:8001', 3)]"""
+    instances = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("|")
+        instances.append((url.strip().rstrip("/"), max(1, int(weight)) if weight.strip() else 1))
+    return instances
@@ -1,10 +1,17 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Depends
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 import os
+from services.common.metrics import instrument
+from services.common.profiler import install_profiler
+from services.common.deadline import deadline_dependency
+from services.common.timing import TimingMiddleware, span
 
-app = FastAPI(title="Frontend Service")
+app = FastAPI(title="Frontend Service", dependencies=[Depends(deadline_dependency())])
+metrics = instrument(app, "frontend")
+install_profiler(app, "frontend")
+app.add_middleware(TimingMiddleware, service="frontend")
 
 # Mount static files
 # We assume this service runs from the root or can access the frontend folder
@@ -22,7 +29,8 @@ def get_html(name: str, request: Request):
     # Check if the request is an AJAX request (for SPA)
     is_spa = request.headers.get("X-SPA") == "true" or request.headers.get("X-Requested-With") == "XMLHttpRequest"
     logger.info(f"Rendering {name} | is_spa: {is_spa} | path: {request.url.path}")
-    response = templates.TemplateResponse(name, {"request": request, "is_spa": is_spa})
+    with span("render"):
+        response = templates.TemplateResponse(request, name, {"is_spa": is_spa})
     response.headers["Vary"] = "X-SPA, X-Requested-With"
     return response
 
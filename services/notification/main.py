@@ -11,10 +11,17 @@ import logging
 
 from .database import engine, SessionLocal, get_db
 from .models import Base, Notification
+from services.common.metrics import instrument
+from services.common.profiler import install_profiler
+from services.common.deadline import deadline_dependency
+from services.common.timing import TimingMiddleware, span
 
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Notification Service")
+app = FastAPI(title="Notification Service", dependencies=[Depends(deadline_dependency())])
+metrics = instrument(app, "notification")
+install_profiler(app, "notification")
+app.add_middleware(TimingMiddleware, service="notification")
 
 @app.get("/health")
 def health():
@@ -120,11 +127,12 @@ def send_html_email(to_email: str, subject: str, html_body: str):
         msg['To'] = to_email
         msg['Subject'] = subject
         msg.attach(MIMEText(html_body, 'html'))
-        server = smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT)
-        server.ehlo()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+        with span("smtp"):
+            server = smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT)
+            server.ehlo()
+            server.login(SMTP_USER, SMTP_PASSWORD)
+            server.send_message(msg)
+            server.quit()
         cb.record_success()
         logger.info(f"Email sent successfully to {to_email}")
         return True
@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from services.common.timing import instrument_engine
 
 import os
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -9,6 +10,7 @@ DB_PATH = os.path.join(DATA_DIR, "orders.db").replace("\\", "/")
 DATABASE_URL = os.getenv("ORDERS_DATABASE_URL", f"sqlite:///{DB_PATH}")
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+instrument_engine(engine)
 
 SessionLocal = sessionmaker(
     autocommit=False,
@@ -1,11 +1,20 @@
 import os, shutil
-from fastapi import FastAPI, Form, UploadFile, File, Depends
+from fastapi import FastAPI, Form, UploadFile, File, Depends, Request, HTTPException
 from sqlalchemy.orm import Session
 from .database import get_db, Base, engine
 from . import crud
 from .security import get_current_user
+from .uploads import receive_order_form
+from services.common.metrics import instrument
+from services.common.profiler import install_profiler
+from services.common import deadline
+from services.common.deadline import deadline_dependency
+from services.common.timing import TimingMiddleware
 
-app = FastAPI(title="Orders Service")
+app = FastAPI(title="Orders Service", dependencies=[Depends(deadline_dependency())])
+metrics = instrument(app, "orders")
+install_profiler(app, "orders")
+app.add_middleware(TimingMiddleware, service="orders")
 
 @app.get("/health")
 def health():
@@ -19,51 +28,58 @@ check_and_migrate()
 
 Base.metadata.create_all(bind=engine)
 
+def _form_float(form: dict, name: str):
+    value = form.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Field '{name}' must be a number")
+
 @app.post("/create_order")
 async def create_order(
-    description: str = Form(...),
-    file: UploadFile | None = File(None),
-    color: str | None = Form(None),
-    size: str | None = Form(None),
-    width: float | None = Form(None),
-    length: float | None = Form(None),
-    height: float | None = Form(None),
-    material: str | None = Form(None),
-    infill: str | None = Form(None),
-    real_weight: str | None = Form(None),
+    request: Request,
     user_email: str = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Convert to floats if possible
-    width = float(width) if width else None
-    length = float(length) if length else None
-    height = float(height) if height else None
-    infill = float(infill) if infill else None
-    real_weight = float(real_weight) if real_weight else None
-    file_path = None
-    if file:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
-    
-    # Validation
-    if any(dim is not None and (dim < 1 or dim > 500) for dim in [width, length, height]):
-        from fastapi import HTTPException
-        raise HTTPException(status_code=400, detail="Габарити повинні бути від 1 до 500 мм")
-    if real_weight is not None and (real_weight < 0 or real_weight > 10000):
-        from fastapi import HTTPException
-        raise HTTPException(status_code=400, detail="Вага повинна бути від 0 до 10000 г")
-    if infill is not None and (infill < 0 or infill > 100):
-        from fastapi import HTTPException
-        raise HTTPException(status_code=400, detail="Заповнення повинно бути від 0 до 100%")
+    # The body is streamed: the uploaded file is written to UPLOAD_DIR once, chunk by chunk
+    form, file_path = await receive_order_form(request, UPLOAD_DIR)
+    try:
+        description = form.get("description")
+        if not description:
+            raise HTTPException(status_code=422, detail="Field 'description' is required")
+        color = form.get("color")
+        size = form.get("size")
+        material = form.get("material")
+        width = _form_float(form, "width")
+        length = _form_float(form, "length")
+        height = _form_float(form, "height")
+        infill = _form_float(form, "infill")
+        real_weight = _form_float(form, "real_weight")
 
-    from .pricing import calculate_order_price
-    result = calculate_order_price(
-        width=width, length=length, height=height,
-        material=material, infill=infill, real_weight=real_weight
-    )
-    price = result["price"]
+        # Validation
+        if any(dim is not None and (dim < 1 or dim > 500) for dim in [width, length, height]):
+            raise HTTPException(status_code=400, detail="Габарити повинні бути від 1 до 500 мм")
+        if real_weight is not None and (real_weight < 0 or real_weight > 10000):
+            raise HTTPException(status_code=400, detail="Вага повинна бути від 0 до 10000 г")
+        if infill is not None and (infill < 0 or infill > 100):
+            raise HTTPException(status_code=400, detail="Заповнення повинно бути від 0 до 100%")
+
+        from .pricing import calculate_order_price
+        result = calculate_order_price(
+            width=width, length=length, height=height,
+            material=material, infill=infill, real_weight=real_weight
+        )
+        price = result["price"]
+
+        if deadline.expired():
+            # The gateway has already given up; an order created now would look failed to the client
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except HTTPException:
+        # No order refers to the upload, so it must not stay in UPLOAD_DIR
+        if file_path: os.remove(file_path)
+        raise
 
     order = crud.create_order(
         db, user_email, description, file_path, color, size, price,
@@ -77,28 +93,28 @@ async def create_order(
         "currency": "UAH"
     }
 
+def order_to_dict(o) -> dict:
+    return {
+        "id": o.id,
+        "description": o.description,
+        "status": o.status,
+        "file_path": o.file_path,
+        "color": o.color,
+        "size": o.size,
+        "price": o.price,
+        "material": o.material,
+        "width": o.width,
+        "length": o.length,
+        "height": o.height,
+        "infill": o.infill,
+        "real_weight": o.real_weight,
+        "created_at": o.created_at.isoformat() if o.created_at else None
+    }
+
 @app.get("/orders")
 def get_orders(user_email: str = Depends(get_current_user), db: Session = Depends(get_db)):
     orders = crud.get_orders_by_user(db, user_email)
-    return {"orders": [
-        {
-            "id": o.id, 
-            "description": o.description, 
-            "status": o.status,
-            "file_path": o.file_path, 
-            "color": o.color, 
-            "size": o.size, 
-            "price": o.price,
-            "material": o.material,
-            "width": o.width,
-            "length": o.length,
-            "height": o.height,
-            "infill": o.infill,
-            "real_weight": o.real_weight,
-            "created_at": o.created_at.isoformat() if o.created_at else None
-        } 
-        for o in orders
-    ]}
+    return {"orders": [order_to_dict(o) for o in orders]}
 
 @app.delete("/orders/{order_id}")
 def delete_order(order_id: int, user_email: str = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -0,0 +1,149 @@
+import os
+from datetime import datetime
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # older python-multipart releases
+    import multipart
+    from multipart.multipart import parse_options_header
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(200 * 1024 * 1024)))  # 200 MB
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class StreamingOrderForm:
+    """Parses a multipart order form chunk by chunk, writing the uploaded model straight to its final path.
+
+    Only one part is buffered at a time for regular fields (capped at MAX_FIELD_SIZE); file data is never
+    held in memory as a whole and never goes through a temporary file.
+    """
+
+    def __init__(self, upload_dir: str, max_size: int = MAX_UPLOAD_SIZE):
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        self.fields = {}
+        self.file_path = None
+        self.received = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._field_name = None
+        self._field_data = bytearray()
+        self._file = None
+        self._in_file = False
+        self._pending = []  # file chunks produced by the last parser.write()
+        self._error = None
+
+    # --- parser callbacks (sync, must not block) ---
+    def on_part_begin(self):
+        self._disposition = b""
+        self._field_name = None
+        self._field_data = bytearray()
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        self._field_name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename", b"").decode("utf-8", "replace")
+        if filename:
+            # Only the first file is kept; browsers send an empty file part when nothing was selected
+            self._field_name = None
+            if self.file_path is None:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                self.file_path = os.path.join(self.upload_dir, f"{timestamp}_{os.path.basename(filename)}")
+                self._file = open(self.file_path, "wb")
+                self._in_file = True
+
+    def on_part_data(self, data, start, end):
+        if self._in_file:
+            self._pending.append(data[start:end])
+        elif self._field_name is not None:
+            if len(self._field_data) + (end - start) > MAX_FIELD_SIZE:
+                self._error = HTTPException(status_code=413, detail="Form field is too large")
+                return
+            self._field_data += data[start:end]
+
+    def on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._pending.append(None)  # close marker, handled after pending writes
+        elif self._field_name:
+            self.fields[self._field_name] = self._field_data.decode("utf-8", "replace")
+
+    # --- driver ---
+    def _flush(self):
+        for chunk in self._pending:
+            if chunk is None:
+                self._file.close()
+                self._file = None
+            else:
+                self._file.write(chunk)
+        self._pending.clear()
+
+    def _discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.file_path and os.path.exists(self.file_path):
+            os.remove(self.file_path)
+        self.file_path = None
+
+    async def parse(self, request: Request):
+        _, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise HTTPException(status_code=400, detail="Missing boundary in multipart body")
+
+        parser = multipart.MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+        try:
+            async for chunk in request.stream():
+                self.received += len(chunk)
+                if self.received > self.max_size:
+                    raise HTTPException(status_code=413, detail="Файл завеликий")
+                parser.write(chunk)
+                if self._error:
+                    raise self._error
+                if self._pending:
+                    await run_in_threadpool(self._flush)
+            parser.finalize()
+        except BaseException:
+            self._discard()
+            raise
+        return self.fields, self.file_path
+
+
+async def receive_order_form(request: Request, upload_dir: str):
+    """Return (fields, saved_file_path) for an order form, enforcing MAX_UPLOAD_SIZE before reading the body."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="Файл завеликий")
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        return await StreamingOrderForm(upload_dir, MAX_UPLOAD_SIZE).parse(request)
+
+    # Forms without a file (e.g. urlencoded) are small and can use the regular parser
+    form = await request.form()
+    return {k: v for k, v in form.items() if isinstance(v, str)}, None
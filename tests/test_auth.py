@@ -27,6 +27,19 @@ def test_login_user(auth_client):
     assert response.status_code == 200
     assert "access_token" in response.json()
 
+def test_login_reports_server_timing(auth_client):
+    auth_client.post("/register", data={"email": "timing@example.com", "password": "password123"})
+    response = auth_client.post("/login", data={"email": "timing@example.com", "password": "password123"}, headers={"X-Request-ID": "req-123"})
+    assert response.headers["X-Request-ID"] == "req-123"
+    timing = response.headers["Server-Timing"]
+    for name in ("db;dur=", "hash;dur=", "auth;dur="):
+        assert name in timing
+
+def test_expired_deadline_is_refused(auth_client):
+    response = auth_client.post("/login", data={"email": "timing@example.com", "password": "password123"}, headers={"X-Request-Timeout-Ms": "0"})
+    assert response.status_code == 504
+    assert auth_client.get("/health", headers={"X-Request-Timeout-Ms": "5000"}).status_code == 200
+
 def test_login_invalid_credentials(auth_client):
     response = auth_client.post("/login", data={"email": "wrong@example.com", "password": "password123"})
     assert response.status_code == 401
@@ -41,3 +54,249 @@ def test_me_endpoint(auth_client):
     response = auth_client.get("/me")
     assert response.status_code == 200
     assert response.json()["email"] == "me@example.com"
+
+def test_verify_signals_claims_change(auth_client):
+    resp = auth_client.post("/register", data={"email": "verify@example.com", "password": "password123"})
+    token = resp.json()["verification_token"]
+    response = auth_client.get(f"/verify/{token}")
+    assert response.status_code == 200
+    assert response.headers["X-Auth-Invalidate"] == "verify@example.com"
+
+def test_full_hashing_pool_sheds_logins_not_me(auth_client, monkeypatch):
+    from services.auth.main import hash_pool
+    resp = auth_client.post("/register", data={"email": "busy@example.com", "password": "password123"})
+    auth_client.cookies.set("access_token", resp.json()["access_token"])
+
+    monkeypatch.setattr(hash_pool, "in_flight", hash_pool.workers + hash_pool.queue)
+    response = auth_client.post("/login", data={"email": "busy@example.com", "password": "password123"})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert auth_client.get("/me").status_code == 200
+    assert hash_pool.stats()["rejected"] >= 1
+
+@pytest.mark.asyncio
+async def test_hashing_pool_recovers_from_dead_worker():
+    import os
+    from fastapi import HTTPException
+    from services.auth.hashing import HashPool
+    pool = HashPool(workers=1, queue=0)
+    try:
+        with pytest.raises(HTTPException) as exc:
+            await pool.run(os._exit, 1)  # the worker process dies, as if OOM-killed
+        assert exc.value.status_code == 503 and exc.value.headers["Retry-After"] == "1"
+        assert pool.stats()["restarts"] == 1
+        assert pool.stats()["in_flight"] == 0
+        assert await pool.verify("password123", await pool.hash("password123"))
+    finally:
+        pool.shutdown()
+
+def test_failure_window_slides_and_evicts_lru():
+    from services.auth.throttle import FailureWindow
+    window = FailureWindow(limit=2, window=10, max_keys=2)
+    assert not window.record("a", now=0)
+    assert window.record("a", now=1)
+    assert window.retry_after("a", now=5) == 5
+    assert window.retry_after("a", now=10.5) == 0  # the first failure left the window
+
+    window.record("b", now=11)
+    window.record("c", now=12)  # over max_keys: "a" is the least recently used
+    assert len(window) == 2 and window.retry_after("a", now=12) == 0
+    assert window.evictions == 1
+
+def test_login_throttle_refuses_before_bcrypt(auth_client, monkeypatch):
+    import services.auth.main as auth_main
+    from services.auth.throttle import LoginThrottle
+    auth_client.post("/register", data={"email": "stuffed@example.com", "password": "password123"})
+    monkeypatch.setattr(auth_main, "login_throttle", LoginThrottle(max_per_account=3, max_per_ip=100))
+
+    verify_calls = []
+    original_verify = auth_main.hash_pool.verify
+    async def counting_verify(plain, hashed):
+        verify_calls.append(plain)
+        return await original_verify(plain, hashed)
+    monkeypatch.setattr(auth_main.hash_pool, "verify", counting_verify)
+
+    for _ in range(3):
+        assert auth_client.post("/login", data={"email": "stuffed@example.com", "password": "wrong-pass"}).status_code == 401
+    response = auth_client.post("/login", data={"email": "Stuffed@example.com ", "password": "password123"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    assert len(verify_calls) == 3
+
+def test_client_ip_from_gateway_on_another_host():
+    from starlette.requests import Request
+    from services.common.client_ip import client_ip_headers
+    from services.auth.throttle import client_ip
+
+    def request(headers):
+        raw = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+        return Request({"type": "http", "headers": raw, "client": ("10.20.0.5", 40000)})
+
+    # The gateway is not a loopback peer: its signed header is used, X-Forwarded-For is not
+    assert client_ip(request(client_ip_headers("203.0.113.9", "test_secret_key"))) == "203.0.113.9"
+    assert client_ip(request({"X-Forwarded-For": "203.0.113.9"})) == "10.20.0.5"
+    forged = client_ip_headers("203.0.113.9", "another-key")
+    assert client_ip(request(forged)) == "10.20.0.5"
+
+def test_login_lockout_persists_to_user_row(auth_client, monkeypatch, test_db_auth):
+    import services.auth.main as auth_main
+    from services.auth.crud import get_user_by_email
+    from services.auth.throttle import LoginThrottle
+    auth_client.post("/register", data={"email": "locked@example.com", "password": "password123"})
+    monkeypatch.setattr(auth_main, "THROTTLE_PERSIST", True)
+    monkeypatch.setattr(auth_main, "login_throttle", LoginThrottle(max_per_account=2, max_per_ip=100))
+
+    for _ in range(2):
+        auth_client.post("/login", data={"email": "locked@example.com", "password": "wrong-pass"})
+    test_db_auth.expire_all()
+    assert get_user_by_email(test_db_auth, "locked@example.com").is_blocked == 1
+
+    # A restarted service (empty in-memory throttle) still honours the lock
+    monkeypatch.setattr(auth_main, "login_throttle", LoginThrottle(max_per_account=2, max_per_ip=100))
+    assert auth_client.post("/login", data={"email": "locked@example.com", "password": "password123"}).status_code == 429
+
+def test_me_answers_from_claims_without_db(auth_client, monkeypatch):
+    import services.auth.main as auth_main
+    resp = auth_client.post("/register", data={"email": "claims@example.com", "password": "password123"})
+    auth_client.cookies.set("access_token", resp.json()["access_token"])
+    assert auth_client.get("/me").json() == {"email": "claims@example.com", "role": "user", "is_verified": 0}
+
+    def no_db(*args, **kwargs):
+        raise AssertionError("/me read the database")
+    monkeypatch.setattr(auth_main, "get_user_by_email", no_db)
+    monkeypatch.setattr(auth_main, "get_token_version", no_db)
+    assert auth_client.get("/me").json()["email"] == "claims@example.com"
+
+def test_migrations_use_configured_database(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine, inspect, text
+    import services.auth.main as auth_main
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy_auth.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, hashed_password VARCHAR)"))
+    monkeypatch.setattr(auth_main, "engine", engine)
+    auth_main.run_migrations()
+    auth_main.run_migrations()  # already applied: no-op
+    assert "token_version" in {column["name"] for column in inspect(engine).get_columns("users")}
+
+def test_verification_outdates_issued_tokens(auth_client):
+    resp = auth_client.post("/register", data={"email": "stale@example.com", "password": "password123"})
+    old_token = resp.json()["access_token"]
+    assert auth_client.get(f"/verify/{resp.json()['verification_token']}").status_code == 200
+
+    auth_client.cookies.set("access_token", old_token)
+    response = auth_client.get("/me")
+    assert response.status_code == 401
+    assert "outdated" in response.json()["detail"]
+
+    new_token = auth_client.post("/login", data={"email": "stale@example.com", "password": "password123"}).json()["access_token"]
+    auth_client.cookies.set("access_token", new_token)
+    assert auth_client.get("/me").json()["is_verified"] == 1
+
+def test_user_cache_hits_and_sees_external_writes(auth_client, test_db_auth):
+    import sqlite3
+    from services.auth.crud import get_user_record, user_cache
+    auth_client.post("/register", data={"email": "cached@example.com", "password": "password123"})
+    first = get_user_record(test_db_auth, "cached@example.com")
+    hits = user_cache.hits
+    assert get_user_record(test_db_auth, "cached@example.com") is first
+    assert user_cache.hits == hits + 1
+
+    # Another process promotes the user: PRAGMA data_version changes and the cache is dropped
+    with sqlite3.connect(user_cache.db_path) as conn:
+        conn.execute("UPDATE users SET role = 'admin' WHERE email = 'cached@example.com'")
+    test_db_auth.expire_all()
+    assert get_user_record(test_db_auth, "cached@example.com").role == "admin"
+    assert 0 < user_cache.stats()["hit_ratio"] < 1
+
+def test_user_cache_local_write_keeps_other_entries(auth_client, test_db_auth):
+    from datetime import datetime, timedelta
+    from services.auth.crud import get_user_record, lock_user, user_cache
+    for email in ("keep@example.com", "write@example.com"):
+        auth_client.post("/register", data={"email": email, "password": "password123"})
+    kept = get_user_record(test_db_auth, "keep@example.com")
+    get_user_record(test_db_auth, "write@example.com")
+    invalidations = user_cache.stats()["external_invalidations"]
+
+    lock_user(test_db_auth, "write@example.com", datetime.utcnow() + timedelta(minutes=5))
+    assert get_user_record(test_db_auth, "keep@example.com") is kept
+    assert get_user_record(test_db_auth, "write@example.com").is_blocked == 1
+    assert user_cache.stats()["external_invalidations"] == invalidations
+
+def test_user_cache_sync_does_not_wait_for_write_lock(test_db_auth):
+    import time
+    import sqlite3
+    from datetime import datetime, timedelta
+    from services.auth.models import VerificationToken
+    from services.auth.crud import create_user, get_user_record, sweep_expired_verification_tokens, user_cache
+    user = create_user(test_db_auth, "spill@example.com", "x")
+    test_db_auth.commit()
+    past = datetime.utcnow() - timedelta(minutes=1)
+    test_db_auth.bulk_insert_mappings(VerificationToken, [
+        {"token_hash": f"spill-{i:060d}", "user_id": user.id, "expires_at": past} for i in range(20000)
+    ])
+    test_db_auth.commit()
+    cached = get_user_record(test_db_auth, "spill@example.com")
+    invalidations = user_cache.stats()["external_invalidations"]
+
+    # A tiny page cache makes the delete spill to the file, which needs an EXCLUSIVE lock
+    test_db_auth.connection().exec_driver_sql("PRAGMA cache_size=10")
+    try:
+        started = time.perf_counter()
+        assert sweep_expired_verification_tokens(test_db_auth, batch_size=20000) >= 20000
+        assert time.perf_counter() - started < 2
+    finally:
+        test_db_auth.connection().exec_driver_sql("PRAGMA cache_size=-2000")
+    assert get_user_record(test_db_auth, "spill@example.com") is cached
+
+    # Another writer holding the file exclusively: lookups neither wait nor drop the cache
+    other = sqlite3.connect(user_cache.db_path, isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    try:
+        started = time.perf_counter()
+        user_cache.sync()
+        assert get_user_record(test_db_auth, "spill@example.com") is cached
+        assert time.perf_counter() - started < 0.5
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    assert user_cache.stats()["external_invalidations"] == invalidations
+
+def test_user_cache_invalidated_by_verification(auth_client, test_db_auth):
+    from services.auth.crud import get_user_record, verify_user
+    resp = auth_client.post("/register", data={"email": "cachedverify@example.com", "password": "password123"})
+    assert get_user_record(test_db_auth, "cachedverify@example.com").is_verified == 0
+    verify_user(test_db_auth, resp.json()["verification_token"])
+    assert get_user_record(test_db_auth, "cachedverify@example.com").is_verified == 1
+
+def test_verification_tokens_are_stored_hashed(auth_client, test_db_auth):
+    from services.auth.models import VerificationToken
+    from services.auth.crud import hash_verification_token
+    token = auth_client.post("/register", data={"email": "hashed@example.com", "password": "password123"}).json()["verification_token"]
+    hashes = [row.token_hash for row in test_db_auth.query(VerificationToken).all()]
+    assert hash_verification_token(token) in hashes
+    assert token not in hashes
+
+def test_expired_verification_tokens_are_refused_and_swept(test_db_auth):
+    from datetime import datetime, timedelta
+    from services.auth.models import VerificationToken
+    from services.auth.crud import create_user, issue_verification_token, verify_user, sweep_expired_verification_tokens
+    past = datetime.utcnow() - timedelta(minutes=1)
+    for i in range(5):
+        user = create_user(test_db_auth, f"sweep{i}@example.com", "x")
+        issue_verification_token(test_db_auth, user, f"sweep-token-{i}", past)
+    test_db_auth.commit()
+
+    assert verify_user(test_db_auth, "sweep-token-0") is None
+    assert sweep_expired_verification_tokens(test_db_auth, batch_size=2) >= 5
+    assert test_db_auth.query(VerificationToken).filter(VerificationToken.expires_at < datetime.utcnow()).count() == 0
+
+def test_plaintext_verification_tokens_are_migrated(test_db_auth):
+    from services.auth.models import User
+    from services.auth.crud import create_user, migrate_plaintext_verification_tokens, verify_user
+    user = create_user(test_db_auth, "legacy@example.com", "x")
+    user.verification_token = "legacy-token"
+    test_db_auth.commit()
+
+    assert migrate_plaintext_verification_tokens(test_db_auth) == 1
+    assert test_db_auth.query(User).filter(User.verification_token.isnot(None)).count() == 0
+    assert verify_user(test_db_auth, "legacy-token").email == "legacy@example.com"
@@ -1,19 +1,44 @@
 import pytest
+from contextlib import contextmanager
 from unittest.mock import patch, MagicMock
 
+@contextmanager
+def mock_upstreams(handler, *names):
+    # Route the pooled clients to an httpx.MockTransport. The lifespan health checks fail against
+    # services that are not running, so the breakers are reset as well.
+    from gateway.main import upstreams
+    import httpx
+    clients = [upstreams.client(name) for name in names]
+    originals = [client._transport for client in clients]
+    for name, client in zip(names, clients):
+        client._transport = httpx.MockTransport(handler)
+        for instance in upstreams.instances[name]:
+            instance.breaker.record_success()
+    try:
+        yield
+    finally:
+        for client, original in zip(clients, originals):
+            client._transport = original
+
 def test_gateway_health(gateway_client):
+    from gateway.main import SERVICES
     response = gateway_client.get("/health")
     assert response.status_code == 200
-    assert response.json() == {"status": "ok", "service": "gateway"}
+    assert response.json()["service"] == "gateway"
+    assert response.json()["status"] in ("ok", "degraded")
+    assert set(response.json()["upstreams"]) == set(SERVICES)
+    # Instance URLs are for operators only
+    assert "instances" not in response.json() and "127.0.0.1" not in response.text
+    admin = gateway_client.get("/health", headers={"Authorization": f"Bearer {_access_token(role='admin')}"})
+    assert set(admin.json()["instances"]) == set(SERVICES)
 
 @pytest.mark.asyncio
 async def test_gateway_index(gateway_client):
     with patch("gateway.main.proxy_request") as mock_proxy:
-        # Create a mock response object
-        mock_resp = MagicMock()
-        mock_resp.status_code = 200
-        mock_resp.text = "<html>Index</html>"
-        mock_resp.headers = {"content-type": "text/html"}
+        import httpx
+        from gateway.cache import page_cache
+        page_cache.purge()
+        mock_resp = httpx.Response(200, html="<html>Index</html>")
         
         # Since proxy_request is awaited, the mock must return a coroutine or use AsyncMock
         from unittest.mock import AsyncMock
@@ -55,3 +80,814 @@ async def test_gateway_login_proxy(gateway_client):
         assert response.status_code == 303
         assert response.headers["location"] == "/orders_page"
         assert "access_token" in response.cookies
+
+def test_gateway_upstream_pool_reused(gateway_client):
+    from gateway.main import upstreams, SERVICES
+    assert upstreams.get("orders") is upstreams.get("orders")
+
+    assert gateway_client.get("/stats").status_code == 403
+    response = gateway_client.get("/stats", headers={"Authorization": f"Bearer {_access_token(role='admin')}"})
+    assert response.status_code == 200
+    pools = response.json()["upstream_pools"]
+    assert set(pools) == set(SERVICES)
+    assert pools["orders"]["requests"] >= 2
+
+def test_gateway_upstream_pool_ignores_cookies():
+    import httpx
+    from gateway.main import upstreams
+    client = upstreams.get("auth")
+    client.cookies.extract_cookies(httpx.Response(200, headers={"set-cookie": "access_token=leak"}, request=httpx.Request("GET", "http://127.0.0.1:8005/me")))
+    assert "access_token" not in client.cookies
+
+@pytest.mark.asyncio
+async def test_gateway_streams_frontend_response():
+    import httpx
+    chunks = [b"<html>", b"a" * 1024, b"b" * 1024]
+
+    class ChunkStream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            for chunk in chunks:
+                yield chunk
+
+    from gateway.main import stream_response
+    upstream = httpx.Response(200, headers={"content-type": "text/html", "connection": "keep-alive"}, stream=ChunkStream())
+    response = stream_response(upstream)
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    assert body == b"".join(chunks)
+    assert "connection" not in response.headers
+    assert upstream.is_closed
+
+@pytest.mark.asyncio
+async def test_streamed_response_holds_bulkhead_until_closed():
+    import httpx
+    from starlette.requests import Request
+    from gateway import main as gateway_main
+    from gateway.bulkhead import Bulkhead
+
+    class ChunkStream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            yield b"x" * 1024
+
+    def handler(request):
+        return httpx.Response(200, headers={"content-type": "text/html"}, stream=ChunkStream())
+
+    original = gateway_main.bulkheads.bulkheads["frontend"]
+    gateway_main.bulkheads.bulkheads["frontend"] = bulkhead = Bulkhead("frontend", max_concurrent=4, max_queue=0)
+    instances = gateway_main.upstreams.instances["frontend"]
+    try:
+        with mock_upstreams(handler, "frontend"):
+            request = Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": []})
+            resp = await gateway_main.proxy_request("frontend", "/", request, stream=True)
+            assert bulkhead.in_flight == 1
+            assert sum(i.outstanding for i in instances) == 1
+            response = gateway_main.stream_response(resp)
+            assert b"".join([chunk async for chunk in response.body_iterator]) == b"x" * 1024
+            await resp.aclose()  # the response's background task closes it a second time
+        assert bulkhead.in_flight == 0
+        assert sum(i.outstanding for i in instances) == 0
+    finally:
+        gateway_main.bulkheads.bulkheads["frontend"] = original
+
+def test_gateway_create_order_rejects_large_upload_early(gateway_client, monkeypatch):
+    import gateway.main as gateway_main
+    monkeypatch.setattr(gateway_main, "MAX_UPLOAD_SIZE", 1024)
+    with patch("gateway.main.proxy_request") as mock_proxy:
+        response = gateway_client.post("/create_order", files={"file": ("big.stl", b"x" * 4096)}, data={"description": "Big"})
+        assert response.status_code == 413
+        mock_proxy.assert_not_called()
+
+def _access_token(sub="claims@example.com", **claims):
+    from datetime import datetime, timedelta
+    from jose import jwt
+    return jwt.encode({"sub": sub, "role": "user", "exp": datetime.utcnow() + timedelta(minutes=5), **claims}, "test_secret_key", algorithm="HS256")
+
+def test_gateway_me_served_from_claims_cache(gateway_client):
+    import httpx
+    from unittest.mock import AsyncMock
+    from gateway.security import claims_cache
+    claims_cache.invalidate("*")
+    claims = {"email": "claims@example.com", "role": "user", "is_verified": 1}
+    with patch("gateway.main.proxy_request", new=AsyncMock(return_value=httpx.Response(200, json=claims))) as mock_proxy:
+        gateway_client.cookies.set("access_token", _access_token())
+        assert gateway_client.get("/me").json() == claims
+        assert gateway_client.get("/me").json() == claims
+        mock_proxy.assert_called_once()
+    gateway_client.cookies.clear()
+
+def test_gateway_claims_cache_checks_token_version(gateway_client):
+    import httpx
+    from unittest.mock import AsyncMock
+    from gateway.security import claims_cache
+    claims_cache.invalidate("*")
+    user = {"email": "claims@example.com", "role": "user", "is_verified": 1}
+    admin = {**user, "role": "admin"}
+    outdated = httpx.Response(401, json={"detail": "Token outdated"})
+    with patch("gateway.main.proxy_request", new=AsyncMock(side_effect=[httpx.Response(200, json=user), httpx.Response(200, json=admin), outdated])) as mock_proxy:
+        old_token, new_token = _access_token(ver=0), _access_token(ver=1)
+        assert gateway_client.get("/me", headers={"Authorization": f"Bearer {old_token}"}).json() == user
+        # promote_admin.py bumped the version: the new token is not served the old claims...
+        assert gateway_client.get("/me", headers={"Authorization": f"Bearer {new_token}"}).json() == admin
+        # ...and the old token is not served the new ones
+        assert gateway_client.get("/me", headers={"Authorization": f"Bearer {old_token}"}).status_code == 401
+        assert gateway_client.get("/me", headers={"Authorization": f"Bearer {new_token}"}).json() == admin
+        assert mock_proxy.call_count == 3
+    claims_cache.invalidate("*")
+
+def test_gateway_create_order_rejects_bad_token_locally(gateway_client):
+    with patch("gateway.main.proxy_request") as mock_proxy:
+        gateway_client.cookies.set("access_token", "not-a-jwt")
+        response = gateway_client.post("/create_order", data={"description": "x"})
+        assert response.status_code == 401
+        mock_proxy.assert_not_called()
+    gateway_client.cookies.clear()
+
+def test_gateway_create_order_uses_cached_claims(gateway_client):
+    import httpx
+    from unittest.mock import AsyncMock
+    from gateway.security import claims_cache
+    claims_cache.set("claims@example.com", {"email": "claims@example.com", "role": "user", "is_verified": 0})
+    with patch("gateway.main.proxy_request", new=AsyncMock()) as mock_proxy:
+        gateway_client.cookies.set("access_token", _access_token())
+        response = gateway_client.post("/create_order", data={"description": "x"})
+        assert response.status_code == 403
+        mock_proxy.assert_not_called()
+    gateway_client.cookies.clear()
+    claims_cache.invalidate("*")
+
+def test_gateway_create_order_trusts_verified_claim(gateway_client):
+    import httpx
+    from unittest.mock import AsyncMock
+    with patch("gateway.main.proxy_request", new=AsyncMock(return_value=httpx.Response(200, json={"order_id": 1}))) as mock_proxy:
+        gateway_client.cookies.set("access_token", _access_token(is_verified=1, ver=0))
+        response = gateway_client.post("/create_order", data={"description": "x"})
+        assert response.status_code == 200
+        assert [call.args[:2] for call in mock_proxy.call_args_list] == [("orders", "/create_order")]
+    gateway_client.cookies.clear()
+
+def test_gateway_verify_renews_session_cookies(gateway_client):
+    import httpx
+
+    def handler(request):
+        if request.url.path == "/refresh":
+            return httpx.Response(200, json={"access_token": "fresh-access", "refresh_token": "fresh-refresh"})
+        return httpx.Response(200, json={"message": "Email verified successfully"})
+
+    with mock_upstreams(handler, "auth"):
+        gateway_client.cookies.set("refresh_token", "old-refresh")
+        response = gateway_client.get("/verify/abc", headers={"Accept": "application/json"})
+    gateway_client.cookies.clear()
+    assert response.status_code == 200
+    assert response.cookies.get("access_token") == "fresh-access"
+    assert response.cookies.get("refresh_token") == "fresh-refresh"
+
+def test_claims_cache_invalidated_by_auth_header():
+    from gateway.security import ClaimsCache
+    cache = ClaimsCache(ttl=60)
+    cache.set("a@example.com", {"is_verified": 0})
+    cache.set("b@example.com", {"is_verified": 0})
+    cache.invalidate("a@example.com")
+    assert cache.get("a@example.com") is None
+    assert cache.get("b@example.com") is not None
+    cache.invalidate("*")
+    assert cache.get("b@example.com") is None
+
+def test_rate_limiter_blocks_after_burst():
+    from gateway.ratelimit import RateLimiter, MemoryStore
+    limiter = RateLimiter(store=MemoryStore(), rate=5, block_seconds=60)
+    assert all(limiter.check_request("10.0.0.1") for _ in range(5))
+    assert limiter.check_request("10.0.0.1") is False
+    assert limiter.check_request("10.0.0.1") is False
+    assert limiter.check_request("10.0.0.2") is True
+    assert limiter.stats()["blocks"] == 1
+
+def test_rate_limiter_evicts_idle_clients():
+    from gateway.ratelimit import RateLimiter, MemoryStore
+    limiter = RateLimiter(store=MemoryStore(), rate=5, idle_seconds=0)
+    for i in range(100):
+        limiter.check_request(f"10.0.1.{i}")
+    assert len(limiter.store) == 100
+    assert limiter.evict_idle() == 100
+    assert len(limiter.store) == 0
+
+def test_rate_limiter_sqlite_store_is_shared(tmp_path):
+    from gateway.ratelimit import RateLimiter, SQLiteStore
+    path = str(tmp_path / "ratelimit.db")
+    worker_a = RateLimiter(store=SQLiteStore(path), rate=4)
+    worker_b = RateLimiter(store=SQLiteStore(path), rate=4)
+    assert worker_a.check_request("10.0.2.1") and worker_b.check_request("10.0.2.1")
+    assert worker_a.check_request("10.0.2.1") and worker_b.check_request("10.0.2.1")
+    assert worker_a.check_request("10.0.2.1") is False
+    assert worker_b.check_request("10.0.2.1") is False
+
+def test_gateway_rate_limit_middleware(gateway_client, monkeypatch):
+    from gateway.main import limiter
+    monkeypatch.setattr(limiter, "check_request", lambda ip: False)
+    monkeypatch.setattr(limiter, "block_seconds", 120)
+    response = gateway_client.get("/health")
+    assert response.status_code == 429
+    assert response.json()["detail"] == "Too many requests. You are blocked for 2 minutes."
+
+@pytest.mark.asyncio
+async def test_rate_limiter_sqlite_wait_does_not_block_event_loop(tmp_path):
+    import time
+    import asyncio
+    import sqlite3
+    from gateway.ratelimit import RateLimiter, SQLiteStore
+    path = str(tmp_path / "ratelimit.db")
+    limiter = RateLimiter(store=SQLiteStore(path), rate=4)
+    other_worker = sqlite3.connect(path, isolation_level=None)
+    other_worker.execute("BEGIN IMMEDIATE")
+    try:
+        check = asyncio.ensure_future(limiter.check_request_async("10.0.3.1"))
+        started = time.perf_counter()
+        await asyncio.sleep(0.05)
+        assert time.perf_counter() - started < 0.5 and not check.done()
+        assert await check is True  # busy timeout -> fails open
+    finally:
+        other_worker.execute("ROLLBACK")
+        other_worker.close()
+
+@pytest.mark.asyncio
+async def test_gateway_page_cache_and_etag(gateway_client):
+    import httpx
+    from unittest.mock import AsyncMock
+    from gateway.cache import page_cache
+    page_cache.purge()
+    page = httpx.Response(200, html="<main>Info</main>", headers={"vary": "X-SPA, X-Requested-With"})
+    with patch("gateway.main.proxy_request", new=AsyncMock(return_value=page)) as mock_proxy:
+        first = gateway_client.get("/info", headers={"X-SPA": "true"})
+        assert first.status_code == 200
+        assert first.text == "<main>Info</main>"
+        etag = first.headers["etag"]
+
+        again = gateway_client.get("/info", headers={"X-SPA": "true"})
+        assert again.text == "<main>Info</main>" and again.headers["etag"] == etag
+
+        revalidated = gateway_client.get("/info", headers={"X-SPA": "true", "If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+
+        # A different variant of the same path is a separate entry
+        gateway_client.get("/info")
+        assert mock_proxy.call_count == 2
+
+def test_gateway_page_cache_purge(gateway_client):
+    import httpx
+    from gateway.cache import page_cache
+    page_cache.purge()
+    page_cache.put(("/contacts", "", "", ""), httpx.Response(200, html="<p>x</p>"))
+    assert gateway_client.post("/cache/purge").status_code == 403
+
+    from datetime import datetime, timedelta
+    from jose import jwt
+    admin = jwt.encode({"sub": "admin@example.com", "role": "admin", "exp": datetime.utcnow() + timedelta(minutes=5)}, "test_secret_key", algorithm="HS256")
+    response = gateway_client.post("/cache/purge", headers={"Authorization": f"Bearer {admin}"})
+    assert response.status_code == 200
+    assert response.json()["purged"] == 1
+    assert page_cache.stats()["entries"] == 0
+
+def test_page_cache_respects_byte_budget():
+    import httpx
+    from gateway.cache import PageCache
+    cache = PageCache(max_bytes=3000, max_entry_bytes=2000)
+    for i in range(5):
+        cache.put((f"/p{i}", "", "", ""), httpx.Response(200, content=b"x" * 1000))
+    assert cache.bytes <= 3000
+    assert cache.get(("/p0", "", "", "")) is None
+    assert cache.get(("/p4", "", "", "")) is not None
+    assert cache.put(("/big", "", "", ""), httpx.Response(200, content=b"x" * 5000)) is None
+
+def test_gateway_serves_static_from_disk(gateway_client):
+    with patch("gateway.main.proxy_request") as mock_proxy:
+        response = gateway_client.get("/static/css/index.css")
+        assert response.status_code == 200
+        assert "text/css" in response.headers["content-type"]
+        assert response.headers["cache-control"].startswith("public, max-age=")
+
+        ranged = gateway_client.get("/static/images/FDM2.png", headers={"Range": "bytes=0-99"})
+        assert ranged.status_code == 206
+        assert len(ranged.content) == 100
+
+        assert gateway_client.get("/favicon.ico").status_code == 200
+        mock_proxy.assert_not_called()
+
+def test_static_files_prefer_precompressed_sibling(tmp_path):
+    import gzip
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from fastapi.testclient import TestClient
+    from gateway.static import PrecompressedStaticFiles
+    css = b"body { color: green; }" * 50
+    (tmp_path / "site.css").write_bytes(css)
+    (tmp_path / "site.css.gz").write_bytes(gzip.compress(css))
+    client = TestClient(Starlette(routes=[Mount("/static", PrecompressedStaticFiles(directory=str(tmp_path)))]))
+
+    response = client.get("/static/site.css", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "text/css" in response.headers["content-type"]
+    assert response.content == css  # decoded by the test client
+
+    plain = client.get("/static/site.css", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.content == css
+
+def test_circuit_breaker_transitions():
+    import time
+    from gateway.health import CircuitBreaker
+    breaker = CircuitBreaker("orders", failure_threshold=2, recovery_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow_request()       # single probe
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def test_gateway_fails_fast_when_circuit_open(gateway_client):
+    from gateway.main import upstreams
+    breakers = [instance.breaker for instance in upstreams.instances["orders"]]
+    for breaker in breakers:
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+    try:
+        response = gateway_client.get("/orders")
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+        assert gateway_client.get("/health").json()["upstreams"]["orders"] == "down"
+    finally:
+        for breaker in breakers:
+            breaker.record_success()
+
+def test_gateway_busy_503_leaves_breaker_closed(gateway_client):
+    import httpx
+    from gateway.main import upstreams
+
+    def handler(request):
+        if request.url.path == "/login":
+            return httpx.Response(503, json={"detail": "Authentication is busy, please retry"}, headers={"Retry-After": "1"})
+        return httpx.Response(200, json={"email": "claims@example.com", "role": "user", "is_verified": 1})
+
+    with mock_upstreams(handler, "auth"):
+        breakers = [instance.breaker for instance in upstreams.instances["auth"]]
+        for _ in range(breakers[0].failure_threshold + 1):
+            response = gateway_client.post("/login", data={"email": "a@example.com", "password": "x"})
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+        assert all(breaker.state == "closed" for breaker in breakers)
+        assert gateway_client.get("/me").status_code == 200
+
+@pytest.mark.asyncio
+async def test_half_open_probe_released_without_verdict(monkeypatch):
+    import httpx
+    from starlette.requests import Request
+    from gateway import main as gateway_main
+
+    def busy(request):
+        return httpx.Response(503, json={"detail": "busy"}, headers={"Retry-After": "1"})
+
+    request = Request({"type": "http", "method": "GET", "path": "/orders", "query_string": b"", "headers": []})
+    with mock_upstreams(busy, "orders"):
+        breakers = [instance.breaker for instance in gateway_main.upstreams.instances["orders"]]
+        for breaker in breakers:
+            monkeypatch.setattr(breaker, "recovery_timeout", 0)
+            for _ in range(breaker.failure_threshold):
+                breaker.record_failure()
+            assert breaker.state == "half-open"
+        # The probe gets a load-shedding answer: no verdict, so the next request may probe again
+        resp = await gateway_main.proxy_request("orders", "/orders", request, coalesce=False)
+        assert resp.status_code == 503 and resp.headers["Retry-After"] == "1"
+        assert all(breaker.state == "half-open" and breaker.can_accept() for breaker in breakers)
+    for breaker in breakers:
+        breaker.record_success()
+
+def test_gateway_contacts_reports_undelivered_message(gateway_client):
+    import httpx
+    from gateway.main import upstreams
+
+    def down(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    with mock_upstreams(down, "notification"):
+        response = gateway_client.post("/contacts", data={"name": "A", "email": "a@example.com", "message": "hi"})
+    for instance in upstreams.instances["notification"]:
+        instance.breaker.record_success()
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+    with mock_upstreams(lambda request: httpx.Response(200, json={"status": "ok"}), "notification"):
+        assert gateway_client.post("/contacts", data={"message": "hi"}).json() == {"status": "sent"}
+
+def test_upstream_pool_parses_instances():
+    from gateway.upstream import parse_instances
+    assert parse_instances("http://a:8001") == [("http://a:8001", 1)]
+    assert parse_instances("http://a:8001/, http://b:8001|3") == [("http://a:8001", 1), ("http://b:8001", 3)]
+
+def test_upstream_pool_least_outstanding():
+    from gateway.upstream import UpstreamPool
+    pool = UpstreamPool({"orders": "http://a:8001,http://b:8001,http://c:8001"})
+    a, b, c = pool.instances["orders"]
+
+    # Idle instances are used in turn
+    assert {pool.pick("orders").url for _ in range(3)} == {a.url, b.url, c.url}
+
+    a.outstanding, b.outstanding, c.outstanding = 2, 0, 1
+    assert pool.pick("orders") is b
+
+    # Unhealthy instances are skipped even when idle
+    for _ in range(b.breaker.failure_threshold):
+        b.breaker.record_failure()
+    assert pool.pick("orders") is c
+    for instance in (a, c):
+        for _ in range(instance.breaker.failure_threshold):
+            instance.breaker.record_failure()
+    assert pool.pick("orders") is None
+
+def test_upstream_pool_weights():
+    from gateway.upstream import UpstreamPool
+    pool = UpstreamPool({"auth": "http://a:8005|3,http://b:8005"})
+    heavy, light = pool.instances["auth"]
+    heavy.outstanding, light.outstanding = 2, 1
+    # 2/3 in flight per unit of weight beats 1/1
+    assert pool.pick("auth") is heavy
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_in_flight_call():
+    import asyncio
+    from gateway.coalesce import SingleFlight
+    flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(5)))
+    assert results == [1] * 5
+    assert flight.stats()["coalesced"] == 4
+    assert flight.stats()["in_flight"] == 0
+    # Finished calls are not reused
+    assert await flight.do("k", fetch) == 2
+
+@pytest.mark.asyncio
+async def test_proxy_request_coalesces_identical_gets():
+    import asyncio
+    import httpx
+    from unittest.mock import AsyncMock
+    from starlette.requests import Request
+    from gateway import main as gateway_main
+
+    def make_request(token=None):
+        headers = [(b"cookie", f"access_token={token}".encode())] if token else []
+        return Request({"type": "http", "method": "GET", "path": "/calculate_price", "query_string": b"", "headers": headers})
+
+    async def slow_upstream(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"price": 1})
+
+    with patch("gateway.main._send_upstream", new=AsyncMock(side_effect=slow_upstream)) as send:
+        params = {"width": "10", "height": "20"}
+        await asyncio.gather(*(gateway_main.proxy_request("orders", "/calculate_price", make_request(), params=params) for _ in range(4)))
+        assert send.await_count == 1
+
+        # Different credentials or an explicit opt-out are never shared
+        await asyncio.gather(
+            gateway_main.proxy_request("orders", "/calculate_price", make_request("a"), params=params),
+            gateway_main.proxy_request("orders", "/calculate_price", make_request("b"), params=params),
+            gateway_main.proxy_request("orders", "/calculate_price", make_request(), params=params, coalesce=False),
+        )
+        assert send.await_count == 4
+
+def test_gateway_metrics(gateway_client, monkeypatch):
+    from gateway import main as gateway_main
+    monkeypatch.setattr(gateway_main, "METRICS_TOKEN", "scrape-secret")
+    gateway_client.get("/health")
+    assert gateway_client.get("/metrics").status_code == 403
+    assert gateway_client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    response = gateway_client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_requests_total{service="gateway",route="/health",method="GET",status="200"}' in text
+    assert 'http_request_duration_seconds_bucket{service="gateway",route="/health",method="GET",le="+Inf"}' in text
+    assert "gateway_upstream_pool_connections" in text
+    assert "gateway_rate_limit_blocks_total" in text
+
+def test_metrics_histogram_buckets():
+    from services.common.metrics import MetricsRegistry
+    registry = MetricsRegistry("test")
+    for value in (0.001, 0.03, 0.03, 20):
+        registry.latency.observe(("test", "/x", "GET"), value)
+    lines = registry.render().splitlines()
+    assert 'http_request_duration_seconds_bucket{service="test",route="/x",method="GET",le="0.005"} 1' in lines
+    assert 'http_request_duration_seconds_bucket{service="test",route="/x",method="GET",le="0.05"} 3' in lines
+    assert 'http_request_duration_seconds_bucket{service="test",route="/x",method="GET",le="+Inf"} 4' in lines
+    assert 'http_request_duration_seconds_count{service="test",route="/x",method="GET"} 4' in lines
+
+def _profiled_app(enabled):
+    from fastapi import FastAPI
+    from services.common.profiler import install_profiler
+    app = FastAPI()
+    install_profiler(app, "gateway", enabled=enabled)
+
+    @app.get("/work/{n}")
+    def work(n: int):
+        import time
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            sum(range(n))
+        return {"n": n}
+
+    return app
+
+def test_profiler_is_absent_when_disabled():
+    app = _profiled_app(enabled=False)
+    assert not app.user_middleware
+    assert all(getattr(r, "path", "") != "/debug/profile" for r in app.routes)
+
+@pytest.mark.asyncio
+async def test_profiler_captures_next_matching_requests(tmp_path):
+    import asyncio
+    import pstats
+    import httpx
+    from services.auth.security import create_access_token
+    app = _profiled_app(enabled=True)
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': 'a@example.com', 'role': 'admin'})}"}
+    user = {"Authorization": f"Bearer {create_access_token({'sub': 'u@example.com', 'role': 'user'})}"}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        assert (await client.get("/debug/profile", params={"seconds": 0.1}, headers=user)).status_code == 403
+
+        profile = asyncio.create_task(client.get(
+            "/debug/profile", params={"route": "/work/{n}", "requests": 2, "format": "pstats", "interval_ms": 2}, headers=admin
+        ))
+        await asyncio.sleep(0.05)
+        for n in (100, 200, 300):
+            assert (await client.get(f"/work/{n}")).status_code == 200
+        resp = await profile
+
+    assert resp.status_code == 200
+    assert resp.headers["x-profile-requests"] == "2"
+    (tmp_path / "gateway.prof").write_bytes(resp.content)
+    stats = pstats.Stats(str(tmp_path / "gateway.prof"))
+    assert any(name == "work" for _, _, name in stats.stats)
+
+@pytest.mark.asyncio
+async def test_profiler_window_returns_collapsed_stacks():
+    import asyncio
+    import httpx
+    from services.auth.security import create_access_token
+    app = _profiled_app(enabled=True)
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': 'a@example.com', 'role': 'admin'})}"}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        profile = asyncio.create_task(client.get("/debug/profile", params={"seconds": 0.3, "interval_ms": 2}, headers=admin))
+        await asyncio.sleep(0.05)
+        await client.get("/work/100")
+        resp = await profile
+
+    assert resp.status_code == 200
+    lines = resp.text.strip().splitlines()
+    assert any("work (test_gateway.py" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+def test_server_timing_parse_and_merge():
+    from services.common import timing
+    assert timing.parse_server_timing("db;dur=1.5, hash;desc=bcrypt;dur=240, cache") == {"db": 0.0015, "hash": 0.24}
+    token = timing._spans.set({})
+    try:
+        timing.merge_upstream_timing("auth", "db;dur=2, hash;dur=100")
+        with timing.span("auth.db"):
+            pass
+        spans = timing._spans.get()
+        assert set(spans) == {"auth.db", "auth.hash"}
+        assert spans["auth.db"] >= 0.002
+    finally:
+        timing._spans.reset(token)
+
+@pytest.mark.asyncio
+async def test_gateway_forwards_request_id_and_merges_timing(gateway_client):
+    import httpx
+    seen = {}
+
+    def handler(request):
+        seen["request_id"] = request.headers.get("x-request-id")
+        seen["forwarded_for"] = request.headers.get("x-forwarded-for")
+        return httpx.Response(200, json={"orders": []}, headers={"Server-Timing": "db;dur=12.5", "X-Request-ID": "upstream-own"})
+
+    with mock_upstreams(handler, "orders"):
+        response = gateway_client.get("/orders", headers={"X-Request-ID": "trace-1", "X-Forwarded-For": "203.0.113.9"})
+    assert seen["request_id"] == "trace-1"
+    assert seen["forwarded_for"] == "203.0.113.9, testclient"
+    assert response.headers["X-Request-ID"] == "trace-1"
+    timing = response.headers["Server-Timing"]
+    assert "orders.db;dur=12.5" in timing
+    assert "orders.upstream;dur=" in timing
+    assert "gateway;dur=" in timing
+    assert timing.count("db;dur") == 1  # the upstream header is replaced, not duplicated
+
+@pytest.mark.asyncio
+async def test_bulkhead_queue_and_shedding():
+    import asyncio
+    from gateway.bulkhead import Bulkhead
+    bulkhead = Bulkhead("ai", max_concurrent=1, max_queue=1, queue_timeout=0.05)
+    assert await bulkhead.acquire()
+
+    waiter = asyncio.ensure_future(bulkhead.acquire())
+    await asyncio.sleep(0)
+    assert bulkhead.queued == 1
+    assert not await bulkhead.acquire()          # queue full -> shed at once
+    assert not await waiter                      # deadline passed -> shed
+    assert bulkhead.stats()["shed_queue_full"] == 1
+    assert bulkhead.stats()["shed_timeout"] == 1
+
+    waiter = asyncio.ensure_future(bulkhead.acquire())
+    await asyncio.sleep(0)
+    bulkhead.release()
+    assert await waiter                          # released slot goes to the waiter
+    assert bulkhead.in_flight == 1 and bulkhead.queued == 0
+
+def test_gateway_sheds_when_bulkhead_full(gateway_client):
+    from gateway.main import bulkheads
+    from gateway.bulkhead import Bulkhead
+    original = bulkheads.bulkheads["orders"]
+    bulkheads.bulkheads["orders"] = full = Bulkhead("orders", max_concurrent=0, max_queue=0)
+    try:
+        response = gateway_client.get("/orders")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == str(full.retry_after)
+        admin = {"Authorization": f"Bearer {_access_token(role='admin')}"}
+        assert gateway_client.get("/stats", headers=admin).json()["bulkheads"]["orders"]["shed_queue_full"] == 1
+    finally:
+        bulkheads.bulkheads["orders"] = original
+
+def test_gateway_signs_client_ip(gateway_client):
+    import httpx
+    from services.common.client_ip import signed_client_ip
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers)
+        return httpx.Response(200, json=[])
+
+    with mock_upstreams(handler, "orders"):
+        gateway_client.get("/orders", headers={"X-Client-IP": "198.51.100.1", "X-Client-IP-Signature": "forged"})
+    assert signed_client_ip(seen[0], "test_secret_key") == "testclient"
+
+def test_gateway_batch(gateway_client):
+    import httpx
+    seen = []
+
+    def handler(request):
+        seen.append((request.url.path, request.headers.get("cookie", "")))
+        if request.url.path == "/me":
+            return httpx.Response(200, json={"email": "batch@example.com"})
+        if request.url.path == "/orders":
+            return httpx.Response(200, json={"orders": [{"id": 1}]})
+        return httpx.Response(503, json={"detail": "down"})
+
+    with mock_upstreams(handler, "auth", "orders"):
+        gateway_client.cookies.set("access_token", "tok")
+        response = gateway_client.post("/batch", json={"requests": [
+            {"id": "me", "path": "/me"},
+            {"id": "orders", "path": "/orders"},
+            {"id": "price", "path": "/calculate_price?width=1", "depends_on": ["orders"]},
+            {"id": "after_price", "path": "/orders", "depends_on": ["price"]},
+        ]})
+    gateway_client.cookies.clear()
+    assert response.status_code == 200
+    results = {r["id"]: r for r in response.json()["responses"]}
+    assert [r["id"] for r in response.json()["responses"]] == ["me", "orders", "price", "after_price"]
+    assert results["me"]["body"] == {"email": "batch@example.com"}
+    assert results["orders"]["body"]["orders"] == [{"id": 1}]
+    assert results["price"]["status"] == 503
+    assert results["after_price"]["status"] == 424
+    assert all("access_token=tok" in cookie for _, cookie in seen)
+
+def test_gateway_batch_charges_limiter_and_shares_deadline(gateway_client, monkeypatch):
+    import time
+    import httpx
+    from gateway import main as gateway_main
+    from gateway.ratelimit import RateLimiter, MemoryStore
+    budgets = {}
+
+    def handler(request):
+        budgets.setdefault(request.url.path, []).append(int(request.headers["x-request-timeout-ms"]))
+        if request.url.path == "/calculate_price":
+            time.sleep(0.3)
+        return httpx.Response(200, json={})
+
+    monkeypatch.setattr(gateway_main.batch_dispatcher, "limiter", RateLimiter(MemoryStore(), rate=3))
+    with mock_upstreams(handler, "orders"):
+        response = gateway_client.post("/batch", headers={"X-Request-Timeout-Ms": "1500"}, json={"requests": [
+            {"id": "slow", "path": "/calculate_price"},
+            {"id": "after", "path": "/orders", "depends_on": ["slow"]},
+            {"id": "a", "path": "/orders?page=1"},
+            {"id": "b", "path": "/orders?page=2"},
+        ]})
+    statuses = {r["id"]: r["status"] for r in response.json()["responses"]}
+    # Three tokens: the independent items take them, the dependant is over the limit
+    assert statuses["slow"] == 200 and statuses["after"] == 429
+    assert sorted(statuses.values()) == [200, 200, 200, 429]
+
+    monkeypatch.setattr(gateway_main.batch_dispatcher, "limiter", RateLimiter(MemoryStore(), rate=100))
+    budgets.clear()
+    with mock_upstreams(handler, "orders"):
+        gateway_client.post("/batch", headers={"X-Request-Timeout-Ms": "1500"}, json={"requests": [
+            {"id": "slow", "path": "/calculate_price"},
+            {"id": "after", "path": "/orders", "depends_on": ["slow"]},
+        ]})
+    # The dependant starts 0.3 s later and only gets what is left of the batch's budget
+    assert budgets["/calculate_price"][0] <= 1500
+    assert budgets["/orders"][0] <= 1250
+
+def test_gateway_batch_validation(gateway_client):
+    assert gateway_client.post("/batch", json={"requests": []}).status_code == 400
+    assert gateway_client.post("/batch", json={"requests": [{"path": "/batch"}]}).status_code == 400
+    assert gateway_client.post("/batch", json={"requests": [{"id": "a", "path": "/me", "depends_on": ["b"]}, {"id": "b", "path": "/me"}]}).status_code == 400
+    assert gateway_client.post("/batch", json={"requests": [{"path": "/me", "method": "PUT"}]}).status_code == 400
+
+def test_gateway_propagates_deadline(gateway_client):
+    import httpx
+    seen = []
+
+    def handler(request):
+        seen.append(int(request.headers["x-request-timeout-ms"]))
+        return httpx.Response(200, json={"orders": []})
+
+    with mock_upstreams(handler, "orders"):
+        gateway_client.get("/orders")
+        gateway_client.get("/orders", headers={"X-Request-Timeout-Ms": "1500"})
+    assert 0 < seen[0] <= 60000
+    assert 0 < seen[1] <= 1500
+    assert gateway_client.get("/orders", headers={"X-Request-Timeout-Ms": "0"}).status_code == 504
+
+def test_deadline_caps_outbound_timeouts():
+    from services.common import deadline
+    assert deadline.timeout(45.0) == 45.0 and deadline.outbound_headers() == {}
+    token = deadline._deadline.set(None)
+    try:
+        deadline.set_deadline(2.0)
+        assert deadline.timeout(45.0) <= 2.0
+        assert 0 < int(deadline.outbound_headers()[deadline.DEADLINE_HEADER]) <= 2000
+        deadline.set_deadline(-1)
+        assert deadline.expired()
+        with pytest.raises(Exception):
+            deadline.check_deadline()
+    finally:
+        deadline._deadline.reset(token)
+
+def test_gateway_passes_json_bytes_through(gateway_client):
+    import httpx
+    body = b'{"orders": [{"id": 1, "price": 12.50}],  "note": "\\u0441"}'
+
+    def handler(request):
+        if request.url.path == "/orders/7":
+            return httpx.Response(500, text="Internal Server Error")
+        return httpx.Response(200, content=body, headers={"content-type": "application/json", "set-cookie": "session=upstream"})
+
+    with mock_upstreams(handler, "orders"):
+        response = gateway_client.get("/orders")
+        failed = gateway_client.delete("/orders/7")
+    assert response.content == body          # not re-serialised: spacing and escapes are kept
+    assert response.headers["content-type"] == "application/json"
+    assert "set-cookie" not in response.headers
+    assert failed.status_code == 500 and failed.text == "Internal Server Error"
+
+def test_fast_json_response_matches_starlette():
+    from starlette.responses import JSONResponse
+    from gateway.responses import FastJSONResponse
+    content = {"email": "a@example.com", "role": "user", "is_verified": True, "name": "Олена", "n": [1, 2.5, None]}
+    assert FastJSONResponse(content).body == JSONResponse(content).body
+
+def test_single_process_mode_serves_in_process():
+    import httpx
+    from fastapi.testclient import TestClient
+    from services.common import transport
+    from gateway.main import upstreams
+    from gateway import single_process
+    for instances in upstreams.instances.values():
+        for instance in instances:
+            instance.breaker.record_success()
+    try:
+        with TestClient(single_process.app) as client:
+            assert isinstance(upstreams.client("orders")._transport, httpx.ASGITransport)
+            response = client.get("/calculate_price", params={"width": 10, "length": 10, "height": 10, "material": "PLA"})
+            assert response.status_code == 200
+            assert "price" in response.json()
+            assert "orders.upstream;dur=" in response.headers["Server-Timing"]
+            assert client.get("/info").status_code == 200
+    finally:
+        # Later tests expect the regular TCP clients
+        transport._transports.clear()
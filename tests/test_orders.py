@@ -1,3 +1,4 @@
+import os
 import pytest
 
 def test_health(orders_client):
@@ -5,6 +6,12 @@ def test_health(orders_client):
     assert response.status_code == 200
     assert response.json() == {"status": "ok", "service": "orders"}
 
+def test_metrics_use_route_templates(orders_client):
+    orders_client.delete("/orders/12345")
+    text = orders_client.get("/metrics").text
+    assert 'route="/orders/{order_id}",method="DELETE"' in text
+    assert "/orders/12345" not in text
+
 def test_create_order(orders_client):
     # Mock user dependency by setting a test header or similar if needed, 
     # but here we rely on dependency_overrides in conftest.py which might need more work if we use get_current_user.
@@ -43,3 +50,60 @@ def test_get_orders(orders_client):
     assert len(response.json()["orders"]) >= 1
     
     app.dependency_overrides.clear()
+
+def test_create_order_streams_file_to_disk(orders_client, monkeypatch, tmp_path):
+    from services.orders.security import get_current_user
+    from services.orders.main import app
+    import services.orders.main as orders_main
+    monkeypatch.setattr(orders_main, "UPLOAD_DIR", str(tmp_path))
+    app.dependency_overrides[get_current_user] = lambda: "test@example.com"
+
+    model = b"solid cube\n" + b"facet normal 0 0 1\n" * 20000
+    response = orders_client.post(
+        "/create_order",
+        data={"description": "With model", "width": "10", "length": "10", "height": "10"},
+        files={"file": ("cube.stl", model, "model/stl")},
+    )
+    assert response.status_code == 200
+    saved = os.listdir(tmp_path)
+    assert len(saved) == 1 and saved[0].endswith("_cube.stl")
+    assert (tmp_path / saved[0]).read_bytes() == model
+
+    app.dependency_overrides.clear()
+
+def test_create_order_rejects_oversized_upload(orders_client, monkeypatch, tmp_path):
+    from services.orders.security import get_current_user
+    from services.orders.main import app
+    import services.orders.main as orders_main
+    import services.orders.uploads as uploads
+    monkeypatch.setattr(orders_main, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_SIZE", 1024)
+    app.dependency_overrides[get_current_user] = lambda: "test@example.com"
+
+    response = orders_client.post(
+        "/create_order",
+        data={"description": "Too big"},
+        files={"file": ("big.stl", b"x" * 4096, "model/stl")},
+    )
+    assert response.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+    app.dependency_overrides.clear()
+
+def test_create_order_validation_error_removes_upload(orders_client, monkeypatch, tmp_path):
+    from services.orders.security import get_current_user
+    from services.orders.main import app
+    import services.orders.main as orders_main
+    monkeypatch.setattr(orders_main, "UPLOAD_DIR", str(tmp_path))
+    app.dependency_overrides[get_current_user] = lambda: "test@example.com"
+
+    for field, value in (("width", "900"), ("real_weight", "-1"), ("infill", "150")):
+        response = orders_client.post(
+            "/create_order",
+            data={"description": "Out of range", field: value},
+            files={"file": ("model.stl", b"solid model", "model/stl")},
+        )
+        assert response.status_code == 400
+        assert os.listdir(tmp_path) == []
+
+    app.dependency_overrides.clear()